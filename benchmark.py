@@ -0,0 +1,289 @@
+"""Benchmarks for each stage of the submission pipeline, run offline against mock_server.py.
+
+    python benchmark.py [--sizes 1,10,100,1000,10000] [--output results.json]
+                        [--baseline baseline.json] [--threshold 0.25]
+
+For every batch size N this runs N vehicles through each stage on its own:
+- xml_prepare: parse the template and rewrite the IVI reference and VIN
+- encode: base64 and JSON request body
+- jwt_sign: sign a client assertion
+- token_fetch: full Maskinporten round trip
+- http_submit: Vegvesen POST round trip
+- sqlite_insert: store the response and document
+- sqlite_lookup: VIN lookup and document load
+
+It then submits the N vehicles end to end with submit_batch(). Per-operation p50/p99
+latencies and throughput are printed and optionally written as JSON. With --baseline,
+the exit status is 1 if any stage's p50 (or a batch's throughput) is worse than the
+baseline by more than the threshold.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+DEFAULT_SIZES = (1, 10, 100, 1000, 10000)
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xml_templates", "Example.xml")
+
+# Stands in for the template's placeholder so the documents pass ivi_validator
+TYPE_APPROVAL_NUMBER = "e1*2018/858*00001"
+
+# Network stages are sampled at most this many times per batch size
+NETWORK_SAMPLE_CAP = 1000
+# Slowdowns smaller than this (in ms) are treated as timer noise, whatever the ratio
+NOISE_FLOOR_MS = 0.05
+# Results from fewer samples than this are reported but not checked for regressions
+MIN_COMPARE_SAMPLES = 10
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples_s):
+    """Turn per-operation durations (seconds) into a result dict in milliseconds."""
+    total = sum(samples_s)
+    return {
+        "count": len(samples_s),
+        "p50_ms": percentile(samples_s, 0.50) * 1000,
+        "p99_ms": percentile(samples_s, 0.99) * 1000,
+        "mean_ms": total / len(samples_s) * 1000,
+        "ops_per_second": len(samples_s) / total if total > 0 else 0.0,
+    }
+
+
+def timed(fn, items):
+    """Call fn(item) for each item and return the list of durations in seconds."""
+    samples = []
+    clock = time.perf_counter
+    for item in items:
+        started = clock()
+        fn(item)
+        samples.append(clock() - started)
+    return samples
+
+
+def run_stages(svc, sp, template_text, size, tag):
+    """Benchmark each pipeline stage over size vehicles. Returns {stage: summary}."""
+    import http_session
+    from jose import jwt
+
+    vins = [f"BENCH{tag}{i:09d}"[:17] for i in range(size)]
+    refs = [svc.generate_ivi_ref_id() for _ in range(size)]
+    documents = {}
+
+    def prepare(i):
+        document = svc.IviDocument.from_string(template_text)
+        document.set_references(refs[i], vins[i])
+        documents[i] = document.to_string()
+
+    bodies = {}
+
+    def encode(i):
+        bodies[i] = svc.build_submit_request(
+            svc.IviDocument.from_string(documents[i]), refs[i], "0", "0", "0")[1]
+
+    signing_key, x5c = sp.load_key_material()
+    claims = {"aud": "https://maskinporten.no/", "iss": "bench", "scope": "svv:kjoretoy/ecoc",
+              "iat": int(time.time()), "exp": int(time.time()) + 60}
+
+    def sign(i):
+        jwt.encode({**claims, "jti": refs[i]}, signing_key, algorithm="RS256", headers={"x5c": x5c})
+
+    config = sp.load_config_from_db("Local") or {}
+
+    def fetch_token(i):
+        token, expires_in, error = sp._request_access_token("Local", config)
+        if error:
+            raise RuntimeError(f"Token fetch failed: {error}")
+
+    access_token, error = svc.get_access_token("Local")
+    if error:
+        raise RuntimeError(f"Token fetch failed: {error}")
+    session = http_session.get_session("Local")
+    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+    replies = {}
+
+    def submit(i):
+        response = session.post(svc.get_submit_url(), headers=headers, data=bodies[i],
+                                timeout=http_session.get_timeout())
+        if response.status_code != 200:
+            raise RuntimeError(f"Submit failed with HTTP {response.status_code}: {response.text}")
+        replies[i] = response.content
+
+    def insert(i):
+        content = replies.get(i) or json.dumps({
+            "iviIdentifikator": {"iviReferanse": refs[i], "understellsnummerMerke": {"understellsnummer": vins[i]}},
+            "datoTid": datetime.now().isoformat(timespec="milliseconds"),
+            "melding": {"meldingstekst": "OK"},
+        }).encode()
+        svc.handle_submit_response(200, content, documents[i])
+
+    def lookup(i):
+        if not svc.check_if_exists_in_database("vin", vins[i]) or svc.get_ividoc_by_vin(vins[i]) is None:
+            raise RuntimeError(f"{vins[i]} was not stored")
+
+    indexes = range(size)
+    network = range(min(size, NETWORK_SAMPLE_CAP))
+    return {
+        "xml_prepare": summarize(timed(prepare, indexes)),
+        "encode": summarize(timed(encode, indexes)),
+        "jwt_sign": summarize(timed(sign, indexes)),
+        "token_fetch": summarize(timed(fetch_token, network)),
+        "http_submit": summarize(timed(submit, network)),
+        "sqlite_insert": summarize(timed(insert, indexes)),
+        "sqlite_lookup": summarize(timed(lookup, indexes)),
+    }
+
+
+def run_end_to_end(svc, template_text, size, tag, directory, workers):
+    """Write size XML files and submit them with submit_batch(). Returns a summary dict."""
+    batch_dir = os.path.join(directory, f"batch-{tag}")
+    os.makedirs(batch_dir)
+    for i in range(size):
+        vin = f"E2E{tag}{i:013d}"
+        with open(os.path.join(batch_dir, f"{vin}.xml"), "w", encoding="utf-16") as f:
+            f.write(template_text.replace("WILL_BE_FILLED_IN_FROM_SOFTWARE", vin)
+                    .replace("THE_NGN_TYPE_APPROVALNUMBER", TYPE_APPROVAL_NUMBER))
+
+    vehicles = svc.load_batch(batch_dir)
+    summary = svc.submit_batch(vehicles, max_workers=workers, write_back=False)
+    latencies = [r["elapsed"] for r in summary["results"]]
+    return {
+        **summarize(latencies),
+        "vehicles": size,
+        "submitted": summary["submitted"],
+        "failed": summary["failed"],
+        "elapsed_s": summary["elapsed"],
+        "vehicles_per_second": summary["per_second"],
+    }
+
+
+def run(sizes, workers=4, latency=0.0, max_rate=None):
+    """Run all benchmarks in a scratch directory against a fresh mock server.
+
+    max_rate lifts retry_policy's adaptive rate limit (start and ceiling, requests/s),
+    which otherwise bounds end-to-end throughput.
+    """
+    import database
+    import ecoc_service as svc
+    import mock_server
+    import retry_policy
+    import samarbeidsportalen as sp
+
+    if max_rate:
+        retry_policy.configure(initial_rate=max_rate, max_rate=max_rate, burst=max(1, int(max_rate)))
+
+    results = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "workers": workers,
+            "mock_latency_s": latency,
+            "rate_limit": {"initial": retry_policy.INITIAL_RATE, "max": retry_policy.MAX_RATE},
+        },
+        "stages": {},
+        "batches": {},
+    }
+    template_text = svc.read_ivi_text(TEMPLATE)
+
+    previous_db = database.DB_PATH
+    with tempfile.TemporaryDirectory() as directory:
+        svc.set_database_path(os.path.join(directory, "bench.db"))
+        svc.create_database()
+        try:
+            with mock_server.mock_environment(directory, latency=latency):
+                for n, size in enumerate(sizes):
+                    tag = chr(ord("A") + n)
+                    results["stages"][str(size)] = run_stages(svc, sp, template_text, size, tag)
+                    results["batches"][str(size)] = run_end_to_end(
+                        svc, template_text, size, tag, directory, workers)
+        finally:
+            svc.set_database_path(previous_db)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regression messages relative to baseline."""
+    regressions = []
+    for size, stages in results["stages"].items():
+        for stage, current in stages.items():
+            before = baseline.get("stages", {}).get(size, {}).get(stage)
+            if not before or current["count"] < MIN_COMPARE_SAMPLES:
+                continue
+            limit = before["p50_ms"] * (1 + threshold)
+            if current["p50_ms"] > limit and current["p50_ms"] - before["p50_ms"] > NOISE_FLOOR_MS:
+                regressions.append(
+                    f"{stage} (N={size}): p50 {current['p50_ms']:.3f} ms vs baseline {before['p50_ms']:.3f} ms")
+    for size, current in results["batches"].items():
+        before = baseline.get("batches", {}).get(size)
+        if not before or current["count"] < MIN_COMPARE_SAMPLES:
+            continue
+        if current["vehicles_per_second"] < before["vehicles_per_second"] / (1 + threshold):
+            regressions.append(
+                f"end_to_end (N={size}): {current['vehicles_per_second']:.1f} vehicles/s "
+                f"vs baseline {before['vehicles_per_second']:.1f}")
+    return regressions
+
+
+def format_results(results):
+    lines = [f"{'stage':<14} {'N':>6} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>10}"]
+    for size, stages in results["stages"].items():
+        for stage, r in stages.items():
+            lines.append(f"{stage:<14} {size:>6} {r['p50_ms']:9.3f} {r['p99_ms']:9.3f} {r['ops_per_second']:10.0f}")
+        b = results["batches"][size]
+        lines.append(f"{'end_to_end':<14} {size:>6} {b['p50_ms']:9.3f} {b['p99_ms']:9.3f} "
+                     f"{b['vehicles_per_second']:10.1f}  ({b['submitted']}/{b['vehicles']} submitted)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the submission pipeline offline.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated batch sizes")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="submit_batch() workers")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock server latency in seconds")
+    parser.add_argument("--max-rate", type=float, default=None,
+                        help="Fix the client rate limit at this many requests/s (default: adaptive)")
+    parser.add_argument("-o", "--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown relative to the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    # ecoc_service reports progress with print(); keep stdout for the results
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = run(sizes, args.workers, args.latency, args.max_rate)
+
+    print(format_results(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""Shared SQLite connections for ecoc_service and samarbeidsportalen.
+
+Each thread gets one long-lived connection per database file, opened in WAL mode with
+synchronous=NORMAL and a busy timeout so batch workers and the GUI can write without
+blocking each other on the rollback journal. Use the connection as a context manager
+(``with get_connection() as conn:``) to commit on success and roll back on error.
+"""
+
+import sqlite3
+import threading
+
+DB_PATH = 'vegvesen_data.db'
+
+# Milliseconds a writer waits for a competing lock before raising "database is locked"
+BUSY_TIMEOUT_MS = 5000
+
+_local = threading.local()
+
+
+def set_database_path(path):
+    """Point all later connections at another database file."""
+    global DB_PATH
+    close_connection()
+    DB_PATH = path
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def get_connection(path=None):
+    """Return this thread's connection to path (default DB_PATH), opening it on first use."""
+    path = path or DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _open(path)
+    return conn
+
+
+def close_connection(path=None):
+    """Close this thread's connection(s); all of them when path is None."""
+    connections = getattr(_local, "connections", None) or {}
+    paths = [path] if path is not None else list(connections)
+    for name in paths:
+        conn = connections.pop(name, None)
+        if conn is not None:
+            conn.close()
@@ -22,6 +22,13 @@ a = Analysis(
     hiddenimports=[
         'ecoc_service',
         'samarbeidsportalen',
+        'http_session',
+        'retry_policy',
+        'telemetry',
+        'ivi_validator',
+        'xml_index',
+        'watch_folder',
+        'database',
         'pubkeygen',
     ],
     hookspath=[],
@@ -5,9 +5,11 @@ from tkinter import PhotoImage, messagebox, filedialog
 import tkinter as tk
 import logging
 import locale
-import time
+import multiprocessing
+import threading
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 
 # Windows-specific imports for taskbar
@@ -43,8 +45,14 @@ def center_window(window):
 def main_app():
 
     def on_closing():
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
         root.destroy()
 
+    # Network and disk work runs here; results come back to Tk via root.after
+    executor = ThreadPoolExecutor(max_workers=1)
+    cancel_event = threading.Event()
+
     # --- Main window setup ---
     root = ttk.Window()
     root.geometry('1500x1050')
@@ -319,7 +327,44 @@ def main_app():
 
     file_button = ttk.Button(
         frame1, text="Last inn XML fil", command=open_file_dialog, bootstyle='primary')
-    file_button.pack(pady=(10, 20))
+    file_button.pack(pady=(10, 4))
+
+    def find_file_by_vin():
+        """Fill in the newest indexed XML file for the VIN, scanning a chosen folder if none is known."""
+        import xml_index
+
+        vin = vin_entry.get().strip()
+        if not vin:
+            result_text.set("Skriv inn VIN for å finne XML filen.")
+            return
+
+        def show(files):
+            if not files:
+                result_text.set(f"Fant ingen XML fil for VIN: {vin}")
+                return
+            file_entry.delete(0, tk.END)
+            file_entry.insert(0, files[0]["path"])
+            registered = " (allerede registrert)" if files[0]["registered"] else ""
+            result_text.set(f"Fant {len(files)} fil(er) for VIN: {vin}{registered}")
+            set_response_text(xml_index.format_files(files))
+
+        files = xml_index.find_files(vin)
+        if files:
+            show(files)
+            return
+        directory = filedialog.askdirectory(title="Velg mappe å søke i")
+        if not directory:
+            return
+
+        def work():
+            xml_index.scan_directory(directory)
+            return xml_index.find_files(vin)
+
+        run_in_background(work, show, f"Indekserer XML filer i {directory}...")
+
+    find_file_button = ttk.Button(
+        frame1, text="Finn XML fra VIN", command=find_file_by_vin, bootstyle='secondary')
+    find_file_button.pack(pady=(0, 20))
 
     ivi_label = ttk.Label(frame1, text="IVI Referanse ID:")
     ivi_label.pack(anchor="center")
@@ -403,7 +448,7 @@ def main_app():
             result_text.set("File path or IVI Reference ID cannot be empty.")
             return
 
-        if svc.check_if_exists_in_database("ivi", iviref_uid) or svc.check_if_exists_in_database("vin", new_vin):
+        if svc.check_if_registered(iviref_uid, new_vin):
             result_text.set(
                 "IVI Reference ID or VIN already exists in the database.")
             return
@@ -414,24 +459,32 @@ def main_app():
             result_text.set("User cancelled the operation.")
             return
 
-        new_file_path = svc.update_ivi_reference_in_xml(file_path, iviref_uid)
-        svc.update_vehicle_identification_number(new_file_path, new_vin)
-        if not isinstance(new_file_path, str) or not new_file_path:
-            result_text.set("Failed to update XML.")
-            return
-
-        print(f"Debug: The new_file_path after updating is {new_file_path}")
-
-        status, response = svc.fetch_vegvesen_data(
-            new_file_path, iviref_uid,
-            avgiftskode_entry.get(),
-            sitteplasserNorskGodkjenning_entry.get(),
-            sengeplasserCampingbil_entry.get()
-        )
-        result_text.set(status)
-        set_response_text(response)
-        populate_table()
-        time.sleep(2)
+        avgiftskode = avgiftskode_entry.get()
+        sitteplasser = sitteplasserNorskGodkjenning_entry.get()
+        sengeplasser = sengeplasserCampingbil_entry.get()
+
+        def work():
+            document = svc.prepare_ivi_document(file_path, iviref_uid, new_vin)
+            if document is None:
+                return "Failed to update XML.", None
+            error = svc.validate_ivi_document(document)
+            if error:
+                return error, None
+
+            if cancel_event.is_set():
+                return "User cancelled the operation.", None
+            return svc.fetch_vegvesen_data(
+                document, iviref_uid, avgiftskode, sitteplasser, sengeplasser)
+
+        def done(result):
+            status, response = result
+            result_text.set(status)
+            if response is not None:
+                set_response_text(response)
+            if status == "HTTP Status Code: 200":
+                add_history_row(new_vin)
+
+        run_in_background(work, done, "Sender inn til Vegvesen...")
 
     # Send button - primary action, more prominent
     execute_button = ttk.Button(
@@ -449,6 +502,10 @@ def main_app():
             set_response_text("Ingen rader er valgt.")
             return
 
+        if len(selected_items) > 1:
+            delete_entries(selected_items)
+            return
+
         selected_item = table.selection()[0]
         vin_to_delete = table.item(selected_item, 'values')[1]
 
@@ -457,16 +514,44 @@ def main_app():
         if not confirm:
             return
 
-        success, status_code, pretty_response = svc.delete_vegvesen_entry(
-            vin_to_delete)
-        if success:
-            populate_table()
-            set_response_text(
-                f"Deleted entry with VIN: {vin_to_delete}\nServer Response: {pretty_response}")
-        else:
-            set_response_text(
-                f"Failed to delete entry with VIN: {vin_to_delete}. "
-                f"HTTP Status Code: {status_code}\nServer Response: {pretty_response}")
+        def done(result):
+            success, status_code, pretty_response = result
+            if success:
+                if table.exists(selected_item):
+                    table.delete(selected_item)
+                set_response_text(
+                    f"Deleted entry with VIN: {vin_to_delete}\nServer Response: {pretty_response}")
+            else:
+                set_response_text(
+                    f"Failed to delete entry with VIN: {vin_to_delete}. "
+                    f"HTTP Status Code: {status_code}\nServer Response: {pretty_response}")
+
+        run_in_background(
+            lambda: svc.delete_vegvesen_entry(vin_to_delete), done,
+            f"Sletter VIN: {vin_to_delete}...")
+
+    def delete_entries(selected_items):
+        """Delete all selected rows with one confirmation, several at a time."""
+        items_by_vin = {table.item(item, 'values')[1]: item for item in selected_items}
+        confirm = messagebox.askyesno(
+            "Bekreftelse", f"Sikker på at du vil slette {len(items_by_vin)} VIN fra Vegvesen?")
+        if not confirm:
+            return
+
+        def work():
+            return svc.delete_vegvesen_entries(
+                list(items_by_vin), cancel_event=cancel_event,
+                progress_callback=lambda done, total, result: progress.update(done=done, total=total))
+
+        def done(summary):
+            for result in summary["results"]:
+                item = items_by_vin.get(result["vin"])
+                if result["success"] and item and table.exists(item):
+                    table.delete(item)
+            result_text.set(f"Slettet {summary['submitted']}/{summary['total']} VIN")
+            set_response_text(svc.format_bulk_report(summary))
+
+        run_in_background(work, done, f"Sletter {len(items_by_vin)} VIN...")
 
     # Delete button - secondary action, danger styling
     delete_button = ttk.Button(
@@ -478,6 +563,155 @@ def main_app():
     )
     delete_button.pack(fill='x')
 
+    def execute_batch():
+        directory = filedialog.askdirectory(title="Velg mappe med XML filer")
+        if not directory:
+            return
+
+        # Read the entries here; Tk widgets must not be touched from the worker thread
+        defaults = {
+            "avgiftskode": avgiftskode_entry.get(),
+            "sitteplasser": sitteplasserNorskGodkjenning_entry.get(),
+            "sengeplasser": sengeplasserCampingbil_entry.get(),
+        }
+
+        def load():
+            # Reading every XML file can take a while for large folders
+            return svc.load_batch(directory, **defaults)
+
+        def confirm(vehicles):
+            if not vehicles:
+                result_text.set("Fant ingen XML filer i mappen.")
+                return
+
+            user_response = messagebox.askyesno(
+                "Confirmation",
+                f"Sende inn {len(vehicles)} kjøretøy fra {directory}? Ja eller Nei")
+            if not user_response:
+                result_text.set("User cancelled the operation.")
+                return
+
+            def work():
+                # Queue everything first so an interrupted batch resumes on the next start
+                queued = svc.enqueue_submissions(vehicles, write_back=True)
+                skipped = [(vehicle, error) for vehicle, ivi, error in queued if error]
+                return skipped, drain_outbox_work()
+
+            def done(outcome):
+                skipped, summary = outcome
+                show_outbox_summary(summary)
+                if skipped:
+                    set_response_text(svc.format_batch_summary(summary) + "\n\nIkke lagt i kø:\n" + "\n".join(
+                        f"{os.path.basename(vehicle['file'])}: {error}" for vehicle, error in skipped))
+
+            run_in_background(work, done, f"Sender inn {len(vehicles)} kjøretøy...")
+
+        run_in_background(load, confirm, "Leser XML filer...")
+
+    def drain_outbox_work():
+        return svc.drain_outbox(
+            cancel_event=cancel_event,
+            progress_callback=lambda done, total, result: progress.update(done=done, total=total))
+
+    def show_outbox_summary(summary):
+        counts = svc.get_outbox_counts()
+        status = f"Batch: {summary['submitted']}/{summary['total']} sendt inn"
+        if counts.get(svc.OUTBOX_PENDING):
+            status += f", {counts[svc.OUTBOX_PENDING]} venter i kø"
+        if counts.get(svc.OUTBOX_FAILED):
+            status += f", {counts[svc.OUTBOX_FAILED]} feilet"
+        if counts.get(svc.OUTBOX_UNKNOWN):
+            status += f", {counts[svc.OUTBOX_UNKNOWN]} uten svar (sjekk hos Vegvesen)"
+        result_text.set(status)
+        set_response_text(svc.format_batch_summary(summary))
+        populate_table()
+
+    def resume_outbox():
+        """Offer to send submissions left in the outbox for this environment by an earlier, interrupted run."""
+        environment = svc.get_environment()
+        pending = svc.recover_outbox(environment)
+        if pending and messagebox.askyesno(
+                "Confirmation",
+                f"{pending} innsending(er) fra en tidligere kjøring venter i køen for {environment}.\n\n"
+                f"Vil du sende dem til {environment} nå?"):
+            run_in_background(drain_outbox_work, show_outbox_summary,
+                              f"Gjenopptar {pending} innsending(er) fra køen...")
+
+    # Batch button - submit a whole folder or manifest with one confirmation
+    batch_button = ttk.Button(
+        button_container,
+        text="⇪ Send inn mappe (batch)",
+        command=execute_batch,
+        bootstyle='info',
+        width=30
+    )
+    batch_button.pack(pady=(8, 0), fill='x')
+
+    # --- Progress / cancel for background work ---
+
+    progress_frame = ttk.Frame(button_container)
+    progress_bar = ttk.Progressbar(progress_frame, mode='indeterminate', bootstyle='info')
+    progress_bar.pack(side=tk.LEFT, fill='x', expand=True, padx=(0, 8))
+
+    def on_cancel():
+        cancel_event.set()
+        result_text.set("Avbryter...")
+
+    cancel_button = ttk.Button(
+        progress_frame, text="Avbryt", command=on_cancel, bootstyle='secondary')
+    cancel_button.pack(side=tk.RIGHT)
+
+    # Disabled while background work runs; the environment selector is added below
+    busy_buttons = [execute_button, delete_button, batch_button, find_file_button]
+    # Written by the worker thread, read by check_progress on the Tk thread
+    progress = {}
+    # The task run_in_background is waiting on; only one runs at a time
+    background = {}
+
+    def set_busy(busy, message=""):
+        for button in busy_buttons:
+            button.config(state=tk.DISABLED if busy else tk.NORMAL)
+        if busy:
+            result_text.set(message)
+            progress.clear()
+            progress_bar.config(mode='indeterminate', value=0)
+            progress_bar.start(10)
+            progress_frame.pack(pady=(8, 0), fill='x')
+        else:
+            progress_bar.stop()
+            progress_frame.pack_forget()
+
+    def run_in_background(work, on_done, message):
+        """Run work() on the executor and pass its result to on_done() on the Tk thread."""
+        running = background.get('future')
+        if running is not None and not running.done():
+            logging.warning(f"Ignored '{message}' while another task is running")
+            return
+        cancel_event.clear()
+        set_busy(True, message)
+        future = background['future'] = executor.submit(work)
+
+        def check_progress():
+            if not future.done():
+                if progress.get('total'):
+                    progress_bar.stop()
+                    progress_bar.config(mode='determinate', maximum=progress['total'],
+                                        value=progress['done'])
+                    result_text.set(f"{message} {progress['done']}/{progress['total']}")
+                root.after(100, check_progress)
+                return
+
+            set_busy(False)
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Background task failed: {e}")
+                result_text.set(f"Error: {e}")
+                return
+            on_done(result)
+
+        root.after(100, check_progress)
+
     # ==================== Frame 3: Table & Response ====================
 
     table_and_search_frame = ttk.Frame(frame3)
@@ -489,7 +723,8 @@ def main_app():
     table = ttk.Treeview(table_and_search_frame, height=30,
                          columns=("iviReferanse", "understellsnummer",
                                   "datoTid", "meldingstekst"),
-                         yscrollcommand=table_scrollbar.set, show='headings')
+                         yscrollcommand=lambda first, last: on_table_scroll(first, last),
+                         show='headings')
     table.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
     table.heading("iviReferanse", text="IVI Reference")
@@ -511,14 +746,26 @@ def main_app():
     search_entry = ttk.Entry(search_frame, width=10)
     search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
-    def on_search():
-        for row in table.get_children():
-            table.delete(row)
-        for row in svc.search_responses(search_entry.get()):
-            if all(row):
-                formatted_date = svc.format_date(row[2])
-                table.insert('', tk.END, values=(
-                    row[0], row[1], formatted_date, row[3]))
+    def on_search(event=None):
+        term = search_entry.get().strip()
+        if not term:
+            populate_table()
+            return
+        table.delete(*table.get_children())
+        history['cursor'] = None
+        for rowid, *values in svc.search_registrations(term):
+            table.insert('', tk.END, iid=str(rowid), values=values)
+
+    # Search as you type, once typing pauses
+    search_job = {'id': None}
+
+    def on_search_key(event):
+        if search_job['id'] is not None:
+            root.after_cancel(search_job['id'])
+        search_job['id'] = root.after(150, on_search)
+
+    search_entry.bind('<KeyRelease>', on_search_key)
+    search_entry.bind('<Return>', on_search)
 
     search_button = ttk.Button(search_frame, bootstyle="warning",
                                text="Søk", command=on_search)
@@ -556,6 +803,7 @@ def main_app():
     ividoc_scrollbar.config(command=ividoc_text.yview)
 
     def set_response_text(text):
+        text = str(text)  # Vegvesen responses are only formatted when shown
         response_text.config(state=tk.NORMAL)
         response_text.delete(1.0, tk.END)
         response_text.tag_configure(
@@ -571,16 +819,32 @@ def main_app():
         response_text.insert(tk.END, "\n".join(text.split("\n")[1:]))
         response_text.config(state=tk.DISABLED)
 
+    # Keyset cursor of the last loaded history page; None when everything is loaded
+    history = {'cursor': None}
+
+    def load_next_page():
+        rows, history['cursor'] = svc.get_responses_page(history['cursor'])
+        for rowid, *values in rows:
+            if not table.exists(str(rowid)):
+                table.insert('', tk.END, iid=str(rowid), values=values)
+
     def populate_table():
-        for row in table.get_children():
-            table.delete(row)
-        for row in svc.get_all_responses():
-            if all(row):
-                formatted_date = svc.format_date(row[2])
-                table.insert('', tk.END, values=(
-                    row[0], row[1], formatted_date, row[3]))
-            else:
-                print("Skipping row with empty or None fields.")
+        """Reset the table to the first page of history."""
+        table.delete(*table.get_children())
+        history['cursor'] = None
+        load_next_page()
+
+    def add_history_row(vin):
+        """Show a newly stored registration at the top without reloading the table."""
+        row = svc.get_history_row_by_vin(vin)
+        if row and not table.exists(str(row[0])):
+            table.insert('', 0, iid=str(row[0]), values=row[1:])
+
+    def on_table_scroll(first, last):
+        table_scrollbar.set(first, last)
+        # Fetch the next page once the user scrolls near the bottom
+        if history['cursor'] is not None and float(last) >= 0.95:
+            load_next_page()
 
     def on_table_select(event):
         try:
@@ -643,6 +907,14 @@ def main_app():
         variable=env_var, value="Production", command=on_env_change, bootstyle='danger')
     env_prod_rb.pack(side='left', padx=(0, 20), pady=5)
 
+    env_local_rb = ttk.Radiobutton(
+        env_frame, text="Local (mock_server.py)",
+        variable=env_var, value="Local", command=on_env_change, bootstyle='secondary')
+    env_local_rb.pack(side='left', padx=(0, 20), pady=5)
+
+    # Running work keeps the environment it started with; don't let it change underneath
+    busy_buttons.extend((env_test_rb, env_prod_rb, env_local_rb))
+
     env_status_label = ttk.Label(env_frame, text=f"Active: {svc.get_environment()}",
                                  bootstyle='success')
     env_status_label.pack(side='left', padx=10, pady=5)
@@ -768,11 +1040,14 @@ def main_app():
     p12_import_button.pack(pady=(10, 10))
 
     # --- Startup ---
-    svc.create_database()
+    svc.initialize()
     populate_table()
+    resume_outbox()
     center_window(root)
     root.mainloop()
 
 
 if __name__ == '__main__':
+    # The XML scanner uses a process pool; frozen Windows builds need this to start workers
+    multiprocessing.freeze_support()
     main_app()
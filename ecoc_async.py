@@ -0,0 +1,202 @@
+"""asyncio client for submitting to and deleting from Vegvesen concurrently.
+
+Needs aiohttp, which is an optional extra: install with `pip install easy-ecoc-ce[async]`
+(or `uv sync --extra async`).
+"""
+
+import asyncio
+import logging
+
+import aiohttp
+
+import ecoc_service as svc
+import http_session
+import retry_policy
+import telemetry
+from samarbeidsportalen import get_access_token, get_cached_access_token
+
+# Requests in flight at once, across all hosts
+MAX_CONCURRENCY = 100
+# Open connections per host (Vegvesen and Maskinporten are separate hosts)
+PER_HOST_LIMIT = 20
+
+
+def request_not_sent(error):
+    """True when an aiohttp error shows the request never reached the server (see http_session)."""
+    return isinstance(error, aiohttp.ClientConnectorError)
+
+
+class AsyncVegvesenClient:
+    """Run many submissions and deletes concurrently from a single event loop.
+
+    Use as an async context manager. All requests share one connection pool and one
+    cached Maskinporten token; request bodies and response handling are the same as
+    in fetch_vegvesen_data() and delete_vegvesen_entry(), including retries and the
+    per-environment rate limit from retry_policy.
+    """
+
+    def __init__(self, environment=None, max_concurrency=MAX_CONCURRENCY,
+                 per_host_limit=PER_HOST_LIMIT, submit_url=None, delete_url=None):
+        self.environment = environment or svc.get_environment()
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.submit_url = submit_url or svc.get_submit_url(self.environment)
+        self.delete_url = delete_url or svc.get_delete_url(self.environment)
+        self._session = None
+        self._semaphore = None
+        self._token_lock = None
+
+    async def __aenter__(self):
+        connect_timeout, read_timeout = http_session.get_timeout()
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency, limit_per_host=self.per_host_limit)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._token_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_access_token(self):
+        """Return (access_token, error) from the shared cache, refreshing at most once for all waiting tasks."""
+        access_token = get_cached_access_token(self.environment)
+        if access_token:
+            return access_token, None
+
+        async with self._token_lock:
+            access_token = get_cached_access_token(self.environment)
+            if access_token:
+                return access_token, None
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, get_access_token, self.environment)
+
+    async def _request(self, method, url, before_attempt=None, retryable=None, **kwargs):
+        """Send with retry_policy's backoff and the environment's shared rate limiter.
+
+        before_attempt and retryable work as in retry_policy.call_with_retry(); the blocking
+        before_attempt(attempt) runs in the default executor. Returns (status_code,
+        body_bytes, error); status_code is None when no response arrived, and all three are
+        None when before_attempt stopped the call.
+        """
+        limiter = retry_policy.get_limiter(self.environment)
+        loop = asyncio.get_running_loop()
+        status_code = content = error = retry_after = None
+        for attempt in range(retry_policy.MAX_ATTEMPTS):
+            if attempt:
+                telemetry.increment("retries", environment=self.environment,
+                                    reason=str(status_code) if status_code else type(error).__name__)
+                await asyncio.sleep(retry_policy.backoff_delay(attempt, retry_after))
+            if before_attempt is not None and await loop.run_in_executor(None, before_attempt, attempt):
+                return None, None, None
+            wait = limiter.reserve()
+            if wait > 0:
+                telemetry.record("ratelimit.wait", wait)
+                await asyncio.sleep(wait)
+            try:
+                with telemetry.span("vegvesen.http", method=method, environment=self.environment) as span:
+                    async with self._session.request(method, url, **kwargs) as response:
+                        status_code, content, error = response.status, await response.read(), None
+                        retry_after = retry_policy.parse_retry_after(response.headers.get("Retry-After"))
+                    span["status"] = status_code
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status_code, content, error, retry_after = None, None, e, None
+                if retryable is not None and not retryable(e):
+                    break
+                continue
+
+            if status_code == 429:
+                telemetry.increment("throttled", environment=self.environment)
+                limiter.on_throttled(retry_after)
+            elif not retry_policy.should_retry(status_code):
+                limiter.on_success()
+                break
+        return status_code, content, error
+
+    async def submit(self, file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser):
+        """Async fetch_vegvesen_data(). Returns (status_str, response) like the sync version."""
+        async with self._semaphore:
+            access_token, error = await self.get_access_token()
+            if error:
+                return svc.token_failure(error)
+
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            loop = asyncio.get_running_loop()
+            ivi_document, data_json = await loop.run_in_executor(
+                None, svc.build_submit_request,
+                file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser)
+
+            def already_registered(attempt):
+                # Retries resend the same iviReferanse; never send one that is already stored
+                return svc.check_if_exists_in_database("ivi", iviref_uid)
+
+            # As in the sync client, only a POST that cannot have reached Vegvesen is resent
+            status_code, content, error = await self._request(
+                "POST", self.submit_url, before_attempt=already_registered,
+                retryable=request_not_sent, headers=headers, data=data_json)
+            if status_code is None and error is None:
+                return "Already registered.", f"IVI reference {iviref_uid} is already registered."
+            if status_code is None:
+                logging.error(f"Request to Vegvesen failed: {error}")
+                if not request_not_sent(error):
+                    return "Outcome unknown.", (f"{error}\nThe request may have reached Vegvesen. Check whether "
+                                                f"IVI reference {iviref_uid} is registered before submitting it again.")
+                return "Request to Vegvesen failed.", str(error)
+
+        return await loop.run_in_executor(
+            None, svc.handle_submit_response, status_code, content, ivi_document)
+
+    async def delete(self, vin):
+        """Async delete_vegvesen_entry(). Returns (success, status_code, pretty_response)."""
+        async with self._semaphore:
+            access_token, error = await self.get_access_token()
+            if error:
+                return False, None, "\n".join(svc.token_failure(error))
+
+            headers = {'Authorization': f'Bearer {access_token}'}
+            status_code, content, error = await self._request(
+                "DELETE", f"{self.delete_url}/{vin}", headers=headers)
+            if status_code is None:
+                logging.error(f"Request to Vegvesen failed: {error}")
+                return False, None, f"Request to Vegvesen failed: {error}"
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, svc.handle_delete_response, vin, status_code, content.decode('utf-8', 'replace'))
+
+    async def submit_many(self, submissions):
+        """Submit (file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser) tuples concurrently.
+
+        Returns results in input order.
+        """
+        return await asyncio.gather(*(self.submit(*args) for args in submissions))
+
+    async def delete_many(self, vins):
+        """Delete many VINs concurrently. Returns results in input order."""
+        return await asyncio.gather(*(self.delete(vin) for vin in vins))
+
+
+def submit_many(submissions, **client_kwargs):
+    """Blocking helper: run AsyncVegvesenClient.submit_many() in a fresh event loop."""
+    async def _run():
+        async with AsyncVegvesenClient(**client_kwargs) as client:
+            return await client.submit_many(submissions)
+    return asyncio.run(_run())
+
+
+def delete_many(vins, **client_kwargs):
+    """Blocking helper: run AsyncVegvesenClient.delete_many() in a fresh event loop."""
+    async def _run():
+        async with AsyncVegvesenClient(**client_kwargs) as client:
+            return await client.delete_many(vins)
+    return asyncio.run(_run())
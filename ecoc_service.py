@@ -1,21 +1,41 @@
 """Business logic for Easy eCoC — API, database, XML, and crypto operations."""
 
 import base64
+import codecs
+import csv
+import hashlib
 import json
 import logging
+import os
+import re
 import sqlite3
+import time
 import uuid
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
 
-import requests
-import pyperclip
 import xml.etree.ElementTree as ET
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization, asymmetric
-from cryptography.hazmat.primitives.serialization import pkcs12
-from jose import jwk
 
-from samarbeidsportalen import get_access_token
+# requests, cryptography, jose and pyperclip are imported inside the functions that need
+# them, so that a search or export does not pay for loading them at startup.
+import http_session
+import retry_policy
+import samarbeidsportalen
+import telemetry
+from database import get_connection, set_database_path
+from samarbeidsportalen import (get_access_token, invalidate_key_material,
+                                invalidate_token_cache)
+
+_API_PATH = "/ws/no/vegvesen/kjoretoy/felles/innmelding/meldingompreregistrering/v1"
+
+
+def _environment_urls(base_url):
+    return {
+        "submit": f"{base_url}{_API_PATH}/opprette",
+        "delete": f"{base_url}{_API_PATH}/slette/understellsnummer",
+    }
+
 
 # Environment URLs
 _ENVIRONMENTS = {
@@ -27,6 +47,8 @@ _ENVIRONMENTS = {
         "submit": "https://www.vegvesen.no/ws/no/vegvesen/kjoretoy/felles/innmelding/meldingompreregistrering/v1/opprette",
         "delete": "https://www.vegvesen.no/ws/no/vegvesen/kjoretoy/felles/innmelding/meldingompreregistrering/v1/slette/understellsnummer",
     },
+    # Offline mock of Vegvesen and Maskinporten, see mock_server.py
+    "Local": _environment_urls(samarbeidsportalen.LOCAL_BASE_URL),
 }
 
 _current_environment = "Production"
@@ -40,65 +62,200 @@ def set_environment(env_name):
     global _current_environment
     if env_name not in _ENVIRONMENTS:
         raise ValueError(f"Unknown environment: {env_name}")
+    if env_name != _current_environment:
+        # Drop keep-alive connections to the hosts we are leaving
+        http_session.close_sessions(_current_environment)
     _current_environment = env_name
     print(f"Environment switched to: {env_name}")
     print(f"  Submit URL: {_ENVIRONMENTS[env_name]['submit']}")
     print(f"  Delete URL: {_ENVIRONMENTS[env_name]['delete']}")
 
 
-def get_submit_url():
-    return _ENVIRONMENTS[_current_environment]["submit"]
+def set_local_base_url(base_url):
+    """Point the "Local" environment (Vegvesen and token endpoints) at another mock server."""
+    base_url = base_url.rstrip("/")
+    _ENVIRONMENTS["Local"] = _environment_urls(base_url)
+    samarbeidsportalen.TOKEN_ENDPOINTS["Local"] = f"{base_url}/token"
+    http_session.close_sessions("Local")
+    invalidate_token_cache("Local")
 
 
-def get_delete_url():
-    return _ENVIRONMENTS[_current_environment]["delete"]
+def get_submit_url(environment=None):
+    return _ENVIRONMENTS[environment or _current_environment]["submit"]
 
 
-DB_PATH = 'vegvesen_data.db'
+def get_delete_url(environment=None):
+    return _ENVIRONMENTS[environment or _current_environment]["delete"]
 
 
 # --- Database operations ---
 
+def initialize():
+    """Create the database tables and the certificate placeholder. Call once at startup.
+
+    Importing this module (or samarbeidsportalen) touches neither the database nor disk.
+    """
+    create_database()
+    samarbeidsportalen.create_certificate_placeholder()
+
+
 def create_database():
-    conn = None
+    samarbeidsportalen.create_database()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS responses (
-            iviReferanse TEXT,
-            understellsnummer TEXT,
-            datoTid TEXT,
-            meldingstekst TEXT,
-            IviDoc TEXT
-        )
-        """)
-        conn.commit()
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                iviReferanse TEXT,
+                understellsnummer TEXT,
+                datoTid TEXT,
+                meldingstekst TEXT,
+                IviDoc TEXT
+            )
+            """)
+            _migrate_responses_indexes(c)
+            _create_document_store(c)
+            _create_search_index(c)
+            _create_outbox(c)
+            _create_file_index(c)
+        _migrate_inline_ivi_documents()
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         logging.error(f"Database error: {e}")
-    finally:
-        if conn:
-            conn.close()
+
+
+def _migrate_responses_indexes(c):
+    """Add unique lookup indexes to responses. Safe to run on every start and on old databases.
+
+    If an existing database already holds duplicates, a plain index is created under the
+    same name instead, so lookups are still indexed and the migration does not fail.
+    """
+    for column in ("iviReferanse", "understellsnummer"):
+        index_name = f"idx_responses_{column}"
+        try:
+            c.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON responses ({column})")
+        except sqlite3.IntegrityError:
+            print(f"Duplicate {column} values in responses; creating non-unique index.")
+            logging.warning(
+                f"Duplicate {column} values in responses; {index_name} created without UNIQUE.")
+            c.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON responses ({column})")
+    # Keyset pagination of the history table walks this index (rowid breaks ties)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_responses_datoTid ON responses (datoTid)")
+
+
+def _create_document_store(c):
+    """Create the compressed IVI document tables and link them from responses."""
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS ivi_dictionaries (
+        hash TEXT PRIMARY KEY,
+        data BLOB NOT NULL
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS ivi_documents (
+        hash TEXT PRIMARY KEY,
+        dictionary_hash TEXT NOT NULL,
+        data BLOB NOT NULL
+    )
+    """)
+    c.execute("PRAGMA table_info(responses)")
+    columns = [col[1] for col in c.fetchall()]
+    if "ividoc_hash" not in columns:
+        c.execute("ALTER TABLE responses ADD COLUMN ividoc_hash TEXT")
+
+
+_SEARCH_INDEX_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS responses_fts_insert AFTER INSERT ON responses BEGIN
+        INSERT INTO responses_fts (rowid, iviReferanse, understellsnummer, meldingstekst)
+        VALUES (new.rowid, new.iviReferanse, new.understellsnummer, new.meldingstekst);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS responses_fts_delete AFTER DELETE ON responses BEGIN
+        INSERT INTO responses_fts (responses_fts, rowid, iviReferanse, understellsnummer, meldingstekst)
+        VALUES ('delete', old.rowid, old.iviReferanse, old.understellsnummer, old.meldingstekst);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS responses_fts_update
+    AFTER UPDATE OF iviReferanse, understellsnummer, meldingstekst ON responses BEGIN
+        INSERT INTO responses_fts (responses_fts, rowid, iviReferanse, understellsnummer, meldingstekst)
+        VALUES ('delete', old.rowid, old.iviReferanse, old.understellsnummer, old.meldingstekst);
+        INSERT INTO responses_fts (rowid, iviReferanse, understellsnummer, meldingstekst)
+        VALUES (new.rowid, new.iviReferanse, new.understellsnummer, new.meldingstekst);
+    END
+    """,
+)
+
+
+def _create_search_index(c):
+    """Create the trigram full-text index over responses and the triggers that maintain it.
+
+    Skipped (search falls back to LIKE) when SQLite is built without FTS5.
+    """
+    exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'responses_fts'").fetchone()
+    try:
+        c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS responses_fts USING fts5(
+            iviReferanse, understellsnummer, meldingstekst,
+            content='responses', content_rowid='rowid', tokenize='trigram'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        logging.warning(f"Full-text search unavailable, using LIKE: {e}")
+        return
+    for trigger in _SEARCH_INDEX_TRIGGERS:
+        c.execute(trigger)
+    if not exists:
+        # Index rows written before the search index existed
+        c.execute("INSERT INTO responses_fts (responses_fts) VALUES ('rebuild')")
+
+
+def _migrate_inline_ivi_documents(batch_size=500):
+    """Move IviDoc text left inline in responses by older versions into the document store."""
+    conn = get_connection()
+    moved = 0
+    while True:
+        with conn:
+            rows = conn.execute(
+                "SELECT rowid, IviDoc FROM responses WHERE IviDoc IS NOT NULL LIMIT ?",
+                (batch_size,)).fetchall()
+            for rowid, ivi_document in rows:
+                doc_hash = store_ivi_document(conn, ivi_document)
+                conn.execute(
+                    "UPDATE responses SET ividoc_hash = ?, IviDoc = NULL WHERE rowid = ?",
+                    (doc_hash, rowid))
+        moved += len(rows)
+        if len(rows) < batch_size:
+            break
+    if moved:
+        print(f"Moved {moved} IVI document(s) into the compressed document store.")
+        logging.info(f"Moved {moved} IVI document(s) into the compressed document store.")
+        # One-time: give the space held by the old inline documents back to the filesystem
+        conn.execute("VACUUM")
+        # VACUUM may renumber rowids, which the external-content search index refers to
+        with conn:
+            try:
+                conn.execute("INSERT INTO responses_fts (responses_fts) VALUES ('rebuild')")
+            except sqlite3.OperationalError:
+                pass
 
 
 def create_settings_table():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS settings
-                (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 username TEXT,
-                 password TEXT)''')
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS settings
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     username TEXT,
+                     password TEXT)''')
 
 
 def load_settings_from_db():
     """Load samarbeidsportalen settings for the current environment. Returns a dict or None."""
-    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        c = get_connection().cursor()
         c.execute(
             "SELECT issuer, audience, resource, scope, kid FROM samarbeidsportalen WHERE environment = ? LIMIT 1",
             (_current_environment,)
@@ -117,9 +274,6 @@ def load_settings_from_db():
         print(f"Database error: {e}")
         logging.error(f"Database error: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
 def save_settings_to_db(issuer, audience, resource, scope, kid=""):
@@ -131,80 +285,293 @@ def save_settings_to_db(issuer, audience, resource, scope, kid=""):
     if not resource:
         resource = "https://www.vegvesen.no"
 
-    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("DELETE FROM samarbeidsportalen WHERE environment = ?",
-                  (_current_environment,))
-        c.execute(
-            "INSERT INTO samarbeidsportalen "
-            "(environment, issuer, audience, resource, scope, kid) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (_current_environment, issuer, audience, resource, scope, kid)
-        )
-        conn.commit()
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM samarbeidsportalen WHERE environment = ?",
+                      (_current_environment,))
+            c.execute(
+                "INSERT INTO samarbeidsportalen "
+                "(environment, issuer, audience, resource, scope, kid) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (_current_environment, issuer, audience, resource, scope, kid)
+            )
         print(f"Settings saved for {_current_environment}.")
 
         from samarbeidsportalen import load_config_from_db
         load_config_from_db(_current_environment)
+        invalidate_token_cache(_current_environment)
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         logging.error(f"Database error: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
 def check_if_exists_in_database(type_of_id, value):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    c = get_connection().cursor()
     column_name = "iviReferanse" if type_of_id == "ivi" else "understellsnummer"
     c.execute(
-        f'SELECT COUNT(*) FROM responses WHERE {column_name} = ?', (value,))
-    exists = c.fetchone()[0]
-    conn.close()
-    return exists > 0
+        f'SELECT EXISTS(SELECT 1 FROM responses WHERE {column_name} = ?)', (value,))
+    return bool(c.fetchone()[0])
+
+
+def check_if_registered(iviref_uid, vin):
+    """Return True if either the IVI reference or the VIN is already stored. One indexed query."""
+    c = get_connection().cursor()
+    c.execute(
+        'SELECT EXISTS(SELECT 1 FROM responses WHERE iviReferanse = ? OR understellsnummer = ?)',
+        (iviref_uid, vin))
+    return bool(c.fetchone()[0])
+
+
+# Columns returned by listing queries; IVI documents are fetched separately
+_LIST_COLUMNS = "iviReferanse, understellsnummer, datoTid, meldingstekst"
 
 
 def get_all_responses():
-    """Return all rows from the responses table."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    rows = c.execute('SELECT * FROM responses').fetchall()
-    conn.close()
-    return rows
+    """Return (iviReferanse, understellsnummer, datoTid, meldingstekst) for all responses."""
+    return get_connection().execute(f'SELECT {_LIST_COLUMNS} FROM responses').fetchall()
+
+
+EXPORT_COLUMNS = ("iviReferanse", "understellsnummer", "datoTid", "meldingstekst")
+
+
+def export_responses(out, fmt="csv", include_documents=False):
+    """Write all responses, newest first, to the text file object out as "csv" or "json".
+
+    With include_documents each row also carries its IVI document XML. Rows are streamed
+    from the database, so large histories are not loaded into memory. Returns the row count.
+    """
+    conn = get_connection()
+    columns = list(EXPORT_COLUMNS) + (["IviDoc"] if include_documents else [])
+    rows = conn.execute(
+        "SELECT iviReferanse, understellsnummer, datoTid, meldingstekst, ividoc_hash, IviDoc "
+        "FROM responses ORDER BY datoTid DESC, rowid DESC")
+
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+    elif fmt != "json":
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    count = 0
+    for row in rows:
+        values = list(row[:4])
+        if include_documents:
+            values.append(load_ivi_document(conn, row[4]) if row[4] else row[5])
+        if fmt == "csv":
+            writer.writerow(values)
+        else:
+            out.write("[\n" if count == 0 else ",\n")
+            json.dump(dict(zip(columns, values)), out, ensure_ascii=False)
+        count += 1
+    if fmt == "json":
+        out.write("\n]\n" if count else "[]\n")
+    return count
 
 
 def search_responses(search_term):
-    """Search responses by iviReferanse or understellsnummer."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    rows = c.execute(
-        'SELECT * FROM responses WHERE iviReferanse LIKE ? OR understellsnummer LIKE ?',
-        (f"%{search_term}%", f"%{search_term}%")
-    ).fetchall()
-    conn.close()
-    return rows
+    """Search responses by iviReferanse, understellsnummer or meldingstekst."""
+    return [row[1:] for row in search_registrations(search_term, limit=SEARCH_MAX_RESULTS)]
+
+
+# Rows per history page; the GUI fetches the next page when scrolled to the bottom
+HISTORY_PAGE_SIZE = 200
+
+# History rows: (rowid, iviReferanse, understellsnummer, dato, meldingstekst), where dato is
+# datoTid cut to YYYY-MM-DD in SQL. Rows with empty fields are not listed.
+_HISTORY_SELECT = (
+    "SELECT rowid, iviReferanse, understellsnummer, substr(datoTid, 1, 10), meldingstekst, datoTid "
+    "FROM responses "
+    "WHERE iviReferanse <> '' AND understellsnummer <> '' AND datoTid <> '' AND meldingstekst <> ''"
+)
+
+
+def get_responses_page(cursor=None, limit=HISTORY_PAGE_SIZE):
+    """Return one page of history, newest first, using keyset pagination on (datoTid, rowid).
+
+    Pass the returned cursor back to get the next page. Returns (rows, next_cursor); next_cursor
+    is None when there are no more rows.
+    """
+    sql = _HISTORY_SELECT
+    params = []
+    if cursor is not None:
+        sql += " AND (datoTid, rowid) < (?, ?)"
+        params += [cursor[0], cursor[1]]
+    sql += " ORDER BY datoTid DESC, rowid DESC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = get_connection().execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][5], rows[-1][0])
+    return [row[:5] for row in rows], next_cursor
+
+
+# Default and maximum number of search hits returned
+SEARCH_LIMIT = 50
+SEARCH_MAX_RESULTS = 10000
+
+# The trigram tokenizer cannot match anything shorter than this
+_TRIGRAM_MIN_LENGTH = 3
+
+
+def _prefix_range(column, prefix):
+    return f" AND {column} >= ? AND {column} < ?", [prefix, prefix + "\uffff"]
+
+
+def search_registrations(search_term, limit=SEARCH_LIMIT):
+    """Search history rows by VIN prefix, partial IVI reference or message text.
+
+    VIN and IVI reference prefix hits rank first (index range scans), followed by trigram
+    full-text hits, newest first. Ordering full-text hits by rowid lets FTS5 stop after limit
+    matches instead of scoring every match, which keeps common words fast on large databases.
+    Returns rows in get_responses_page() format, at most limit of them.
+    """
+    term = (search_term or "").strip()
+    if not term:
+        return get_responses_page(limit=limit)[0]
+
+    conn = get_connection()
+    results = {}
+
+    def add(rows):
+        for row in rows:
+            if len(results) >= limit:
+                return
+            results.setdefault(row[0], row[:5])
+
+    for column, prefix in (("understellsnummer", term.upper()), ("iviReferanse", term.lower())):
+        sql, params = _prefix_range(column, prefix)
+        add(conn.execute(
+            _HISTORY_SELECT + sql + f" ORDER BY {column} LIMIT ?", params + [limit]).fetchall())
+
+    words = [w for w in term.split() if len(w) >= _TRIGRAM_MIN_LENGTH]
+    if words and len(results) < limit:
+        query = " ".join('"' + w.replace('"', '""') + '"' for w in words)
+        try:
+            rowids = [row[0] for row in conn.execute(
+                "SELECT rowid FROM responses_fts WHERE responses_fts MATCH ? ORDER BY rowid DESC LIMIT ?",
+                (query, limit + len(results)))]
+            if rowids:
+                placeholders = ",".join("?" * len(rowids))
+                rows = {row[0]: row for row in conn.execute(
+                    _HISTORY_SELECT + f" AND rowid IN ({placeholders})", rowids)}
+                add(rows[rowid] for rowid in rowids if rowid in rows)
+        except sqlite3.OperationalError:
+            # No FTS5 in this SQLite build: unindexed substring search
+            like = f"%{term}%"
+            add(conn.execute(
+                _HISTORY_SELECT + " AND (iviReferanse LIKE ? OR understellsnummer LIKE ? "
+                "OR meldingstekst LIKE ?) ORDER BY datoTid DESC LIMIT ?",
+                (like, like, like, limit)).fetchall())
+
+    return list(results.values())
+
+
+def get_history_row_by_vin(vin):
+    """Return the history row for a VIN in get_responses_page() format, or None."""
+    row = get_connection().execute(
+        _HISTORY_SELECT + " AND understellsnummer = ?", (vin,)).fetchone()
+    return row[:5] if row else None
 
 
 def get_ividoc_by_vin(vin):
     """Fetch the IVI document for a given VIN."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT ividoc FROM responses WHERE understellsnummer = ?", (vin,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT ividoc_hash, IviDoc FROM responses WHERE understellsnummer = ?", (vin,)).fetchone()
+    if not row:
+        return None
+    if row[0]:
+        return load_ivi_document(conn, row[0])
+    return row[1]
 
 
 def delete_response_by_vin(vin):
     """Delete a response row from the local database by VIN."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM responses WHERE understellsnummer = ?", (vin,))
-    conn.commit()
-    conn.close()
+    delete_responses_by_vins([vin])
+
+
+def delete_responses_by_vins(vins):
+    """Delete the response rows for many VINs in one transaction."""
+    with get_connection() as conn:
+        for vin in vins:
+            row = conn.execute(
+                "SELECT ividoc_hash FROM responses WHERE understellsnummer = ?", (vin,)).fetchone()
+            conn.execute("DELETE FROM responses WHERE understellsnummer = ?", (vin,))
+            if row and row[0]:
+                _delete_orphan_document(conn, row[0])
+
+
+# --- IVI document store ---
+#
+# Documents are stored once per content hash, zlib-compressed against a shared
+# dictionary. Documents rendered from the same template only differ in a few
+# values, so the dictionary (the first such document with its IVI reference and
+# VIN blanked out) is stored once and each document compresses to a few hundred bytes.
+
+_REFERENCE_ELEMENTS_RE = re.compile(
+    r"(<(IVIReferenceId|VehicleIdentificationNumber)>)[^<]*(</\2>)")
+
+# dictionary hash -> dictionary bytes
+_dictionary_cache = {}
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _get_dictionary(conn, dictionary_hash):
+    dictionary = _dictionary_cache.get(dictionary_hash)
+    if dictionary is None:
+        row = conn.execute(
+            "SELECT data FROM ivi_dictionaries WHERE hash = ?", (dictionary_hash,)).fetchone()
+        if row is None:
+            raise KeyError(f"Missing IVI dictionary {dictionary_hash}")
+        dictionary = _dictionary_cache[dictionary_hash] = zlib.decompress(row[0])
+    return dictionary
+
+
+def store_ivi_document(conn, ivi_document):
+    """Store an IVI document (deduplicated, compressed) inside the caller's transaction. Returns its hash."""
+    data = ivi_document.encode("utf-8")
+    doc_hash = _sha256(data)
+    if conn.execute("SELECT 1 FROM ivi_documents WHERE hash = ?", (doc_hash,)).fetchone():
+        return doc_hash
+
+    dictionary = _REFERENCE_ELEMENTS_RE.sub(r"\1\3", ivi_document).encode("utf-8")
+    dictionary_hash = _sha256(dictionary)
+    conn.execute(
+        "INSERT OR IGNORE INTO ivi_dictionaries (hash, data) VALUES (?, ?)",
+        (dictionary_hash, zlib.compress(dictionary, 9)))
+    _dictionary_cache.setdefault(dictionary_hash, dictionary)
+
+    compressor = zlib.compressobj(9, zdict=dictionary)
+    compressed = compressor.compress(data) + compressor.flush()
+    conn.execute(
+        "INSERT OR IGNORE INTO ivi_documents (hash, dictionary_hash, data) VALUES (?, ?, ?)",
+        (doc_hash, dictionary_hash, compressed))
+    return doc_hash
+
+
+def load_ivi_document(conn, doc_hash):
+    """Return the decompressed text of a stored IVI document, or None if it is missing."""
+    row = conn.execute(
+        "SELECT dictionary_hash, data FROM ivi_documents WHERE hash = ?", (doc_hash,)).fetchone()
+    if row is None:
+        return None
+    decompressor = zlib.decompressobj(zdict=_get_dictionary(conn, row[0]))
+    return (decompressor.decompress(row[1]) + decompressor.flush()).decode("utf-8")
+
+
+def _delete_orphan_document(conn, doc_hash):
+    # Outbox rows that may still be sent (failed ones can be requeued) keep their document
+    conn.execute(
+        "DELETE FROM ivi_documents WHERE hash = ? "
+        "AND NOT EXISTS (SELECT 1 FROM responses WHERE ividoc_hash = ?) "
+        "AND NOT EXISTS (SELECT 1 FROM outbox WHERE ividoc_hash = ? AND state IN (?, ?, ?))",
+        (doc_hash, doc_hash, doc_hash, OUTBOX_PENDING, OUTBOX_IN_FLIGHT, OUTBOX_FAILED))
 
 
 # --- Date formatting ---
@@ -222,32 +589,142 @@ def format_date(date_str):
 
 # --- XML operations ---
 
+def read_ivi_text(file_path):
+    """Read an IVI file as text. Files written by this app are UTF-16; templates are often UTF-8."""
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    if raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return raw.decode("utf-16")
+    return raw.decode("utf-8-sig")
+
+
+class IviDocument:
+    """An IVI XML document parsed once and edited in memory.
+
+    Update the references with set_references(), then either pass the document to
+    fetch_vegvesen_data() directly or save() it back to disk first.
+    """
+
+    def __init__(self, root, file_path=None):
+        self.root = root
+        self.file_path = file_path
+        self._text = None
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Parse an IVI file. Raises ET.ParseError on malformed XML."""
+        return cls.from_string(read_ivi_text(file_path), file_path)
+
+    @classmethod
+    def from_string(cls, text, file_path=None):
+        document = cls(ET.fromstring(text), file_path)
+        # Until the document is changed, serializing gives back the text it came from
+        document._text = text
+        return document
+
+    def _find(self, tag):
+        return next(self.root.iter(tag), None)
+
+    def _get(self, tag):
+        elem = self._find(tag)
+        return elem.text if elem is not None else None
+
+    @property
+    def vin(self):
+        return self._get("VehicleIdentificationNumber")
+
+    @property
+    def ivi_reference(self):
+        return self._get("IVIReferenceId")
+
+    def set_references(self, ivi_reference=None, vin=None):
+        """Set the first IVIReferenceId and/or VehicleIdentificationNumber element."""
+        for tag, value in (("IVIReferenceId", ivi_reference),
+                           ("VehicleIdentificationNumber", vin)):
+            if value is None:
+                continue
+            elem = self._find(tag)
+            if elem is not None:
+                elem.text = value
+        self._text = None
+
+    def to_string(self):
+        """Serialize the document the same way ElementTree.write(encoding='utf-16') does."""
+        if self._text is None:
+            self._text = ("<?xml version='1.0' encoding='utf-16'?>\n"
+                          + ET.tostring(self.root, encoding="unicode"))
+        return self._text
+
+    def save(self, file_path=None):
+        """Write the document as UTF-16 to file_path (default: where it was read from)."""
+        file_path = file_path or self.file_path
+        with open(file_path, "w", encoding="utf-16") as f:
+            f.write(self.to_string())
+        self.file_path = file_path
+        return file_path
+
+
+def _create_file_index(c):
+    """The xml_files table behind xml_index.py: fields scanned from XML files on disk.
+
+    Rows are keyed by path and are rescanned only when mtime_ns or size changes.
+    """
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS xml_files (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        vin TEXT,
+        ivi_reference TEXT,
+        category TEXT,
+        type_approval_number TEXT,
+        make TEXT,
+        commercial_name TEXT,
+        manufactured TEXT,
+        error TEXT,
+        scanned_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_xml_files_vin ON xml_files (vin)")
+
+
+def read_first_element_text(file_path, tag):
+    """Return the text of the first <tag> in an IVI file, or None, without building the whole tree.
+
+    Parsing stops at the first match and finished elements are cleared as it goes.
+    Files whose bytes do not match their declared encoding fall back to read_ivi_text().
+    Raises ET.ParseError on malformed XML.
+    """
+    with telemetry.span("xml.scan"):
+        try:
+            with open(file_path, "rb") as f:
+                for _, elem in ET.iterparse(f, events=("end",)):
+                    if elem.tag == tag:
+                        return elem.text
+                    elem.clear()
+            return None
+        except ET.ParseError:
+            return IviDocument.from_file(file_path)._get(tag)
+
+
 def read_vehicle_identification_number(file_path):
     try:
-        tree = ET.parse(file_path, parser=ET.XMLParser(encoding='utf-8'))
-        root = tree.getroot()
-        for elem in root.iter('VehicleIdentificationNumber'):
-            return elem.text
+        return read_first_element_text(file_path, "VehicleIdentificationNumber")
     except ET.ParseError as e:
         print(f"An error occurred while parsing the XML file: {e}")
         logging.error(f"An error occurred while parsing the XML file: {e}")
         return None
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Could not read the XML file {file_path}: {e}")
+        logging.error(f"Could not read the XML file {file_path}: {e}")
+        return None
 
 
 def update_ivi_reference_in_xml(file_path, new_ivi_ref):
     try:
-        with open(file_path, "r", encoding='utf-16-le') as f:
-            print(f.read(1000))
-
-        tree = ET.parse(file_path, parser=ET.XMLParser(encoding='utf-8'))
-        root = tree.getroot()
-
-        for elem in root.iter('IVIReferenceId'):
-            elem.text = new_ivi_ref
-            break
-
-        tree.write(file_path, encoding='utf-16')
-        return file_path
+        document = IviDocument.from_file(file_path)
+        document.set_references(ivi_reference=new_ivi_ref)
+        return document.save()
     except ET.ParseError as e:
         print(f"An error occurred while parsing the XML file: {e}")
         logging.error(f"An error occurred: {e}")
@@ -256,41 +733,82 @@ def update_ivi_reference_in_xml(file_path, new_ivi_ref):
 
 def update_vehicle_identification_number(file_path, new_vin):
     try:
-        tree = ET.parse(file_path, parser=ET.XMLParser(encoding='utf-8'))
-        root = tree.getroot()
-        for elem in root.iter('VehicleIdentificationNumber'):
-            elem.text = new_vin
-            break
-        tree.write(file_path, encoding='utf-16')
+        document = IviDocument.from_file(file_path)
+        document.set_references(vin=new_vin)
+        document.save()
     except ET.ParseError as e:
         logging.error(f"An error occurred while parsing the XML file: {e}")
         print(f"An error occurred while parsing the XML file: {e}")
 
 
-# --- Vegvesen API operations ---
+def prepare_ivi_document(file_path, iviref_uid, vin, write_back=True):
+    """Parse an IVI file once and set both references. Returns the IviDocument, or None on errors.
 
-def fetch_vegvesen_data(file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser):
-    """Submit vehicle data to Vegvesen. Returns (status_str, response_str)."""
-    print(f"Debug: The file_path is {file_path}")
+    With write_back the updated document is also saved over the original file. Malformed
+    XML, undecodable bytes and unreadable or unwritable files are logged and give None.
+    """
+    with telemetry.span("xml.prepare"):
+        try:
+            document = IviDocument.from_file(file_path)
+        except ET.ParseError as e:
+            print(f"An error occurred while parsing the XML file: {e}")
+            logging.error(f"An error occurred while parsing the XML file: {e}")
+            return None
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Could not read the XML file {file_path}: {e}")
+            logging.error(f"Could not read the XML file {file_path}: {e}")
+            return None
+        document.set_references(ivi_reference=iviref_uid, vin=vin)
+        if write_back:
+            try:
+                document.save()
+            except OSError as e:
+                print(f"Could not write the XML file {file_path}: {e}")
+                logging.error(f"Could not write the XML file {file_path}: {e}")
+                return None
+        return document
+
+
+def validate_ivi_document(document):
+    """Run the ivi_validator rules over a prepared IviDocument. Returns an error string, or None if valid.
+
+    Warnings are logged but do not block the submission.
+    """
+    if not VALIDATE_BEFORE_SUBMIT:
+        return None
+    import ivi_validator  # imports this module, so load it on first use
 
-    access_token = get_access_token(_current_environment)
+    with telemetry.span("xml.validate"):
+        issues = ivi_validator.get_validator().validate_root(document.root)
+    for issue in issues:
+        if issue.severity == ivi_validator.WARNING:
+            logging.info(f"Validation: {issue.message}")
+    if ivi_validator.has_errors(issues):
+        telemetry.increment("validation_failures")
+        errors = [issue.message for issue in issues if issue.severity == ivi_validator.ERROR]
+        return "Validation failed: " + " ".join(errors)
+    return None
 
-    if access_token is None:
-        logging.error("Could not get an access token.")
-        return "Could not get an access token.", None
 
-    if "error" in access_token:
-        return "Could not get an access token.", access_token
+# --- Vegvesen API operations ---
 
-    print("Access token retrieved successfully.")
+def token_failure(error):
+    """Log a get_access_token() error and return it as a (status, response) tuple."""
+    logging.error(f"Could not get an access token: {error}")
+    return "Could not get an access token.", error
 
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
 
-    with open(file_path, "r", encoding='utf-16') as f:
-        ivi_document = f.read()
+def build_submit_request(source, iviref_uid, avgiftskode, sitteplasser, sengeplasser):
+    """Build the submit body from an IVI file path or an IviDocument. Returns (ivi_document, data_json)."""
+    with telemetry.span("xml.encode"):
+        return _build_submit_request(source, iviref_uid, avgiftskode, sitteplasser, sengeplasser)
+
+
+def _build_submit_request(source, iviref_uid, avgiftskode, sitteplasser, sengeplasser):
+    if isinstance(source, IviDocument):
+        ivi_document = source.to_string()
+    else:
+        ivi_document = read_ivi_text(source)
 
     ivi_base64_encoded = base64.b64encode(ivi_document.encode()).decode()
 
@@ -306,79 +824,849 @@ def fetch_vegvesen_data(file_path, iviref_uid, avgiftskode, sitteplasser, sengep
         }
     }
 
-    data_json = json.dumps(data)
-    response = requests.post(get_submit_url(), headers=headers, data=data_json)
-    print(response)
-    print(f"Debug: Headers: {headers}")
-    print(f"Debug: HTTP Status Code: {response.status_code}")
-    print(f"Debug: Response Content: {response.content}")
-
-    if response.status_code == 200:
-        response_dict = json.loads(response.content)
-        iviReferanse = response_dict.get(
-            "iviIdentifikator", {}).get("iviReferanse", "")
-        understellsnummer = response_dict.get(
-            "iviIdentifikator", {}).get("understellsnummerMerke", {}).get("understellsnummer", "")
-        datoTid = response_dict.get("datoTid", "")
-        meldingstekst = response_dict.get(
-            "melding", {}).get("meldingstekst", "")
-
-        conn = None
+    return ivi_document, json.dumps(data)
+
+
+class VegvesenResponse:
+    """A Vegvesen reply: the raw body, its JSON parsed once, and the fields the app uses.
+
+    Nothing is pretty-printed until the response is shown: str() formats the body
+    (indented JSON, or the text as received) as "Vegvesen Response:\n...", once.
+    """
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content.encode("utf-8") if isinstance(content, str) else (content or b"")
+        self._data = None
+        self._parsed = False
+        self._formatted = None
+
+    @property
+    def ok(self):
+        return self.status_code == 200
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    @property
+    def data(self):
+        """The JSON body as a dict, or None if it is empty or not a JSON object."""
+        if not self._parsed:
+            self._parsed = True
+            try:
+                data = json.loads(self.content)
+                self._data = data if isinstance(data, dict) else None
+            except ValueError:  # JSONDecodeError, or bytes that are not UTF-8
+                self._data = None
+        return self._data
+
+    def _get(self, *keys):
+        value = self.data or {}
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        return value if isinstance(value, str) else ""
+
+    @property
+    def ivi_reference(self):
+        return self._get("iviIdentifikator", "iviReferanse")
+
+    @property
+    def vin(self):
+        return self._get("iviIdentifikator", "understellsnummerMerke", "understellsnummer")
+
+    @property
+    def timestamp(self):
+        return self._get("datoTid")
+
+    @property
+    def message(self):
+        return self._get("melding", "meldingstekst")
+
+    def pretty(self):
+        """The body as indented JSON, or as text if it is not JSON."""
+        if self.data is None:
+            return self.text
+        return json.dumps(self.data, ensure_ascii=False, indent=4)
+
+    def __str__(self):
+        if self._formatted is None:
+            self._formatted = f"Vegvesen Response:\n{self.pretty()}"
+        return self._formatted
+
+    def __repr__(self):
+        return f"<VegvesenResponse {self.status_code} {len(self.content)} bytes>"
+
+
+def handle_submit_response(status_code, content, ivi_document):
+    """Store a successful submission. Returns (status_str, VegvesenResponse); str() of the latter formats it."""
+    print(f"Debug: HTTP Status Code: {status_code}")
+    # The body repeats the vehicle data, so keep it out of the console
+    logging.debug(f"Response content: {content!r}")
+
+    response = VegvesenResponse(status_code, content)
+    if response.ok:
+        if response.data is None:
+            logging.error(f"Vegvesen returned a response that is not JSON: {response.text}")
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO responses (iviReferanse, understellsnummer, datoTid, meldingstekst, IviDoc) "
-                "VALUES (?, ?, ?, ?, ?)",
-                (iviReferanse, understellsnummer,
-                 datoTid, meldingstekst, ivi_document)
-            )
-            conn.commit()
-        except sqlite3.OperationalError as e:
+            with telemetry.span("db.store_response"), get_connection() as conn:
+                doc_hash = store_ivi_document(conn, ivi_document)
+                conn.execute(
+                    "INSERT INTO responses (iviReferanse, understellsnummer, datoTid, meldingstekst, ividoc_hash) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (response.ivi_reference, response.vin,
+                     response.timestamp, response.message, doc_hash)
+                )
+        except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
             print(f"SQLite error: {e}")
             logging.error(f"An error occurred: {e}")
-        finally:
-            if conn:
-                conn.close()
-    else:
-        return f"HTTP Status Code: {response.status_code}", f"Vegvesen Response:\n{response.content}"
 
-    try:
-        response_dict = json.loads(response.content)
-        pretty_response = json.dumps(
-            response_dict, ensure_ascii=False, indent=4)
-    except json.JSONDecodeError as e:
-        pretty_response = response.content.decode('utf-8')
-        logging.error(f"An error occurred: {e}")
+    return f"HTTP Status Code: {status_code}", response
 
-    return f"HTTP Status Code: {response.status_code}", f"Vegvesen Response:\n{pretty_response}"
 
+def handle_delete_response(vin, status_code, content):
+    """Remove a deleted VIN locally and format the reply. Returns (success, status_code, pretty_response).
 
-def delete_vegvesen_entry(vin):
+    content may be bytes or text, and need not be JSON.
+    """
+    response = VegvesenResponse(status_code, content)
+    if response.ok:
+        delete_response_by_vin(vin)
+    return response.ok, status_code, response.pretty()
+
+
+def _timed_http(method, environment, send):
+    """Wrap send() so each attempt is recorded as a vegvesen.http span with its status."""
+    def timed():
+        with telemetry.span("vegvesen.http", method=method, environment=environment) as span:
+            response = send()
+            span["status"] = response.status_code
+            return response
+    return timed
+
+
+def fetch_vegvesen_data(file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser, environment=None):
+    """Submit vehicle data to Vegvesen. Returns (status_str, response).
+
+    response is a VegvesenResponse whenever Vegvesen answered, whatever the status code;
+    when no answer was received (no token, network failure, already registered) it is a
+    plain message string. str() of either is fit for display.
+    file_path may also be an already prepared IviDocument, which avoids rereading the file.
+    The environment (default: the current one) is fixed for the whole call, so switching
+    environments meanwhile never sends one environment's token to another's URL.
+    """
+    environment = environment or _current_environment
+    with telemetry.span("submit.total", environment=environment, iviReferanse=iviref_uid) as span:
+        status, response = _fetch_vegvesen_data(
+            file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser, environment)
+        span["status"] = status
+    code = _status_code(status)
+    telemetry.increment("submissions", environment=environment,
+                        outcome=code if code is not None else status.rstrip("."))
+    return status, response
+
+
+def _fetch_vegvesen_data(file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser, environment):
+    print(f"Debug: The file_path is {file_path}")
+
+    access_token, error = get_access_token(environment)
+    if error:
+        return token_failure(error)
+
+    print("Access token retrieved successfully.")
+
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+
+    ivi_document, data_json = build_submit_request(
+        file_path, iviref_uid, avgiftskode, sitteplasser, sengeplasser)
+    session = http_session.get_session(environment)
+    url = get_submit_url(environment)
+    from requests import RequestException
+
+    def send():
+        return session.post(url, headers=headers, data=data_json,
+                            timeout=http_session.get_timeout())
+
+    def already_registered(attempt):
+        # Retries resend the same iviReferanse; never send one that is already stored
+        return check_if_exists_in_database("ivi", iviref_uid)
+
+    # A POST that may have reached Vegvesen is not resent: if it was accepted, the
+    # resend is rejected as a duplicate and the registration is never stored here
+    response, error = retry_policy.call_with_retry(
+        _timed_http("POST", environment, send), environment, RequestException, already_registered,
+        retryable=http_session.request_not_sent)
+    if response is None and error is None:
+        return "Already registered.", f"IVI reference {iviref_uid} is already registered."
+    if response is None:
+        logging.error(f"Request to Vegvesen failed: {error}")
+        if not http_session.request_not_sent(error):
+            return "Outcome unknown.", (f"{error}\nThe request may have reached Vegvesen. Check whether IVI "
+                                        f"reference {iviref_uid} is registered before submitting it again.")
+        return "Request to Vegvesen failed.", str(error)
+
+    return handle_submit_response(response.status_code, response.content, ivi_document)
+
+
+def delete_vegvesen_entry(vin, environment=None):
     """Delete an entry from Vegvesen by VIN. Returns (success, status_code, pretty_response)."""
-    access_token = get_access_token(_current_environment)
-    if access_token is None:
-        return False, None, "Could not get an access token."
+    environment = environment or _current_environment
+    access_token, error = get_access_token(environment)
+    if error:
+        return False, None, "\n".join(token_failure(error))
 
+    response, error = _send_delete(vin, access_token, environment)
+    if response is None:
+        return False, None, error
+    return handle_delete_response(vin, response.status_code, response.content)
+
+
+def _send_delete(vin, access_token, environment):
+    """DELETE one VIN at Vegvesen with retries. Returns (response, None) or (None, error message)."""
     headers = {'Authorization': f'Bearer {access_token}'}
-    url = f"{get_delete_url()}/{vin}"
-    response = requests.delete(url, headers=headers)
+    url = f"{get_delete_url(environment)}/{vin}"
+    session = http_session.get_session(environment)
+    from requests import RequestException
+    response, error = retry_policy.call_with_retry(
+        _timed_http("DELETE", environment,
+                    lambda: session.delete(url, headers=headers, timeout=http_session.get_timeout())),
+        environment, RequestException)
+    if response is None:
+        logging.error(f"Request to Vegvesen failed: {error}")
+        telemetry.increment("deletes", environment=environment, outcome="error")
+        return None, f"Request to Vegvesen failed: {error}"
+
+    telemetry.increment("deletes", environment=environment, outcome=response.status_code)
+    return response, None
+
+
+# --- Batch submission ---
+
+# Default number of vehicles submitted in parallel
+BATCH_WORKERS = 4
+
+# Run ivi_validator over each batch document before it is sent or queued
+VALIDATE_BEFORE_SUBMIT = True
+
+
+def load_batch_manifest(manifest_path):
+    """Read a CSV manifest with columns file, vin, avgiftskode, sitteplasser (and optional sengeplasser).
+
+    Relative file paths are resolved against the manifest's directory. An empty vin is
+    read from the XML file. Returns a list of vehicle dicts for submit_batch().
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    vehicles = []
+    with open(manifest_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+            if not row.get("file"):
+                continue
+            file_path = row["file"]
+            if not os.path.isabs(file_path):
+                file_path = os.path.join(base_dir, file_path)
+            vehicles.append({
+                "file": file_path,
+                "vin": row.get("vin") or read_vehicle_identification_number(file_path),
+                "avgiftskode": row.get("avgiftskode") or "0",
+                "sitteplasser": row.get("sitteplasser") or "0",
+                "sengeplasser": row.get("sengeplasser") or "0",
+            })
+    return vehicles
+
+
+def load_batch_directory(directory, avgiftskode="0", sitteplasser="0", sengeplasser="0"):
+    """Build a batch from every .xml file in a directory, reading the VIN from each file.
+
+    If the directory contains a manifest.csv, that manifest is used instead.
+    """
+    manifest_path = os.path.join(directory, "manifest.csv")
+    if os.path.isfile(manifest_path):
+        return load_batch_manifest(manifest_path)
+
+    vehicles = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".xml"):
+            continue
+        file_path = os.path.join(directory, name)
+        vehicles.append({
+            "file": file_path,
+            "vin": read_vehicle_identification_number(file_path),
+            "avgiftskode": avgiftskode,
+            "sitteplasser": sitteplasser,
+            "sengeplasser": sengeplasser,
+        })
+    return vehicles
+
+
+def load_batch(path, **defaults):
+    """Load a batch from either a directory of XML files or a CSV manifest."""
+    if os.path.isdir(path):
+        return load_batch_directory(path, **defaults)
+    return load_batch_manifest(path)
+
+
+def submit_vehicle(vehicle, cancel_event=None, write_back=True, environment=None):
+    """Assign an IVI reference, rewrite the XML and submit one batch vehicle. Returns a result dict.
+
+    If cancel_event (a threading.Event) is set before the vehicle starts, it is skipped.
+    Without write_back the rewritten XML is only submitted, not saved over the file.
+    """
+    result = {
+        "file": vehicle["file"],
+        "vin": vehicle.get("vin"),
+        "iviReferanse": None,
+        "success": False,
+        "status": None,
+        "response": None,
+        "elapsed": 0.0,
+    }
+    started = time.monotonic()
+    try:
+        if cancel_event is not None and cancel_event.is_set():
+            result["status"] = "Cancelled."
+            return result
+
+        vin = vehicle.get("vin")
+        if not vin:
+            result["status"] = "No VehicleIdentificationNumber found in XML."
+            return result
+        if check_if_exists_in_database("vin", vin):
+            result["status"] = "VIN already exists in the database."
+            return result
+
+        iviref_uid = generate_ivi_ref_id()
+        result["iviReferanse"] = iviref_uid
+
+        document = prepare_ivi_document(vehicle["file"], iviref_uid, vin, write_back)
+        if document is None:
+            result["status"] = "Failed to update XML."
+            return result
+        error = validate_ivi_document(document)
+        if error:
+            result["status"] = error
+            return result
+
+        status, response = fetch_vegvesen_data(
+            document, iviref_uid,
+            vehicle.get("avgiftskode", "0"),
+            vehicle.get("sitteplasser", "0"),
+            vehicle.get("sengeplasser", "0"),
+            environment,
+        )
+        result["status"] = status
+        result["response"] = response
+        result["success"] = status == "HTTP Status Code: 200"
+    except Exception as e:
+        logging.error(f"Batch submission of {vehicle['file']} failed: {e}")
+        result["status"] = f"Error: {e}"
+    finally:
+        result["elapsed"] = time.monotonic() - started
+    return result
+
+
+def submit_batch(vehicles, max_workers=BATCH_WORKERS, progress_callback=None, cancel_event=None,
+                 write_back=True):
+    """Submit many vehicles through a bounded worker pool.
+
+    progress_callback(done, total, result) is called from the calling thread as each
+    vehicle finishes. Setting cancel_event skips vehicles that have not started yet.
+    Returns a summary dict with per-vehicle results (in input order) and aggregate throughput.
+    """
+    total = len(vehicles)
+    results = [None] * total
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # Every vehicle goes to the environment that was current when the batch started
+        environment = _current_environment
+        futures = {executor.submit(submit_vehicle, vehicle, cancel_event, write_back, environment): i
+                   for i, vehicle in enumerate(vehicles)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results[futures[future]] = result
+            logging.info(f"Batch {done}/{total}: {result['file']} -> {result['status']}")
+            if progress_callback:
+                progress_callback(done, total, result)
+
+    return _batch_summary(results, time.monotonic() - started)
+
+
+def _batch_summary(results, elapsed):
+    submitted = sum(1 for r in results if r["success"])
+    return {
+        "results": results,
+        "total": len(results),
+        "submitted": submitted,
+        "failed": len(results) - submitted,
+        "elapsed": elapsed,
+        "per_second": submitted / elapsed if elapsed > 0 else 0.0,
+    }
 
-    server_response = response.text
-    pretty_server_response = json.dumps(json.loads(server_response), indent=4)
 
-    if response.status_code == 200:
-        delete_response_by_vin(vin)
-        return True, response.status_code, pretty_server_response
-    else:
-        return False, response.status_code, pretty_server_response
+def format_batch_summary(summary):
+    """Render a batch summary as text for display or logging."""
+    lines = [
+        f"Batch: {summary['submitted']}/{summary['total']} submitted, "
+        f"{summary['failed']} failed in {summary['elapsed']:.1f}s "
+        f"({summary['per_second']:.2f} vehicles/s)",
+        "",
+    ]
+    for r in summary["results"]:
+        mark = "OK  " if r["success"] else "FAIL"
+        lines.append(f"{mark} {r['vin'] or '-'}  {os.path.basename(r['file'])}  {r['status']}")
+    return "\n".join(lines)
+
+
+# --- Outbox ---
+#
+# Submissions are written to the outbox table before anything is sent, so a crash or
+# network drop never loses them. Each row moves pending -> in_flight -> done/failed and
+# is keyed by its iviReferanse, so resuming resends the same reference instead of
+# creating a new registration. A row whose request may have reached Vegvesen without an
+# answer (a read timeout, a reset connection) ends as unknown and is never resent.
+
+OUTBOX_PENDING = "pending"
+OUTBOX_IN_FLIGHT = "in_flight"
+OUTBOX_DONE = "done"
+OUTBOX_FAILED = "failed"
+OUTBOX_UNKNOWN = "unknown"
+
+# Transient failures (network, 429, 5xx) are retried this many times before a row is failed
+OUTBOX_MAX_ATTEMPTS = 5
+
+
+def _create_outbox(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        iviReferanse TEXT PRIMARY KEY,
+        understellsnummer TEXT NOT NULL,
+        file_path TEXT,
+        avgiftskode TEXT,
+        sitteplasser TEXT,
+        sengeplasser TEXT,
+        ividoc_hash TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_status TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+        environment TEXT
+    )
+    """)
+    # Rows queued before the column existed keep a NULL environment and are never sent
+    c.execute("PRAGMA table_info(outbox)")
+    if "environment" not in [col[1] for col in c.fetchall()]:
+        c.execute("ALTER TABLE outbox ADD COLUMN environment TEXT")
+    c.execute("DROP INDEX IF EXISTS idx_outbox_state")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_environment_state ON outbox (environment, state, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_ividoc_hash ON outbox (ividoc_hash)")
+
+
+def enqueue_submissions(vehicles, write_back=True):
+    """Prepare vehicles (see load_batch()) and queue them in one transaction.
+
+    Each vehicle gets a fresh IVI reference unless it already has an "iviReferanse". With
+    write_back, as in submit_vehicle(), the reference is also written into the file. The
+    rewritten document is stored with the queue row, so the sender does not need the file.
+    Rows are queued for the current environment and only sent while it is selected.
+    Returns a list of (vehicle, iviReferanse or None, error) tuples.
+    """
+    environment = _current_environment
+    queued = []
+    prepared = []
+    for vehicle in vehicles:
+        vin = vehicle.get("vin")
+        if not vin:
+            queued.append((vehicle, None, "No VehicleIdentificationNumber found in XML."))
+            continue
+        if check_if_exists_in_database("vin", vin):
+            queued.append((vehicle, None, "VIN already exists in the database."))
+            continue
+        iviref_uid = vehicle.get("iviReferanse") or generate_ivi_ref_id()
+        document = prepare_ivi_document(vehicle["file"], iviref_uid, vin, write_back)
+        if document is None:
+            queued.append((vehicle, None, "Failed to update XML."))
+            continue
+        error = validate_ivi_document(document)
+        if error:
+            queued.append((vehicle, None, error))
+            continue
+        prepared.append((vehicle, iviref_uid, document))
+        queued.append((vehicle, iviref_uid, None))
+
+    # Parse and validate everything first: the write lock is held only for the inserts,
+    # so a watch daemon sending from the same database is not locked out meanwhile
+    if prepared:
+        with get_connection() as conn:
+            for vehicle, iviref_uid, document in prepared:
+                _queue_document(conn, vehicle, iviref_uid, document, environment)
+    return queued
+
+
+def _queue_document(conn, vehicle, iviref_uid, document, environment):
+    """Store a prepared document and add its pending outbox row (inside the caller's transaction)."""
+    doc_hash = store_ivi_document(conn, document.to_string())
+    conn.execute(
+        "INSERT OR IGNORE INTO outbox (iviReferanse, understellsnummer, file_path, "
+        "avgiftskode, sitteplasser, sengeplasser, ividoc_hash, environment) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (iviref_uid, vehicle["vin"], vehicle["file"], vehicle.get("avgiftskode", "0"),
+         vehicle.get("sitteplasser", "0"), vehicle.get("sengeplasser", "0"), doc_hash, environment))
+
+
+def recover_outbox(environment=None):
+    """Resume after a crash: settle an environment's rows left in flight. Safe to call on every start.
+
+    Only rows queued for environment (default: the current one) are touched. Those whose
+    IVI reference is already stored in responses are marked done; the rest go back to
+    pending and will be resent with the same iviReferanse. Returns the pending count.
+    """
+    environment = environment or _current_environment
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE outbox SET state = ?, updated_at = datetime('now') WHERE state = ? AND environment = ? "
+            "AND EXISTS (SELECT 1 FROM responses WHERE responses.iviReferanse = outbox.iviReferanse)",
+            (OUTBOX_DONE, OUTBOX_IN_FLIGHT, environment))
+        conn.execute(
+            "UPDATE outbox SET state = ?, updated_at = datetime('now') WHERE state = ? AND environment = ?",
+            (OUTBOX_PENDING, OUTBOX_IN_FLIGHT, environment))
+    return get_outbox_counts(environment).get(OUTBOX_PENDING, 0)
+
+
+def _outbox_scope(environment, references=None):
+    """Return the condition and parameters selecting an environment's rows, or only references among them."""
+    sql, params = "environment = ?", [environment or _current_environment]
+    if references is not None:
+        sql += f" AND iviReferanse IN ({','.join('?' * len(references))})"
+        params += list(references)
+    return sql, params
+
+
+def get_outbox_counts(environment=None, references=None):
+    """Return {state: row count} for an environment's outbox rows (default: the current one)."""
+    scope, params = _outbox_scope(environment, references)
+    return dict(get_connection().execute(
+        f"SELECT state, COUNT(*) FROM outbox WHERE {scope} GROUP BY state", params).fetchall())
+
+
+def retry_failed_outbox(environment=None):
+    """Move an environment's failed rows back to pending. Returns how many were requeued."""
+    with get_connection() as conn:
+        return conn.execute(
+            "UPDATE outbox SET state = ?, attempts = 0, updated_at = datetime('now') "
+            "WHERE state = ? AND environment = ?",
+            (OUTBOX_PENDING, OUTBOX_FAILED, environment or _current_environment)).rowcount
+
+
+def claim_outbox_rows(limit, environment=None, references=None):
+    """Atomically move up to limit pending rows queued for environment to in_flight and return them.
+
+    With references, only rows with those IVI references are claimed.
+    """
+    scope, params = _outbox_scope(environment, references)
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT iviReferanse, understellsnummer, file_path, avgiftskode, sitteplasser, "
+            f"sengeplasser, ividoc_hash, attempts, environment FROM outbox WHERE state = ? AND {scope} "
+            "ORDER BY created_at LIMIT ?", [OUTBOX_PENDING] + params + [limit]).fetchall()
+        conn.executemany(
+            "UPDATE outbox SET state = ?, attempts = attempts + 1, updated_at = datetime('now') "
+            "WHERE iviReferanse = ?", [(OUTBOX_IN_FLIGHT, row[0]) for row in rows])
+    return rows
+
+
+def _status_code(status):
+    """Extract the HTTP status from a fetch_vegvesen_data() status string, or None."""
+    match = re.match(r"HTTP Status Code: (\d+)", status or "")
+    return int(match.group(1)) if match else None
+
+
+def _send_outbox_document(result, text, row):
+    """Submit a row's stored document, fill in result and return the row's next state."""
+    iviref_uid, vin, file_path, avgiftskode, sitteplasser, sengeplasser, doc_hash, attempts, environment = row
+    status, response = fetch_vegvesen_data(
+        IviDocument.from_string(text), iviref_uid, avgiftskode, sitteplasser, sengeplasser, environment)
+    result["status"], result["response"] = status, response
+    code = _status_code(status)
+    if code == 200:
+        result["success"] = True
+        return OUTBOX_DONE
+    if status == "Outcome unknown.":
+        return OUTBOX_UNKNOWN
+    if (code is None or code == 429 or code >= 500) and attempts + 1 < OUTBOX_MAX_ATTEMPTS:
+        return OUTBOX_PENDING
+    return OUTBOX_FAILED
+
+
+def send_outbox_row(row):
+    """Send one claimed outbox row and record the outcome. Returns a result dict with its new "state"."""
+    iviref_uid, vin, file_path, avgiftskode, sitteplasser, sengeplasser, doc_hash, attempts, environment = row
+    result = {
+        "file": file_path or "",
+        "vin": vin,
+        "iviReferanse": iviref_uid,
+        "success": False,
+        "status": None,
+        "response": None,
+        "elapsed": 0.0,
+    }
+    started = time.monotonic()
+    try:
+        if check_if_exists_in_database("ivi", iviref_uid):
+            # Sent before a crash, and the response was stored
+            state, result["success"], result["status"] = OUTBOX_DONE, True, "Already registered."
+        else:
+            text = load_ivi_document(get_connection(), doc_hash)
+            if text is None:
+                # Nothing to send, and resending will not bring it back
+                logging.error(f"Outbox row {iviref_uid} has no stored IVI document {doc_hash}")
+                state, result["status"] = OUTBOX_FAILED, "Stored IVI document is missing."
+            else:
+                state = _send_outbox_document(result, text, row)
+    except Exception as e:
+        logging.error(f"Outbox submission of {iviref_uid} failed: {e}")
+        state, result["status"] = OUTBOX_FAILED, f"Error: {e}"
+
+    try:
+        with get_connection() as conn:
+            conn.execute(
+                "UPDATE outbox SET state = ?, last_status = ?, updated_at = datetime('now') "
+                "WHERE iviReferanse = ?", (state, result["status"], iviref_uid))
+    except sqlite3.Error as e:
+        # The row stays in flight; recover_outbox() settles it on the next start
+        logging.error(f"Could not record the outbox state of {iviref_uid}: {e}")
+    result["state"] = state
+    result["elapsed"] = time.monotonic() - started
+    return result
+
+
+def drain_outbox(max_workers=BATCH_WORKERS, progress_callback=None, cancel_event=None, environment=None,
+                 references=None):
+    """Send the environment's pending outbox rows with at most max_workers in flight until none are left.
+
+    Rows that fail transiently return to pending and are picked up again in the same run.
+    progress_callback(done, total, result) and cancel_event behave as in submit_batch(),
+    with done counting rows that reached done or failed. Returns a submit_batch()-style
+    summary with one result per row in its final state (its "attempts" says how many sends
+    it took); every individual send is listed under "attempts" in the summary. With
+    references, only the rows with those IVI references are sent.
+    """
+    environment = environment or _current_environment
+    rows = {}  # iviReferanse -> latest result, in the order rows were first sent
+    attempts = []
+    settled = 0
+    started = time.monotonic()
+    max_workers = max(1, max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        while True:
+            if not (cancel_event is not None and cancel_event.is_set()):
+                for row in claim_outbox_rows(max_workers - len(in_flight), environment, references):
+                    in_flight.add(executor.submit(send_outbox_row, row))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                attempts.append(result)
+                previous = rows.get(result["iviReferanse"])
+                rows[result["iviReferanse"]] = {
+                    **result,
+                    "attempts": previous["attempts"] + 1 if previous else 1,
+                    "elapsed": result["elapsed"] + (previous["elapsed"] if previous else 0.0),
+                }
+                settled += result["state"] != OUTBOX_PENDING
+                logging.info(f"Outbox: {result['iviReferanse']} -> {result['status']}")
+                if progress_callback:
+                    pending = get_outbox_counts(environment, references).get(OUTBOX_PENDING, 0)
+                    progress_callback(settled, settled + len(in_flight) + pending, result)
+
+    summary = _batch_summary(list(rows.values()), time.monotonic() - started)
+    summary["attempts"] = attempts
+    return summary
+
+
+# --- Bulk delete and corrections ---
+
+def _delete_result(vin):
+    return {"vin": vin, "success": False, "status_code": None, "status": None, "response": None,
+            "elapsed": 0.0}
+
+
+def delete_vegvesen_entries(vins, max_workers=BATCH_WORKERS, progress_callback=None, cancel_event=None,
+                            environment=None):
+    """Delete many VINs at Vegvesen concurrently, sharing one token and the retry policy.
+
+    VINs deleted remotely are removed from responses in a single transaction at the end.
+    progress_callback(done, total, result) and cancel_event behave as in submit_batch().
+    Returns a submit_batch()-style summary with one result dict per (unique) VIN.
+    """
+    vins = list(dict.fromkeys(vin.strip() for vin in vins if vin and vin.strip()))
+    results = {vin: _delete_result(vin) for vin in vins}
+    started = time.monotonic()
+
+    environment = environment or _current_environment
+    access_token, error = get_access_token(environment) if vins else (None, None)
+    if error:
+        token_error = token_failure(error)
+        for result in results.values():
+            result["status"], result["response"] = token_error
+        return _batch_summary(list(results.values()), time.monotonic() - started)
+
+    def delete(vin):
+        result = results[vin]
+        if cancel_event is not None and cancel_event.is_set():
+            result["status"] = "Cancelled."
+            return result
+        begun = time.monotonic()
+        response, error = _send_delete(vin, access_token, environment)
+        if response is None:
+            result["status"] = error
+        else:
+            result["status_code"] = response.status_code
+            result["status"] = f"HTTP Status Code: {response.status_code}"
+            result["response"] = VegvesenResponse(response.status_code, response.content)
+            result["success"] = response.status_code == 200
+        result["elapsed"] = time.monotonic() - begun
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(delete, vin) for vin in vins]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            logging.info(f"Bulk delete {done}/{len(vins)}: {result['vin']} -> {result['status']}")
+            if progress_callback:
+                progress_callback(done, len(vins), result)
+
+    deleted = [vin for vin in vins if results[vin]["success"]]
+    if deleted:
+        delete_responses_by_vins(deleted)
+    return _batch_summary(list(results.values()), time.monotonic() - started)
+
+
+def resubmit_corrections(vehicles, max_workers=BATCH_WORKERS, progress_callback=None, cancel_event=None,
+                         write_back=True):
+    """Replace registrations with corrected documents: delete each vehicle's VIN, then resubmit it.
+
+    vehicles come from load_batch(). Every corrected document is read and validated, with a
+    fresh IVI reference, before anything is deleted, so a bad file never costs the vehicle its
+    existing registration. VINs that appear in more than one file are not touched either.
+    Only vehicles whose delete succeeded are queued, and only those rows are sent from the
+    outbox; anything else waiting there is left for a batch run. Returns a
+    summary whose per-VIN results carry both outcomes: "delete_status" and "status" (the
+    resubmission); vehicles rejected up front have a "delete_status" of None.
+    """
+    environment = _current_environment
+    files_by_vin = {}
+    for vehicle in vehicles:
+        if vehicle.get("vin"):
+            files_by_vin.setdefault(vehicle["vin"], []).append(vehicle["file"])
+
+    rejected = []
+    by_vin = {}
+    documents = {}
+    for vehicle in vehicles:
+        vin = vehicle.get("vin")
+        if not vin:
+            error = "No VehicleIdentificationNumber found in XML."
+        elif len(files_by_vin[vin]) > 1:
+            others = ", ".join(f for f in files_by_vin[vin] if f != vehicle["file"])
+            error = f"VIN {vin} is also in {others}; not deleted."
+        else:
+            iviref_uid = vehicle.get("iviReferanse") or generate_ivi_ref_id()
+            document = prepare_ivi_document(vehicle["file"], iviref_uid, vin, write_back=False)
+            error = validate_ivi_document(document) if document is not None else "Failed to update XML."
+            if not error:
+                by_vin[vin] = vehicle
+                documents[vin] = (iviref_uid, document)
+                continue
+            error += " Not deleted."
+        rejected.append({**_delete_result(vin), "file": vehicle["file"], "iviReferanse": None,
+                         "delete_status": None, "status": error})
+
+    # Progress counts the deletes first, then the submissions
+    def delete_progress(done, total, result):
+        if progress_callback:
+            progress_callback(done, 2 * total, result)
+
+    def submit_progress(done, total, result):
+        if progress_callback:
+            progress_callback(len(by_vin) + done, len(by_vin) + total, result)
+
+    deletes = delete_vegvesen_entries(list(by_vin), max_workers, delete_progress, cancel_event, environment)
+
+    results = {}
+    for d in deletes["results"]:
+        results[d["vin"]] = {**d, "file": by_vin[d["vin"]]["file"], "iviReferanse": None, "success": False,
+                             "delete_status": d["status"], "status": "Not resubmitted."}
+    started = time.monotonic()
+
+    deleted = [vin for vin, result in results.items() if result["delete_status"] == "HTTP Status Code: 200"]
+    if deleted and not (cancel_event is not None and cancel_event.is_set()):
+        if write_back:
+            for vin in deleted:
+                document = documents[vin][1]
+                try:
+                    document.save()
+                except OSError as e:
+                    # The file keeps its old reference; the validated document is still sent
+                    print(f"Could not write the XML file {document.file_path}: {e}")
+                    logging.error(f"Could not write the XML file {document.file_path}: {e}")
+        with get_connection() as conn:
+            for vin in deleted:
+                iviref_uid, document = documents[vin]
+                _queue_document(conn, by_vin[vin], iviref_uid, document, environment)
+                results[vin].update(iviReferanse=iviref_uid, status="Queued.")
+        queued = {results[vin]["iviReferanse"] for vin in deleted}
+        sent = drain_outbox(max_workers, submit_progress, cancel_event, environment, queued)
+        for result in sent["results"]:
+            if result["vin"] in results and result["iviReferanse"] == results[result["vin"]]["iviReferanse"]:
+                entry = results[result["vin"]]
+                entry.update(success=result["success"], status=result["status"], response=result["response"],
+                             status_code=_status_code(result["status"]),
+                             elapsed=entry["elapsed"] + result["elapsed"])
+
+    return _batch_summary(list(results.values()) + rejected, deletes["elapsed"] + time.monotonic() - started)
+
+
+BULK_REPORT_COLUMNS = ("vin", "success", "status_code", "status", "delete_status", "iviReferanse", "file", "elapsed")
+
+
+def write_bulk_report(summary, out):
+    """Write a per-VIN CSV report of delete_vegvesen_entries() or resubmit_corrections() to out."""
+    writer = csv.writer(out)
+    writer.writerow(BULK_REPORT_COLUMNS)
+    for result in summary["results"]:
+        writer.writerow(["" if result.get(column) is None else result.get(column) for column in BULK_REPORT_COLUMNS])
+
+
+def format_bulk_report(summary):
+    """Render a bulk delete or correction summary as text, one line per VIN."""
+    lines = [f"{summary['submitted']}/{summary['total']} succeeded, {summary['failed']} failed "
+             f"in {summary['elapsed']:.1f}s", ""]
+    for r in summary["results"]:
+        status = r["status"]
+        if r.get("delete_status") and r["delete_status"] != status:
+            status = f"delete: {r['delete_status']}; resubmit: {status}"
+        lines.append(f"{'OK  ' if r['success'] else 'FAIL'} {r['vin'] or '-'}  {status}")
+    return "\n".join(lines)
 
 
 # --- JWT / Key generation ---
 
 def generate_keypair():
     """Generate RSA keypair, save to files, return JWK JSON string."""
-    private_key = asymmetric.rsa.generate_private_key(
+    import pyperclip
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from jose import jwk
+
+    private_key = rsa.generate_private_key(
         public_exponent=65537,
         key_size=2048,
         backend=default_backend()
@@ -402,6 +1690,8 @@ def generate_keypair():
             )
         )
 
+    invalidate_key_material()
+
     jwk_dict = jwk.construct(public_key, algorithm='RS256').to_dict()
     jwk_dict['use'] = 'sig'
     jwk_dict['kid'] = 'min_egen_nokkel'
@@ -415,6 +1705,10 @@ def generate_keypair():
 
 def import_p12_certificate(p12_path, password):
     """Import a .p12 certificate, extracting private key, public key, and cert chain."""
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
     with open(p12_path, "rb") as f:
         p12_data = f.read()
 
@@ -451,6 +1745,10 @@ def import_p12_certificate(p12_path, password):
             b64 = base64.b64encode(der_bytes).decode("ascii")
             f.write(b64 + "\n")
 
+    # The cached signing key and tokens minted with the previous certificate must not be reused
+    invalidate_key_material()
+    invalidate_token_cache()
+
     return f"Imported {len(all_certs)} certificate(s).\nFiles written: private_key.pem, public_key.pem, virksomhet.cer"
 
 
@@ -0,0 +1,77 @@
+"""Pooled HTTP sessions shared by the Vegvesen and Maskinporten calls."""
+
+import threading
+
+# Connections kept alive per host and environment
+POOL_SIZE = 10
+# Seconds to wait for the TCP/TLS connection and for each read
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None):
+    """Change pool size and timeouts. Open sessions are closed so new settings apply."""
+    global POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    close_sessions()
+
+
+def get_timeout():
+    """Return the (connect, read) timeout tuple passed to every request."""
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+def _create_session():
+    # requests is imported on first use so that importing this module stays cheap
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def request_not_sent(error):
+    """True when a requests exception shows the request never reached the server.
+
+    Only then is it safe to resend a request that is not idempotent: after a read
+    timeout or a reset connection the server may already have acted on it.
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # Refused connections and failed DNS lookups arrive wrapped in a MaxRetryError
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def get_session(environment):
+    """Return the keep-alive session for an environment, creating it on first use."""
+    with _sessions_lock:
+        session = _sessions.get(environment)
+        if session is None:
+            session = _sessions[environment] = _create_session()
+        return session
+
+
+def close_sessions(environment=None):
+    """Close pooled connections, for one environment or all of them."""
+    with _sessions_lock:
+        names = [environment] if environment is not None else list(_sessions)
+        for name in names:
+            session = _sessions.pop(name, None)
+            if session is not None:
+                session.close()
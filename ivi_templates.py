@@ -0,0 +1,181 @@
+"""Compiled IVI templates — render many per-VIN documents from one template without reparsing."""
+
+import argparse
+import csv
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from ecoc_service import generate_ivi_ref_id, read_ivi_text
+
+# Placeholder text the shipped template uses for values the operator or the app must fill in
+TEMPLATE_PLACEHOLDERS = {
+    "IVIReferenceId": "GENERER_BUTTON_CREATESTHIS",
+    "VehicleIdentificationNumber": "WILL_BE_FILLED_IN_FROM_SOFTWARE",
+    "TypeApprovalNumber": "THE_NGN_TYPE_APPROVALNUMBER",
+}
+
+# CSV column aliases for element names
+FIELD_ALIASES = {
+    "vin": "VehicleIdentificationNumber",
+    "understellsnummer": "VehicleIdentificationNumber",
+    "ivi": "IVIReferenceId",
+    "ivireferanse": "IVIReferenceId",
+}
+
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+
+
+def _element_re(tag):
+    return re.compile(
+        rf"<{tag}(\s[^>]*)?(?:/>|>(.*?)</{tag}\s*>)", re.DOTALL)
+
+
+class CompiledTemplate:
+    """A template split once into static text and pre-located substitution points.
+
+    Each field is the first (non-commented) leaf element with that tag. render() only
+    joins strings, so thousands of documents can be produced without parsing XML.
+    """
+
+    def __init__(self, text, fields):
+        ET.fromstring(text)  # fail early on a malformed template
+        comments = [m.span() for m in _COMMENT_RE.finditer(text)]
+
+        slots = []
+        for field in dict.fromkeys(fields):
+            match = next((m for m in _element_re(field).finditer(text)
+                          if not any(a <= m.start() < b for a, b in comments)), None)
+            if match is None:
+                raise ValueError(f"Template has no <{field}> element.")
+            content = match.group(2) or ""
+            if "<" in _COMMENT_RE.sub("", content):
+                raise ValueError(f"<{field}> is not a leaf element and cannot be substituted.")
+            open_tag = f"<{field}{match.group(1) or ''}>"
+            slots.append((match.start(), match.end(), field, open_tag, content))
+
+        slots.sort()
+        self.fields = [slot[2] for slot in slots]
+        self._segments = []
+        self._defaults = []
+        pos = 0
+        for start, end, field, open_tag, content in slots:
+            if start < pos:
+                raise ValueError(f"<{field}> overlaps another substituted element.")
+            self._segments.append(text[pos:start] + open_tag)
+            self._defaults.append(content)
+            pos = end
+        self._closers = [f"</{field}>" for field in self.fields]
+        self._tail = text[pos:]
+
+    def render(self, values):
+        """Render one document. Missing or empty values keep the template's own text."""
+        parts = []
+        for segment, field, default, closer in zip(
+                self._segments, self.fields, self._defaults, self._closers):
+            value = values.get(field)
+            parts.append(segment)
+            parts.append(escape(str(value)) if value not in (None, "") else default)
+            parts.append(closer)
+        parts.append(self._tail)
+        return "".join(parts)
+
+
+def compile_template(template_path, fields=None):
+    """Compile a template file. By default only the IVI reference and VIN are substituted."""
+    if fields is None:
+        fields = ["IVIReferenceId", "VehicleIdentificationNumber"]
+    return CompiledTemplate(read_ivi_text(template_path), fields)
+
+
+def _normalize_row(row):
+    values = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip()
+        values[FIELD_ALIASES.get(key.lower(), key)] = (value or "").strip()
+    return values
+
+
+def read_variant_csv(csv_path):
+    """Read a CSV of VIN and variant data. Columns are element names (or vin/ivi aliases)."""
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        return [_normalize_row(row) for row in csv.DictReader(f)]
+
+
+def render_rows(template, rows):
+    """Yield (values, document_text) per row, assigning a fresh IVI reference when none is given."""
+    for row in rows:
+        values = dict(row)
+        if not values.get("IVIReferenceId"):
+            values["IVIReferenceId"] = generate_ivi_ref_id()
+        yield values, template.render(values)
+
+
+def render_csv(template_path, csv_path, output_dir):
+    """Render one UTF-16 XML file per CSV row into output_dir. Returns a list of written paths."""
+    rows = read_variant_csv(csv_path)
+    fields = {"IVIReferenceId", "VehicleIdentificationNumber"}
+    for row in rows:
+        fields.update(row)
+    template = compile_template(template_path, sorted(fields))
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for values, document in render_rows(template, rows):
+        name = values.get("VehicleIdentificationNumber") or values["IVIReferenceId"]
+        path = os.path.join(output_dir, f"{name}.xml")
+        with open(path, "w", encoding="utf-16") as f:
+            f.write(document)
+        written.append(path)
+    return written
+
+
+def benchmark(template_path, count=10000, fields=None):
+    """Measure compile time and documents rendered per second for count synthetic VINs."""
+    started = time.perf_counter()
+    template = compile_template(template_path, fields)
+    compile_seconds = time.perf_counter() - started
+
+    rows = [{"VehicleIdentificationNumber": f"BENCH{i:012d}"} for i in range(count)]
+    started = time.perf_counter()
+    for _ in render_rows(template, rows):
+        pass
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": count,
+        "compile_seconds": compile_seconds,
+        "render_seconds": elapsed,
+        "documents_per_second": count / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render IVI documents from a template.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    render_parser = sub.add_parser("render", help="Render one XML file per CSV row")
+    render_parser.add_argument("template")
+    render_parser.add_argument("csv")
+    render_parser.add_argument("output_dir")
+
+    bench_parser = sub.add_parser("bench", help="Benchmark documents rendered per second")
+    bench_parser.add_argument("template")
+    bench_parser.add_argument("-n", "--count", type=int, default=10000)
+
+    args = parser.parse_args(argv)
+    if args.command == "render":
+        written = render_csv(args.template, args.csv, args.output_dir)
+        print(f"Rendered {len(written)} document(s) into {args.output_dir}")
+    else:
+        result = benchmark(args.template, args.count)
+        print(f"Compiled in {result['compile_seconds'] * 1000:.1f} ms; "
+              f"rendered {result['documents']} documents in {result['render_seconds']:.2f} s "
+              f"({result['documents_per_second']:.0f} documents/s)")
+
+
+if __name__ == "__main__":
+    main()
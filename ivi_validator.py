@@ -0,0 +1,271 @@
+"""Local checks for IVI documents, so bad files are rejected before a token fetch and a round trip.
+
+    python ivi_validator.py <file or folder>... [--workers N] [--json]
+
+Rules are compiled once per process into a Validator. Each document is parsed once,
+and its elements are indexed by tag in a single pass that every rule shares.
+validate_files() spreads many files over a process pool. Errors block a submission;
+warnings are only reported.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from ecoc_service import read_ivi_text
+from ivi_templates import TEMPLATE_PLACEHOLDERS
+
+ERROR = "error"
+WARNING = "warning"
+
+Issue = namedtuple("Issue", "severity rule message")
+
+ROOT_ELEMENT = "InitialVehicleInformation"
+
+# Elements that must be present with a value
+REQUIRED_ELEMENTS = (
+    "IVIReferenceId",
+    "VersionNumberXsd",
+    "VehicleIdentificationNumber",
+    "StageOfCompletionCode",
+    "TypeApprovalTypeCode",
+    "VehicleCategoryCode",
+    "TypeApprovalNumber",
+    "DateOfManufactureVeh",
+    "Make",
+    "NumberOfAxles",
+)
+
+SUPPORTED_XSD_VERSIONS = ("1.1",)
+
+# EU vehicle categories (M, N, O, L, T, C, R, S)
+VEHICLE_CATEGORY_PATTERN = r"M[123]G?|N[123]G?|O[1-4]|L[1-7]e(-[A-Z0-9]+)?|T[1-5][ab]?|C[1-5][ab]?|R[1-4][ab]|S[12][ab]"
+
+# Sample values from xml_templates/Example.xml that are unlikely to be real data
+TEMPLATE_SAMPLE_VALUES = {
+    "Make": "The Make of your vehicle",
+    "CommercialName": "CommercialName",
+}
+
+# Placeholders the application fills in itself at submission time
+APP_FILLED = ("IVIReferenceId",)
+
+_VIN_CHARS = "0123456789ABCDEFGHJKLMNPRSTUVWXYZ"
+_VIN_VALUES = dict(zip("ABCDEFGHJKLMNPRSTUVWXYZ", [1, 2, 3, 4, 5, 6, 7, 8, 1, 2, 3, 4, 5, 7, 9, 2, 3, 4, 5, 6, 7, 8, 9]))
+_VIN_VALUES.update({str(d): d for d in range(10)})
+_VIN_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+
+
+def vin_check_digit(vin):
+    """ISO 3779 / North American check digit for a 17-character VIN ("0"-"9" or "X")."""
+    total = sum(_VIN_VALUES[c] * w for c, w in zip(vin, _VIN_WEIGHTS))
+    remainder = total % 11
+    return "X" if remainder == 10 else str(remainder)
+
+
+class Validator:
+    """A compiled set of rules. validate_root() runs them all over one parsed document."""
+
+    def __init__(self, app_filled=APP_FILLED, check_digit=True):
+        self.app_filled = set(app_filled)
+        self.check_digit = check_digit
+        self._vin_re = re.compile(rf"[{_VIN_CHARS}]{{17}}")
+        self._category_re = re.compile(rf"(?:{VEHICLE_CATEGORY_PATTERN})")
+        self._placeholders = {value: tag for tag, value in TEMPLATE_PLACEHOLDERS.items()}
+        self.rules = (
+            self._check_root,
+            self._check_required,
+            self._check_placeholders,
+            self._check_version,
+            self._check_vin,
+            self._check_category,
+            self._check_date,
+            self._check_axles,
+        )
+
+    def validate_text(self, text):
+        try:
+            root = ET.fromstring(text)
+        except ET.ParseError as e:
+            return [Issue(ERROR, "xml", f"Malformed XML: {e}")]
+        return self.validate_root(root)
+
+    def validate_file(self, file_path):
+        try:
+            text = read_ivi_text(file_path)
+        except (OSError, UnicodeDecodeError) as e:
+            return [Issue(ERROR, "file", f"Cannot read file: {e}")]
+        return self.validate_text(text)
+
+    def validate_root(self, root):
+        """Return a list of Issues for an already parsed document (e.g. IviDocument.root)."""
+        index = {}
+        for elem in root.iter():
+            index.setdefault(elem.tag, []).append(elem)
+        issues = []
+        for rule in self.rules:
+            issues.extend(rule(root, index))
+        return issues
+
+    @staticmethod
+    def _text(index, tag):
+        elems = index.get(tag)
+        return (elems[0].text or "").strip() if elems else None
+
+    def _check_root(self, root, index):
+        if root.tag != ROOT_ELEMENT:
+            yield Issue(ERROR, "root", f"Root element is <{root.tag}>, expected <{ROOT_ELEMENT}>.")
+
+    def _check_required(self, root, index):
+        for tag in REQUIRED_ELEMENTS:
+            value = self._text(index, tag)
+            if value is None:
+                yield Issue(ERROR, "required", f"<{tag}> is missing.")
+            elif not value:
+                yield Issue(ERROR, "required", f"<{tag}> is empty.")
+
+    def _check_placeholders(self, root, index):
+        for tag, elems in index.items():
+            for elem in elems:
+                value = (elem.text or "").strip()
+                if value in self._placeholders and tag not in self.app_filled:
+                    yield Issue(ERROR, "placeholder", f"<{tag}> still holds the template placeholder {value}.")
+                elif TEMPLATE_SAMPLE_VALUES.get(tag) == value:
+                    yield Issue(WARNING, "placeholder", f"<{tag}> still holds the template sample value '{value}'.")
+
+    def _check_version(self, root, index):
+        version = self._text(index, "VersionNumberXsd")
+        if version and version not in SUPPORTED_XSD_VERSIONS:
+            yield Issue(WARNING, "version", f"VersionNumberXsd {version} is not one of {', '.join(SUPPORTED_XSD_VERSIONS)}.")
+
+    def _check_vin(self, root, index):
+        vin = self._text(index, "VehicleIdentificationNumber")
+        if not vin or vin in self._placeholders:
+            return
+        if not self._vin_re.fullmatch(vin):
+            yield Issue(ERROR, "vin", f"VIN {vin} must be 17 characters of A-Z and 0-9, without I, O or Q.")
+        elif self.check_digit and vin[8] != vin_check_digit(vin):
+            # Only mandatory for North America, so a mismatch is not fatal
+            yield Issue(WARNING, "vin", f"VIN {vin} check digit is {vin[8]}, expected {vin_check_digit(vin)}.")
+
+    def _check_category(self, root, index):
+        category = self._text(index, "VehicleCategoryCode")
+        if category and not self._category_re.fullmatch(category):
+            yield Issue(ERROR, "category", f"VehicleCategoryCode {category} is not a known vehicle category.")
+
+    def _check_date(self, root, index):
+        value = self._text(index, "DateOfManufactureVeh")
+        if not value:
+            return
+        try:
+            manufactured = date.fromisoformat(value[:10])
+        except ValueError:
+            yield Issue(ERROR, "date", f"DateOfManufactureVeh {value} is not a YYYY-MM-DD date.")
+            return
+        if manufactured > date.today():
+            yield Issue(ERROR, "date", f"DateOfManufactureVeh {value} is in the future.")
+
+    def _check_axles(self, root, index):
+        declared = self._text(index, "NumberOfAxles")
+        if not declared:
+            return
+        if not declared.isdigit() or int(declared) < 1:
+            yield Issue(ERROR, "axles", f"NumberOfAxles {declared} is not a positive whole number.")
+            return
+        declared = int(declared)
+
+        groups = index.get("AxleGroup", [])
+        if len(groups) != declared:
+            yield Issue(ERROR, "axles", f"NumberOfAxles is {declared} but AxleTable has {len(groups)} AxleGroup(s).")
+
+        numbers = [(group.findtext("AxleNumber") or "").strip() for group in groups]
+        if groups and numbers != [str(n) for n in range(1, len(groups) + 1)]:
+            yield Issue(ERROR, "axles", f"AxleNumber values {', '.join(numbers)} should run 1..{len(groups)} in order.")
+
+        steered = self._text(index, "NumberOfSteeredAxles")
+        if steered and steered.isdigit() and groups:
+            marked = sum(1 for group in groups if (group.findtext("SteeredAxleInd") or "").strip() == "Y")
+            if marked != int(steered):
+                yield Issue(WARNING, "axles", f"NumberOfSteeredAxles is {steered} but {marked} axle(s) have SteeredAxleInd Y.")
+
+
+_validator = None
+
+
+def get_validator():
+    """Return this process's shared Validator, compiling the rules on first use."""
+    global _validator
+    if _validator is None:
+        _validator = Validator()
+    return _validator
+
+
+def has_errors(issues):
+    return any(issue.severity == ERROR for issue in issues)
+
+
+def format_issues(issues):
+    return "\n".join(f"{issue.severity.upper()}: {issue.message}" for issue in issues)
+
+
+def _validate_path(file_path):
+    return file_path, get_validator().validate_file(file_path)
+
+
+def validate_files(paths, max_workers=None):
+    """Validate many files in parallel processes. Returns {path: [Issue, ...]} in input order."""
+    paths = list(paths)
+    if len(paths) < 50 or max_workers == 1:
+        return dict(map(_validate_path, paths))
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(paths) // (workers * 4))
+        return dict(executor.map(_validate_path, paths, chunksize=chunksize))
+
+
+def collect_xml_files(paths):
+    """Expand folders into the .xml files they contain (not recursive)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(".xml"))
+        else:
+            files.append(path)
+    return files
+
+
+def write_report(results, out, as_json=False):
+    """Print validate_files() results to out. Returns the number of files with errors."""
+    failed = sum(1 for issues in results.values() if has_errors(issues))
+    if as_json:
+        json.dump({path: [issue._asdict() for issue in issues] for path, issues in results.items()},
+                  out, indent=2, ensure_ascii=False)
+        out.write("\n")
+        return failed
+    for path, issues in results.items():
+        print(f"{'FAIL' if has_errors(issues) else 'OK  '} {path}", file=out)
+        for issue in issues:
+            print(f"       {issue.severity}: {issue.message}", file=out)
+    print(f"{len(results) - failed}/{len(results)} file(s) valid", file=out)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate IVI XML files before submission.")
+    parser.add_argument("paths", nargs="+", help="XML files or folders")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Processes to use")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = validate_files(collect_xml_files(args.paths), args.workers)
+    return 1 if write_report(results, sys.stdout, args.json) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,352 @@
-def main():
-    print("Hello from easy-ecoc-ce!")
+"""Headless command-line entry point for cron jobs and pipelines.
+
+    python main.py [--env Test|Production|Local] [--db PATH] <command> ...
+
+Commands: submit, batch, watch, validate, scan, locate, delete, resubmit, search, export, token, import-cert. Diagnostic output
+from ecoc_service goes to stderr (or nowhere with --quiet), so stdout only carries the
+command's result. Exit status is 0 on success and 1 if anything failed.
+"""
+
+import argparse
+import contextlib
+import getpass
+import json
+import os
+import sys
+
+# Environment variable read by import-cert when --password-stdin is not given
+P12_PASSWORD_ENV = "EASY_ECOC_P12_PASSWORD"
+
+
+def _add_vehicle_options(parser):
+    parser.add_argument("--avgiftskode", default="0")
+    parser.add_argument("--sitteplasser", default="0")
+    parser.add_argument("--sengeplasser", default="0")
+    parser.add_argument("--no-write-back", dest="write_back", action="store_false",
+                        help="Submit the rewritten XML without saving it over the file")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="easy-ecoc", description="Submit and manage eCoC registrations with Statens vegvesen.")
+    parser.add_argument("--env", choices=["Test", "Production", "Local"],
+                        default=os.environ.get("EASY_ECOC_ENV", "Production"),
+                        help="Environment to use (default: $EASY_ECOC_ENV or Production)")
+    parser.add_argument("--db", help="SQLite database file (default: vegvesen_data.db)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Discard diagnostic output instead of writing it to stderr")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print per-stage timings and counters to stderr when done")
+    parser.add_argument("--trace-file", help="Append one JSON line per timed stage to this file")
+    parser.add_argument("--metrics-file", help="Write Prometheus textfile metrics to this file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("submit", help="Submit one IVI XML file")
+    p.add_argument("file")
+    p.add_argument("--vin", help="VIN to write into the file (default: read from the XML)")
+    _add_vehicle_options(p)
+    p.add_argument("--json", action="store_true", help="Print the result as JSON")
+    p.set_defaults(handler=cmd_submit)
+
+    p = sub.add_parser("batch", help="Submit a folder of XML files or a CSV manifest")
+    p.add_argument("path", nargs="?",
+                   help="Folder or manifest.csv; omit to only resume the queued submissions")
+    p.add_argument("-w", "--workers", type=int, default=None,
+                   help="Vehicles submitted in parallel")
+    p.add_argument("--retry-failed", action="store_true",
+                   help="Requeue earlier failed submissions before sending")
+    _add_vehicle_options(p)
+    p.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    p.set_defaults(handler=cmd_batch)
+
+    p = sub.add_parser("watch", help="Submit XML files as they are dropped into an inbox folder")
+    p.add_argument("inbox")
+    p.add_argument("-w", "--workers", type=int, default=None,
+                   help="Vehicles submitted in parallel")
+    p.add_argument("--max-pending", type=int, default=None,
+                   help="Files taken from the inbox before waiting for results")
+    p.add_argument("--settle", type=float, default=None,
+                   help="Seconds a file must stay unchanged before it is picked up")
+    _add_vehicle_options(p)
+    p.set_defaults(handler=cmd_watch)
+
+    p = sub.add_parser("validate", help="Check XML files for errors without submitting them")
+    p.add_argument("paths", nargs="+", metavar="path", help="XML files or folders")
+    p.add_argument("-w", "--workers", type=int, default=None, help="Processes to use")
+    p.add_argument("--json", action="store_true", help="Print the issues as JSON")
+    p.set_defaults(handler=cmd_validate)
+
+    p = sub.add_parser("scan", help="Index the XML files in a folder so they can be found by VIN")
+    p.add_argument("directory")
+    p.add_argument("-w", "--workers", type=int, default=None, help="Processes to use")
+    p.add_argument("--no-recursive", dest="recursive", action="store_false")
+    p.set_defaults(handler=cmd_scan)
+
+    p = sub.add_parser("locate", help="Find indexed XML files by VIN")
+    p.add_argument("vin")
+    p.add_argument("--prefix", action="store_true", help="Match VINs starting with vin")
+    p.add_argument("--json", action="store_true", help="Print the files as JSON")
+    p.set_defaults(handler=cmd_locate)
+
+    p = sub.add_parser("delete", help="Delete registrations by VIN")
+    p.add_argument("vins", nargs="*", metavar="vin")
+    p.add_argument("--from-file", help="Read VINs from this file, one per line ('-' for stdin)")
+    p.add_argument("-w", "--workers", type=int, default=None, help="Deletes sent in parallel")
+    p.add_argument("-y", "--yes", action="store_true", help="Do not ask for confirmation")
+    p.add_argument("--report", help="Write a per-VIN CSV report to this file")
+    p.add_argument("--json", action="store_true", help="Print the results as JSON")
+    p.set_defaults(handler=cmd_delete)
+
+    p = sub.add_parser("resubmit", help="Delete registrations and submit corrected XML files in their place")
+    p.add_argument("path", help="Folder of corrected XML files or manifest.csv")
+    p.add_argument("-w", "--workers", type=int, default=None, help="Requests sent in parallel")
+    p.add_argument("-y", "--yes", action="store_true", help="Do not ask for confirmation")
+    p.add_argument("--report", help="Write a per-VIN CSV report to this file")
+    _add_vehicle_options(p)
+    p.add_argument("--json", action="store_true", help="Print the results as JSON")
+    p.set_defaults(handler=cmd_resubmit)
+
+    p = sub.add_parser("search", help="Search registrations by VIN, IVI reference or message")
+    p.add_argument("term")
+    p.add_argument("-n", "--limit", type=int, default=None)
+    p.set_defaults(handler=cmd_search)
+
+    p = sub.add_parser("export", help="Export all registrations")
+    p.add_argument("-o", "--output", help="Output file (default: stdout)")
+    p.add_argument("-f", "--format", choices=["csv", "json"], default="csv")
+    p.add_argument("--documents", action="store_true", help="Include the IVI document XML")
+    p.set_defaults(handler=cmd_export)
+
+    p = sub.add_parser("token", help="Check that a Maskinporten access token can be obtained")
+    p.add_argument("--show", action="store_true", help="Print the access token itself")
+    p.set_defaults(handler=cmd_token)
+
+    p = sub.add_parser("import-cert", help="Import a .p12/.pfx certificate")
+    p.add_argument("p12")
+    p.add_argument("--password-stdin", action="store_true",
+                   help=f"Read the password from stdin (default: ${P12_PASSWORD_ENV}, else prompt)")
+    p.set_defaults(handler=cmd_import_cert)
+
+    return parser
+
+
+def cmd_submit(svc, args, out):
+    vin = args.vin or svc.read_vehicle_identification_number(args.file)
+    result = svc.submit_vehicle({
+        "file": args.file,
+        "vin": vin,
+        "avgiftskode": args.avgiftskode,
+        "sitteplasser": args.sitteplasser,
+        "sengeplasser": args.sengeplasser,
+    }, write_back=args.write_back)
+    if args.json:
+        json.dump(result, out, indent=2, ensure_ascii=False, default=str)
+        out.write("\n")
+    else:
+        print(result["status"], file=out)
+        if result["response"]:
+            print(result["response"], file=out)
+    return 0 if result["success"] else 1
+
+
+def cmd_batch(svc, args, out):
+    pending = svc.recover_outbox()
+    if args.retry_failed:
+        pending += svc.retry_failed_outbox()
+
+    skipped = []
+    if args.path:
+        vehicles = svc.load_batch(args.path, avgiftskode=args.avgiftskode,
+                                  sitteplasser=args.sitteplasser, sengeplasser=args.sengeplasser)
+        queued = svc.enqueue_submissions(vehicles, write_back=args.write_back)
+        skipped = [(vehicle["file"], error) for vehicle, ivi, error in queued if error]
+    elif not pending:
+        print("Nothing to submit: the queue is empty.", file=out)
+        return 0
+
+    summary = svc.drain_outbox(max_workers=args.workers or svc.BATCH_WORKERS)
+    counts = svc.get_outbox_counts()
+    if args.json:
+        # Responses are VegvesenResponse objects; default=str formats them
+        json.dump({**summary, "skipped": skipped, "queue": counts}, out, indent=2, ensure_ascii=False,
+                  default=str)
+        out.write("\n")
+    else:
+        print(svc.format_batch_summary(summary), file=out)
+        for file_path, error in skipped:
+            print(f"SKIP {os.path.basename(file_path)}  {error}", file=out)
+        if counts.get(svc.OUTBOX_FAILED):
+            print(f"{counts[svc.OUTBOX_FAILED]} submission(s) failed; "
+                  f"rerun with --retry-failed to send them again.", file=out)
+        if counts.get(svc.OUTBOX_UNKNOWN):
+            print(f"{counts[svc.OUTBOX_UNKNOWN]} submission(s) got no answer after sending; "
+                  f"check them at Vegvesen before submitting again.", file=out)
+    return 0 if summary["failed"] == 0 and not skipped else 1
+
+
+def cmd_watch(svc, args, out):
+    import watch_folder
+
+    watcher = watch_folder.FolderWatcher(
+        args.inbox,
+        max_workers=args.workers or svc.BATCH_WORKERS,
+        max_pending=args.max_pending or watch_folder.MAX_PENDING,
+        settle_seconds=watch_folder.SETTLE_SECONDS if args.settle is None else args.settle,
+        avgiftskode=args.avgiftskode, sitteplasser=args.sitteplasser, sengeplasser=args.sengeplasser,
+        write_back=args.write_back)
+    with contextlib.redirect_stdout(out):
+        counts = watcher.run()
+    return 1 if counts["failed"] else 0
+
+
+def cmd_validate(svc, args, out):
+    import ivi_validator
+
+    results = ivi_validator.validate_files(ivi_validator.collect_xml_files(args.paths), args.workers)
+    return 1 if ivi_validator.write_report(results, out, args.json) else 0
+
+
+def cmd_scan(svc, args, out):
+    import xml_index
+
+    s = xml_index.scan_directory(args.directory, args.workers, args.recursive)
+    print(f"{s['files']} file(s): {s['scanned']} scanned, {s['unchanged']} unchanged, "
+          f"{s['removed']} removed, {s['errors']} unreadable in {s['elapsed']:.2f}s", file=out)
+    return 0
+
+
+def cmd_locate(svc, args, out):
+    import xml_index
+
+    files = xml_index.find_files(args.vin, prefix=args.prefix)
+    if args.json:
+        json.dump(files, out, indent=2, ensure_ascii=False)
+        out.write("\n")
+    elif files:
+        print(xml_index.format_files(files), file=out)
+    return 0 if files else 1
+
+
+def _confirm(prompt):
+    if not sys.stdin.isatty():
+        print("Refusing to delete without --yes when not run interactively.", file=sys.stderr)
+        return False
+    answer = input(f"{prompt} [y/N] ")
+    if answer.strip().lower() not in ("y", "yes", "j", "ja"):
+        print("Cancelled.", file=sys.stderr)
+        return False
+    return True
+
+
+def _print_bulk_report(svc, summary, args, out):
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as f:
+            svc.write_bulk_report(summary, f)
+        print(f"Report written to {args.report}", file=sys.stderr)
+    if args.json:
+        json.dump(summary, out, indent=2, ensure_ascii=False, default=str)
+        out.write("\n")
+    else:
+        print(svc.format_bulk_report(summary), file=out)
+    return 1 if summary["failed"] else 0
+
+
+def cmd_delete(svc, args, out):
+    vins = list(args.vins)
+    if args.from_file:
+        with (sys.stdin if args.from_file == "-" else open(args.from_file, encoding="utf-8")) as f:
+            vins += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not vins:
+        print("No VINs given.", file=sys.stderr)
+        return 1
+    if not args.yes:
+        if args.from_file == "-":
+            print("Use --yes when reading VINs from stdin.", file=sys.stderr)
+            return 1
+        if not _confirm(f"Delete {len(vins)} registration(s) in {args.env}?"):
+            return 1
+
+    summary = svc.delete_vegvesen_entries(vins, max_workers=args.workers or svc.BATCH_WORKERS)
+    return _print_bulk_report(svc, summary, args, out)
+
+
+def cmd_resubmit(svc, args, out):
+    vehicles = svc.load_batch(args.path, avgiftskode=args.avgiftskode,
+                              sitteplasser=args.sitteplasser, sengeplasser=args.sengeplasser)
+    if not vehicles:
+        print(f"No XML files found in {args.path}.", file=sys.stderr)
+        return 1
+    if not args.yes and not _confirm(f"Delete and resubmit {len(vehicles)} registration(s) in {args.env}?"):
+        return 1
+
+    summary = svc.resubmit_corrections(vehicles, max_workers=args.workers or svc.BATCH_WORKERS,
+                                       write_back=args.write_back)
+    return _print_bulk_report(svc, summary, args, out)
+
+
+def cmd_search(svc, args, out):
+    rows = svc.search_registrations(args.term, limit=args.limit or svc.SEARCH_LIMIT)
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row[1:]), file=out)
+    return 0 if rows else 1
+
+
+def cmd_export(svc, args, out):
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            count = svc.export_responses(f, args.format, args.documents)
+        print(f"Exported {count} registration(s) to {args.output}", file=sys.stderr)
+    else:
+        svc.export_responses(out, args.format, args.documents)
+    return 0
+
+
+def cmd_token(svc, args, out):
+    access_token, error = svc.get_access_token(args.env)
+    if error:
+        print(f"Could not get an access token: {error}", file=out)
+        return 1
+    print(access_token if args.show else f"Access token OK for {args.env}.", file=out)
+    return 0
+
+
+def cmd_import_cert(svc, args, out):
+    if args.password_stdin:
+        password = sys.stdin.readline().rstrip("\r\n")
+    else:
+        password = os.environ.get(P12_PASSWORD_ENV)
+        if password is None:
+            password = getpass.getpass("Certificate password: ")
+    try:
+        print(svc.import_p12_certificate(args.p12, password), file=out)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+    chatter = open(os.devnull, "w") if args.quiet else sys.stderr
+
+    with contextlib.redirect_stdout(chatter):
+        import ecoc_service as svc
+
+        if args.db:
+            svc.set_database_path(args.db)
+        svc.telemetry.configure(jsonl_path=args.trace_file, prometheus_path=args.metrics_file)
+        svc.set_environment(args.env)
+        svc.create_database()
+        try:
+            return args.handler(svc, args, out)
+        except KeyboardInterrupt:
+            print("Interrupted; queued submissions resume on the next batch run.", file=sys.stderr)
+            return 130
+        finally:
+            if args.timings:
+                print(svc.telemetry.format_snapshot(), file=sys.stderr)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,367 @@
+"""Local stand-in for the Vegvesen preregistration API and the Maskinporten token endpoint.
+
+    python mock_server.py [--port 8765] [--latency 0.05] [--throttle-rate 0.1] [--failure-rate 0.01]
+
+The "Local" environment in ecoc_service points at http://127.0.0.1:8765 (override with
+$EASY_ECOC_LOCAL_URL), so the GUI, CLI, batch and async clients can be exercised and
+benchmarked offline. Responses mimic the real shapes (iviIdentifikator, datoTid, melding).
+Latency, 429s, server errors and dropped connections can be injected. Assertions are
+decoded but not verified.
+
+mock_environment() starts a server on a free port and points the Local environment at
+it with a throwaway key and certificate, for scripts and benchmarks.
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+DEFAULT_PORT = 8765
+TOKEN_LIFETIME = 120
+
+_VIN_RE = re.compile(r"<VehicleIdentificationNumber>\s*([^<]*?)\s*</VehicleIdentificationNumber>")
+_DELETE_RE = re.compile(r"/slette/understellsnummer/([^/?]+)$")
+
+
+class MockState:
+    """Registrations, issued tokens, fault settings and request counters for one server."""
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0, rate_limit=None,
+                 retry_after=1, failure_rate=0.0, failure_status=503, drop_rate=0.0,
+                 token_lifetime=TOKEN_LIFETIME, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.drop_rate = drop_rate
+        self.token_lifetime = token_lifetime
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.registrations = {}  # iviReferanse -> VIN
+        self.vins = {}  # VIN -> iviReferanse
+        self.tokens = set()
+        self.counters = {}
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def roll(self, probability):
+        with self.lock:
+            return probability > 0 and self.random.random() < probability
+
+    def over_rate_limit(self):
+        """True when this request exceeds rate_limit requests per second (fixed one-second window)."""
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self.lock:
+                extra = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+            time.sleep(self.latency + extra)
+
+    def stats(self):
+        with self.lock:
+            return {"registrations": len(self.registrations), **self.counters}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoints
+    # Headers and body go out in separate writes; without TCP_NODELAY every response
+    # waits ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.state.count(f"status_{status}")
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _inject_faults(self):
+        """Apply latency and injected faults. Returns True when the request was answered."""
+        state = self.state
+        state.count("requests")
+        state.delay()
+        if state.roll(state.drop_rate):
+            state.count("dropped")
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return True
+        if state.over_rate_limit() or state.roll(state.throttle_rate):
+            self._send_json(429, {"melding": {"meldingstekst": "For mange forespørsler"}},
+                            {"Retry-After": str(state.retry_after)})
+            return True
+        if state.roll(state.failure_rate):
+            self._send_json(state.failure_status, {"melding": {"meldingstekst": "Intern feil"}})
+            return True
+        return False
+
+    def _authorized(self):
+        token = (self.headers.get("Authorization") or "").removeprefix("Bearer ").strip()
+        with self.state.lock:
+            if token in self.state.tokens:
+                return True
+        self._send_json(401, {"melding": {"meldingstekst": "Ugyldig eller manglende token"}})
+        return False
+
+    def do_GET(self):
+        if self.path == "/_mock/stats":
+            self._send_json(200, self.state.stats())
+        else:
+            self._send_json(404, {"melding": {"meldingstekst": "Ukjent adresse"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._inject_faults():
+            return
+        if self.path == "/token":
+            self._token(body)
+        elif self.path.endswith("/opprette"):
+            if self._authorized():
+                self._submit(body)
+        else:
+            self._send_json(404, {"melding": {"meldingstekst": "Ukjent adresse"}})
+
+    def do_DELETE(self):
+        self._read_body()
+        if self._inject_faults():
+            return
+        match = _DELETE_RE.search(self.path)
+        if not match:
+            self._send_json(404, {"melding": {"meldingstekst": "Ukjent adresse"}})
+        elif self._authorized():
+            self._delete(match.group(1))
+
+    def _token(self, body):
+        form = parse_qs(body.decode("utf-8"))
+        assertion = (form.get("assertion") or [""])[0]
+        grant_type = (form.get("grant_type") or [""])[0]
+        if grant_type != "urn:ietf:params:oauth:grant-type:jwt-bearer" or assertion.count(".") != 2:
+            self._send_json(400, {"error": "invalid_request", "error_description": "Missing JWT bearer assertion"})
+            return
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(assertion.split(".")[1] + "=="))
+        except ValueError:
+            self._send_json(400, {"error": "invalid_grant", "error_description": "Malformed assertion"})
+            return
+
+        access_token = f"mock-{uuid.uuid4().hex}"
+        with self.state.lock:
+            self.state.tokens.add(access_token)
+        self.state.count("tokens_issued")
+        self._send_json(200, {
+            "access_token": access_token,
+            "token_type": "Bearer",
+            "expires_in": self.state.token_lifetime,
+            "scope": payload.get("scope", ""),
+        })
+
+    def _submit(self, body):
+        try:
+            request = json.loads(body)
+            ivi_reference = request["ivi"]["iviReferanse"]
+            document = base64.b64decode(request["ivi"]["iviDokument"]).decode("utf-8")
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"melding": {"meldingstekst": "Ugyldig forespørsel"}})
+            return
+        match = _VIN_RE.search(document)
+        if not match or not match.group(1):
+            self._send_json(400, {"melding": {"meldingstekst": "Mangler VehicleIdentificationNumber"}})
+            return
+        vin = match.group(1)
+
+        with self.state.lock:
+            duplicate = ivi_reference in self.state.registrations or vin in self.state.vins
+            if not duplicate:
+                self.state.registrations[ivi_reference] = vin
+                self.state.vins[vin] = ivi_reference
+        if duplicate:
+            self._send_json(409, {"melding": {"meldingstekst": "IVI-referansen eller understellsnummeret er allerede registrert"}})
+            return
+
+        self.state.count("submitted")
+        self._send_json(200, {
+            "iviIdentifikator": {
+                "iviReferanse": ivi_reference,
+                "understellsnummerMerke": {"understellsnummer": vin},
+            },
+            "datoTid": datetime.now().isoformat(timespec="milliseconds"),
+            "melding": {"meldingstekst": "Melding om preregistrering er mottatt"},
+        })
+
+    def _delete(self, vin):
+        with self.state.lock:
+            ivi_reference = self.state.vins.pop(vin, None)
+            if ivi_reference is not None:
+                self.state.registrations.pop(ivi_reference, None)
+        if ivi_reference is None:
+            self._send_json(404, {"melding": {"meldingstekst": f"Fant ingen registrering for {vin}"}})
+            return
+        self.state.count("deleted")
+        self._send_json(200, {"melding": {"meldingstekst": f"Registreringen for {vin} er slettet"}})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, **options):
+        self.state = MockState(**options)
+        super().__init__((host, port), _Handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread. Returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    """Start a mock server in the background (port 0 picks a free port). Returns the MockServer."""
+    return MockServer(host, port, **options).start()
+
+
+def configure_local_client(directory):
+    """Prepare the Local environment to authenticate against a mock server.
+
+    Saves placeholder Samarbeidsportalen settings for Local (if none exist) and points
+    the client at a throwaway RSA key and certificate in directory, leaving the real
+    private_key.pem and virksomhet.cer untouched.
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    import ecoc_service as svc
+    import samarbeidsportalen
+
+    key_path = os.path.join(directory, "mock_private_key.pem")
+    cert_path = os.path.join(directory, "mock_virksomhet.cer")
+    if not os.path.exists(key_path):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        with open(key_path, "wb") as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM,
+                                      serialization.PrivateFormat.TraditionalOpenSSL,
+                                      serialization.NoEncryption()))
+        with open(cert_path, "w") as f:
+            f.write(base64.b64encode(b"mock certificate").decode("ascii") + "\n")
+
+    samarbeidsportalen.PRIVATE_KEY_FILE = key_path
+    samarbeidsportalen.CERTIFICATE_FILE = cert_path
+    samarbeidsportalen.invalidate_key_material()
+
+    previous = svc.get_environment()
+    svc.set_environment("Local")
+    if not svc.load_settings_from_db():
+        svc.save_settings_to_db("mock-client", "", "", "", "")
+    svc.set_environment(previous)
+
+
+@contextlib.contextmanager
+def mock_environment(directory, **options):
+    """Run a mock server and switch ecoc_service to the Local environment for the duration.
+
+    directory holds the throwaway key and certificate. Options are passed to MockState
+    (latency, jitter, throttle_rate, rate_limit, failure_rate, drop_rate, ...).
+    Yields the MockServer; the previous environment and key files are restored on exit.
+    """
+    import ecoc_service as svc
+    import samarbeidsportalen
+
+    previous = (svc.get_environment(), samarbeidsportalen.PRIVATE_KEY_FILE,
+                samarbeidsportalen.CERTIFICATE_FILE, samarbeidsportalen.LOCAL_BASE_URL)
+    server = start_mock_server(**options)
+    try:
+        svc.set_local_base_url(server.base_url)
+        configure_local_client(directory)
+        svc.set_environment("Local")
+        yield server
+    finally:
+        server.stop()
+        svc.set_local_base_url(previous[3])
+        samarbeidsportalen.PRIVATE_KEY_FILE, samarbeidsportalen.CERTIFICATE_FILE = previous[1:3]
+        samarbeidsportalen.invalidate_key_material()
+        svc.set_environment(previous[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Vegvesen and Maskinporten endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Requests per second before 429s")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of connections dropped without a reply")
+    parser.add_argument("--token-lifetime", type=int, default=TOKEN_LIFETIME)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    options = vars(args).copy()
+    host, port = options.pop("host"), options.pop("port")
+    server = MockServer(host, port, **options)
+    print(f"Mock Vegvesen/Maskinporten listening on {server.base_url} (Ctrl+C to stop)")
+    print(f"Use the Local environment; set EASY_ECOC_LOCAL_URL={server.base_url} if not the default.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.state.stats()))
+
+
+if __name__ == "__main__":
+    main()
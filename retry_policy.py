@@ -0,0 +1,188 @@
+"""Retries and adaptive rate limiting for Vegvesen calls.
+
+Every environment has one token bucket shared by all threads (and the asyncio client).
+Its rate grows additively while calls succeed and is halved on a 429, so a long batch
+settles just below the rate the server accepts instead of bursting into throttling.
+Failed calls are retried with jittered exponential backoff, and a Retry-After header
+pauses the whole bucket rather than just the call that received it.
+"""
+
+import random
+import threading
+import time
+
+import telemetry
+
+# Attempts per call, including the first
+MAX_ATTEMPTS = 5
+# Backoff before retry n is a random delay in [0, min(MAX_DELAY, BASE_DELAY * 2 ** n)]
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+
+# Requests per second: starting rate, bounds, and burst size
+INITIAL_RATE = 10.0
+MIN_RATE = 0.5
+MAX_RATE = 50.0
+BURST = 10
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def configure(max_attempts=None, base_delay=None, max_delay=None,
+              initial_rate=None, min_rate=None, max_rate=None, burst=None):
+    """Change the retry and rate settings. Existing limiters are reset so new settings apply."""
+    global MAX_ATTEMPTS, BASE_DELAY, MAX_DELAY, INITIAL_RATE, MIN_RATE, MAX_RATE, BURST
+    if max_attempts is not None:
+        MAX_ATTEMPTS = max_attempts
+    if base_delay is not None:
+        BASE_DELAY = base_delay
+    if max_delay is not None:
+        MAX_DELAY = max_delay
+    if initial_rate is not None:
+        INITIAL_RATE = initial_rate
+    if min_rate is not None:
+        MIN_RATE = min_rate
+    if max_rate is not None:
+        MAX_RATE = max_rate
+    if burst is not None:
+        BURST = burst
+    with _limiters_lock:
+        _limiters.clear()
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose rate adapts to throttling (additive increase, multiplicative decrease)."""
+
+    def __init__(self, rate=None, burst=None, min_rate=None, max_rate=None):
+        self.rate = rate or INITIAL_RATE
+        self.burst = burst or BURST
+        self.min_rate = min_rate or MIN_RATE
+        self.max_rate = max_rate or MAX_RATE
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token and return the seconds the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        wait = self.reserve()
+        if wait > 0:
+            # Our own throttling, not server time
+            telemetry.record("ratelimit.wait", wait)
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            # About +1 request/s for every second spent at the current rate
+            self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+    def on_throttled(self, retry_after=None):
+        """Halve the rate (at most once per second) and pause for retry_after seconds."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._last_decrease = now
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+
+def get_limiter(environment):
+    """Return the shared token bucket for an environment, creating it on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(environment)
+        if limiter is None:
+            limiter = _limiters[environment] = TokenBucket()
+        return limiter
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    import email.utils
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt (1-based), honouring Retry-After when larger."""
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, MAX_DELAY))
+    return delay
+
+
+def should_retry(status_code):
+    """True for responses worth retrying. None means the request failed without a response."""
+    return status_code is None or status_code in RETRY_STATUSES
+
+
+def retry_reason(response, error):
+    """Short label for why an attempt is retried: the HTTP status or the exception type."""
+    if response is not None:
+        return str(response.status_code)
+    return type(error).__name__ if error is not None else "unknown"
+
+
+def call_with_retry(send, environment, exceptions, before_attempt=None, retryable=None):
+    """Call send() until it returns a response that should not be retried, or attempts run out.
+
+    send() returns an object with status_code and headers, or raises one of exceptions.
+    retryable(error), if given, decides whether such an exception is retried; when it
+    returns False the call stops there. before_attempt(attempt), if given, runs before
+    every attempt; returning True stops without sending and gives (None, None). Otherwise
+    returns the last response (None when it never arrived) and the last exception.
+    """
+    limiter = get_limiter(environment)
+    response = error = None
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+            telemetry.increment("retries", environment=environment, reason=retry_reason(response, error))
+            with telemetry.span("retry.backoff"):
+                time.sleep(backoff_delay(attempt, retry_after))
+        if before_attempt is not None and before_attempt(attempt):
+            return None, None
+
+        limiter.acquire()
+        try:
+            response, error = send(), None
+        except exceptions as e:
+            response, error = None, e
+            if retryable is not None and not retryable(e):
+                break
+            continue
+
+        if response.status_code == 429:
+            telemetry.increment("throttled", environment=environment)
+            limiter.on_throttled(parse_retry_after(response.headers.get("Retry-After")))
+        elif not should_retry(response.status_code):
+            limiter.on_success()
+            return response, None
+    return response, error
@@ -1,46 +1,67 @@
 import os
-from jose import jwt
-import requests
 import uuid
-from time import time
+import threading
+from time import time, monotonic
 import sqlite3
 
+import http_session
+import telemetry
+from database import get_connection
+
+# Seconds before expiry at which a cached access token is refreshed (at most half its lifetime)
+TOKEN_REFRESH_MARGIN = 30
+
+# environment -> (access_token, monotonic refresh time); cleared when that environment's settings change
+_token_cache = {}
+_token_locks = {}
+_token_locks_guard = threading.Lock()
+
+# Base URL of the mock server (mock_server.py) behind the "Local" environment
+LOCAL_BASE_URL = os.environ.get("EASY_ECOC_LOCAL_URL", "http://127.0.0.1:8765")
+
+TOKEN_ENDPOINTS = {
+    "Test": "https://test.maskinporten.no/token",
+    "Production": "https://maskinporten.no/token",
+    "Local": f"{LOCAL_BASE_URL}/token",
+}
+
+PRIVATE_KEY_FILE = 'private_key.pem'
+CERTIFICATE_FILE = 'virksomhet.cer'
+
+# (file stamps, parsed signing key, x5c chain), reloaded when either file changes
+_key_material = None
+_key_material_lock = threading.Lock()
+
 
 def create_database():
-    conn = None
     try:
         print("Creating database...")
-        conn = sqlite3.connect('vegvesen_data.db')
-        c = conn.cursor()
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS samarbeidsportalen (
-            environment TEXT,
-            issuer TEXT,
-            audience TEXT,
-            resource TEXT,
-            scope TEXT,
-            kid TEXT
-        )
-        """)
-        # Migrate existing databases: add kid column if missing
-        c.execute("PRAGMA table_info(samarbeidsportalen)")
-        columns = [col[1] for col in c.fetchall()]
-        if "kid" not in columns:
-            c.execute("ALTER TABLE samarbeidsportalen ADD COLUMN kid TEXT")
-        conn.commit()
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS samarbeidsportalen (
+                environment TEXT,
+                issuer TEXT,
+                audience TEXT,
+                resource TEXT,
+                scope TEXT,
+                kid TEXT
+            )
+            """)
+            # Migrate existing databases: add kid column if missing
+            c.execute("PRAGMA table_info(samarbeidsportalen)")
+            columns = [col[1] for col in c.fetchall()]
+            if "kid" not in columns:
+                c.execute("ALTER TABLE samarbeidsportalen ADD COLUMN kid TEXT")
         print("Database created successfully.")
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
 def load_config_from_db(environment=None):
     try:
         print("Loading configuration from database...")
-        conn = sqlite3.connect('vegvesen_data.db')
-        c = conn.cursor()
+        c = get_connection().cursor()
         if environment:
             c.execute(
                 "SELECT environment, issuer, audience, resource, scope, kid FROM samarbeidsportalen WHERE environment = ? LIMIT 1", (environment,))
@@ -48,7 +69,6 @@ def load_config_from_db(environment=None):
             c.execute(
                 "SELECT environment, issuer, audience, resource, scope, kid FROM samarbeidsportalen LIMIT 1")
         row = c.fetchone()
-        conn.close()
 
         if row is not None:
             print(
@@ -67,37 +87,144 @@ def load_config_from_db(environment=None):
         print(f"Error loading configuration: {e}")
 
 
-# Create database if not exists
-create_database()
+def create_certificate_placeholder():
+    """Create an empty virksomhet.cer for the user to fill, if there is none."""
+    if not os.path.exists('virksomhet.cer'):
+        with open('virksomhet.cer', 'w') as cert_file:
+            cert_file.write('')
+        print("Created empty virksomhet.cer — import a .p12 certificate to populate it.")
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def invalidate_key_material():
+    """Forget the cached signing key and certificate chain, e.g. after writing new files."""
+    global _key_material
+    with _key_material_lock:
+        _key_material = None
+
+
+def load_key_material():
+    """Return (signing_key, x5c) parsed from private_key.pem and virksomhet.cer.
+
+    The parsed key object is cached and reused for every client assertion. The files
+    are only read again when their modification time or size changes.
+    """
+    global _key_material
+    from jose import jwk
+
+    stamps = (_file_stamp(PRIVATE_KEY_FILE), _file_stamp(CERTIFICATE_FILE))
+    with _key_material_lock:
+        if _key_material is not None and _key_material[0] == stamps:
+            return _key_material[1], _key_material[2]
+
+        with open(CERTIFICATE_FILE, 'r') as cert_file:
+            x5c = [line.strip() for line in cert_file if line.strip()]
+        with open(PRIVATE_KEY_FILE, 'r') as f:
+            signing_key = jwk.construct(f.read(), 'RS256')
+
+        _key_material = (stamps, signing_key, x5c)
+        return signing_key, x5c
+
+
+def _get_token_lock(key):
+    with _token_locks_guard:
+        lock = _token_locks.get(key)
+        if lock is None:
+            lock = _token_locks[key] = threading.Lock()
+        return lock
 
-# Load configurations from database
-config = load_config_from_db()
 
+def _get_cached_token(key):
+    entry = _token_cache.get(key)
+    if entry and monotonic() < entry[1]:
+        return entry[0]
+    return None
 
-if not os.path.exists('virksomhet.cer'):
-    with open('virksomhet.cer', 'w') as cert_file:
-        cert_file.write('')
-    print("Created empty virksomhet.cer — import a .p12 certificate to populate it.")
+
+def _cache_token(key, access_token, expires_in):
+    # Short-lived tokens would otherwise never be reused, so refresh them halfway through instead
+    margin = min(TOKEN_REFRESH_MARGIN, expires_in / 2)
+    _token_cache[key] = (access_token, monotonic() + expires_in - margin)
+
+
+def get_cached_access_token(environment=None):
+    """Return a still-valid cached token for an environment without touching disk or network."""
+    return _get_cached_token(environment)
+
+
+def invalidate_token_cache(environment=None):
+    """Drop cached access tokens, for one environment or all of them."""
+    if environment is None:
+        _token_cache.clear()
+    else:
+        _token_cache.pop(environment, None)
 
 
 def get_access_token(environment=None):
-    global config
-    config = load_config_from_db(environment)
+    """Return (access_token, error) for Maskinporten, reusing a cached token until shortly before expiry.
+
+    Exactly one of the two is set. A cache hit touches neither the database nor the
+    console. On a refresh the settings are read for this call only, so concurrent
+    refreshes for different environments cannot sign with each other's issuer or scope.
+    Concurrent callers for the same environment wait for a single refresh. Failures
+    are never cached.
+    """
+    access_token = _get_cached_token(environment)
+    if access_token:
+        telemetry.increment("token_cache_hits", environment=environment)
+        return access_token, None
+
+    with _get_token_lock(environment):
+        # Another caller may have refreshed the token while we waited
+        access_token = _get_cached_token(environment)
+        if access_token:
+            telemetry.increment("token_cache_hits", environment=environment)
+            return access_token, None
+
+        config = load_config_from_db(environment) or {}
+        with telemetry.span("token.fetch", environment=environment) as span:
+            access_token, expires_in, error = _request_access_token(environment, config)
+            span["ok"] = error is None
+        telemetry.increment("token_refreshes", environment=environment,
+                            outcome="error" if error else "ok")
+        if error:
+            return None, error
+        if expires_in:
+            _cache_token(environment, access_token, expires_in)
+        return access_token, None
+
+
+def _request_access_token(environment, config):
+    """Sign a client assertion with config's settings and exchange it for a token.
+
+    Returns (access_token, expires_in, None) when a token was granted, else (None, None, error).
+    """
+    import requests
+    from jose import jwt
+
     print("Getting access token...")
 
-    if not os.path.exists('virksomhet.cer') or os.path.getsize('virksomhet.cer') == 0:
+    if not config.get('issuer'):
+        print(f"No Samarbeidsportalen settings saved for {environment}.")
+        return None, None, f"No Samarbeidsportalen settings saved for {environment}. Fill them in on the Settings tab."
+
+    if not os.path.exists(CERTIFICATE_FILE) or os.path.getsize(CERTIFICATE_FILE) == 0:
         print("virksomhet.cer is missing or empty. Import a .p12 certificate first.")
-        return "virksomhet.cer is missing or empty. Import a .p12 certificate via the Certificate Import tab."
+        return None, None, "virksomhet.cer is missing or empty. Import a .p12 certificate via the Certificate Import tab."
 
-    if not os.path.exists('private_key.pem') or os.path.getsize('private_key.pem') == 0:
+    if not os.path.exists(PRIVATE_KEY_FILE) or os.path.getsize(PRIVATE_KEY_FILE) == 0:
         print("private_key.pem is missing or empty. Import a .p12 certificate first.")
-        return "private_key.pem is missing or empty. Import a .p12 certificate via the Certificate Import tab."
+        return None, None, "private_key.pem is missing or empty. Import a .p12 certificate via the Certificate Import tab."
 
-    with open('virksomhet.cer', 'r') as cert_file:
-        x5c = [line.strip() for line in cert_file if line.strip()]
-
-    with open("private_key.pem", "r") as f:
-        PRIVATE_KEY = f.read()
+    try:
+        signing_key, x5c = load_key_material()
+    except Exception as e:
+        print(f"Could not load the private key or certificate: {e}")
+        return None, None, f"Could not load the private key or certificate: {e}"
 
     # Prepare JWT header and payload
     header = {
@@ -120,36 +247,42 @@ def get_access_token(environment=None):
         "jti": str(uuid.uuid4()),
     }
 
-    # Create and sign the JWT
-    encoded_jwt = jwt.encode(payload, PRIVATE_KEY,
-                             algorithm='RS256', headers=header)
+    # Create and sign the JWT with the preloaded key (jose would otherwise reparse the PEM)
+    with telemetry.span("token.sign"):
+        encoded_jwt = jwt.encode(payload, signing_key,
+                                 algorithm='RS256', headers=header)
 
     # Make POST request to get the access token
-    if environment == "Test":
-        token_endpoint = "https://test.maskinporten.no/token"
-    else:
-        token_endpoint = "https://maskinporten.no/token"
+    token_endpoint = TOKEN_ENDPOINTS.get(environment, TOKEN_ENDPOINTS["Production"])
 
     print(f"Token endpoint: {token_endpoint}")
 
-    response = requests.post(token_endpoint, headers={
-        'Content-Type': 'application/x-www-form-urlencoded',
-    }, data={
-        'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
-        'assertion': encoded_jwt
-    })
+    try:
+        # Time spent here is Maskinporten's (plus the network)
+        with telemetry.span("token.http", environment=environment) as span:
+            response = http_session.get_session(environment).post(token_endpoint, headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+            }, data={
+                'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+                'assertion': encoded_jwt
+            }, timeout=http_session.get_timeout())
+            span["status"] = response.status_code
+    except requests.RequestException as e:
+        print(f"Token request failed: {e}")
+        return None, None, f"Token request failed: {e}"
 
     print(payload)
 
     # Print out the received access token or error
     if response.status_code == 200:
-        # print("Access Token:", response.json()['access_token'])
+        token_response = response.json()
+        # print("Access Token:", token_response['access_token'])
         print("Access Token Granted")
         # prints the first 10 characters of the token for checking
-        print(f"Access Token: {response.json()['access_token'][:10]}...")
+        print(f"Access Token: {token_response['access_token'][:10]}...")
 
-        return response.json()['access_token']
+        return token_response['access_token'], token_response.get('expires_in'), None
     else:
         print("Failed to retrieve access token:", response.content)
         # Failure status, and the error content
-        return (response.content.decode('utf-8'))
+        return None, None, f"HTTP {response.status_code}: {response.content.decode('utf-8', 'replace')}"
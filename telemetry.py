@@ -0,0 +1,205 @@
+"""Lightweight timing spans and counters for the submission pipeline.
+
+    with telemetry.span("vegvesen.submit", environment="Test") as s:
+        response = session.post(...)
+        s["status"] = response.status_code
+    telemetry.increment("retries", reason="429")
+
+Spans are timed with time.perf_counter() and aggregated per name (count, sum, max,
+histogram buckets). Recording costs a lock and a few additions, so it is always on.
+Exporters are optional:
+- EASY_ECOC_TRACE_FILE (or configure(jsonl_path=...)) appends one JSON line per span
+- EASY_ECOC_METRICS_FILE (or configure(prometheus_path=...)) writes a Prometheus
+  textfile-collector file, at most every PROMETHEUS_INTERVAL seconds and at exit
+
+Span names say whose time it is: token.* is Maskinporten, vegvesen.* is the Vegvesen
+API, and xml.*, db.* and ratelimit.* are local work.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+PROMETHEUS_PREFIX = "easy_ecoc"
+# Minimum seconds between Prometheus textfile rewrites
+PROMETHEUS_INTERVAL = 10.0
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_spans = {}  # name -> [count, sum, max, bucket counts...]
+_counters = {}  # (name, sorted label items) -> value
+_jsonl_path = os.environ.get("EASY_ECOC_TRACE_FILE")
+_prometheus_path = os.environ.get("EASY_ECOC_METRICS_FILE")
+_last_prometheus_write = 0.0
+# Held while the textfile is rewritten, so only one thread uses the temporary file at a time
+_prometheus_lock = threading.Lock()
+
+
+def configure(jsonl_path=None, prometheus_path=None):
+    """Enable the JSON-lines and/or Prometheus textfile exporters (None leaves a setting unchanged)."""
+    global _jsonl_path, _prometheus_path
+    if jsonl_path is not None:
+        _jsonl_path = jsonl_path or None
+    if prometheus_path is not None:
+        _prometheus_path = prometheus_path or None
+
+
+def reset():
+    """Drop all recorded spans and counters."""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def increment(name, value=1, **labels):
+    """Add value to the counter name with the given labels."""
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def record(name, seconds, **attributes):
+    """Record a finished span of the given duration."""
+    with _lock:
+        entry = _spans.get(name)
+        if entry is None:
+            entry = _spans[name] = [0, 0.0, 0.0] + [0] * len(BUCKETS)
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry[3 + i] += 1
+                break
+
+    if _jsonl_path:
+        _write_jsonl({"ts": round(time.time(), 6), "span": name,
+                      "ms": round(seconds * 1000, 3), **attributes})
+    if _prometheus_path and time.monotonic() - _last_prometheus_write >= PROMETHEUS_INTERVAL:
+        # Whoever gets the lock writes; the others carry on rather than queue up for the same rewrite
+        if _prometheus_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - _last_prometheus_write >= PROMETHEUS_INTERVAL:
+                    _write_prometheus(_prometheus_path)
+            finally:
+                _prometheus_lock.release()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as span name. Yields a dict for adding attributes along the way.
+
+    An exception escaping the block is recorded as attribute "error" and re-raised.
+    """
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        record(name, time.perf_counter() - started, **attributes)
+
+
+def snapshot():
+    """Return {"spans": {name: {count, total_s, mean_ms, max_ms}}, "counters": {...}}."""
+    with _lock:
+        spans = {
+            name: {
+                "count": entry[0],
+                "total_s": entry[1],
+                "mean_ms": entry[1] / entry[0] * 1000 if entry[0] else 0.0,
+                "max_ms": entry[2] * 1000,
+            }
+            for name, entry in _spans.items()
+        }
+        counters = {_format_key(name, labels): value for (name, labels), value in _counters.items()}
+    return {"spans": spans, "counters": counters}
+
+
+def format_snapshot():
+    """Render snapshot() as a small text table, slowest total first."""
+    data = snapshot()
+    lines = [f"{'span':<24} {'count':>7} {'mean ms':>9} {'max ms':>9} {'total s':>9}"]
+    for name, s in sorted(data["spans"].items(), key=lambda item: -item[1]["total_s"]):
+        lines.append(f"{name:<24} {s['count']:>7} {s['mean_ms']:9.2f} {s['max_ms']:9.2f} {s['total_s']:9.2f}")
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"{name} = {value}")
+    return "\n".join(lines)
+
+
+def _format_key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _write_jsonl(event):
+    line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+    try:
+        with _lock, open(_jsonl_path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError:
+        pass  # tracing must never break a submission
+
+
+def _metric_name(name):
+    return f"{PROMETHEUS_PREFIX}_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text():
+    """Return all spans and counters in the Prometheus text exposition format."""
+    with _lock:
+        spans = {name: list(entry) for name, entry in _spans.items()}
+        counters = dict(_counters)
+
+    metric = f"{PROMETHEUS_PREFIX}_span_seconds"
+    lines = [f"# HELP {metric} Duration of pipeline stages.", f"# TYPE {metric} histogram"]
+    for name, entry in sorted(spans.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, entry[3:]):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{span="{name}",le="+Inf"}} {entry[0]}')
+        lines.append(f'{metric}_sum{{span="{name}"}} {entry[1]:.6f}')
+        lines.append(f'{metric}_count{{span="{name}"}} {entry[0]}')
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {_metric_name(name)}_total counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+                lines.append(f"{_metric_name(name)}_total{label_text} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=None):
+    """Atomically write prometheus_text() to path (default: the configured textfile)."""
+    path = path or _prometheus_path
+    if not path:
+        return
+    with _prometheus_lock:
+        _write_prometheus(path)
+
+
+def _write_prometheus(path):
+    # Caller holds _prometheus_lock
+    global _last_prometheus_write
+    _last_prometheus_write = time.monotonic()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+@atexit.register
+def _flush_at_exit():
+    if _prometheus_path:
+        write_prometheus()
@@ -0,0 +1,60 @@
+"""Shared fixtures: a scratch database, a mock Vegvesen/Maskinporten server and IVI files."""
+
+import contextlib
+import os
+
+import pytest
+
+import database
+import ecoc_service as svc
+import mock_server
+import retry_policy
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "xml_templates", "Example.xml")
+
+# Stands in for the template's placeholder so the documents pass ivi_validator
+TYPE_APPROVAL_NUMBER = "e1*2018/858*00001"
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Point ecoc_service at a fresh database for the test."""
+    previous = database.DB_PATH
+    svc.set_database_path(str(tmp_path / "test.db"))
+    svc.create_database()
+    yield
+    svc.set_database_path(previous)
+
+
+@pytest.fixture
+def start_mock(db, tmp_path):
+    """Return start(**options), which runs a mock server behind the Local environment until the test ends."""
+    # Short backoffs, and limiters reset so one test's throttling does not slow the next
+    saved = (retry_policy.MAX_ATTEMPTS, retry_policy.BASE_DELAY, retry_policy.MAX_DELAY)
+    retry_policy.configure(base_delay=0.01, max_delay=0.05)
+    with contextlib.ExitStack() as stack:
+        yield lambda **options: stack.enter_context(mock_server.mock_environment(str(tmp_path), **options))
+    retry_policy.configure(*saved)
+
+
+@pytest.fixture
+def write_ivi(tmp_path):
+    """Return write(vin, name=None, folder="xml", placeholder=False), which writes an IVI file and returns its path.
+
+    With placeholder the template's TypeApprovalNumber placeholder is left in, so
+    ivi_validator rejects the file.
+    """
+    template = svc.read_ivi_text(TEMPLATE)
+
+    def write(vin, name=None, folder="xml", placeholder=False):
+        text = template.replace("WILL_BE_FILLED_IN_FROM_SOFTWARE", vin)
+        if not placeholder:
+            text = text.replace("THE_NGN_TYPE_APPROVALNUMBER", TYPE_APPROVAL_NUMBER)
+        directory = tmp_path / folder
+        directory.mkdir(exist_ok=True)
+        path = directory / (name or f"{vin}.xml")
+        path.write_text(text, encoding="utf-16")
+        return str(path)
+
+    return write
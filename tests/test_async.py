@@ -0,0 +1,44 @@
+import pytest
+
+import ecoc_service as svc
+
+# aiohttp is the optional "async" extra
+pytest.importorskip("aiohttp")
+import ecoc_async  # noqa: E402
+
+
+def submit(path):
+    return ecoc_async.submit_many([(path, svc.generate_ivi_ref_id(), "0", "0", "0")])[0]
+
+
+def test_registration_is_checked_before_every_retry(start_mock, write_ivi, monkeypatch):
+    server = start_mock()
+    assert svc.get_access_token("Local")[1] is None
+    path = write_ivi("TEST0000000000000")
+    server.state.failure_rate = 1.0
+    checks = []
+
+    def exists(column, value):
+        # Stored by another process while the first attempt failed
+        checks.append(value)
+        return len(checks) > 1
+
+    monkeypatch.setattr(svc, "check_if_exists_in_database", exists)
+
+    status, _ = submit(path)
+
+    assert status == "Already registered."
+    assert len(checks) == 2
+    assert server.state.stats()["status_503"] == 1
+
+
+def test_dropped_submission_is_not_resent(start_mock, write_ivi):
+    server = start_mock()
+    assert svc.get_access_token("Local")[1] is None
+    path = write_ivi("TEST0000000000000")
+    server.state.drop_rate = 1.0
+
+    status, _ = submit(path)
+
+    assert status == "Outcome unknown."
+    assert server.state.stats()["dropped"] == 1
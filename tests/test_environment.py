@@ -0,0 +1,25 @@
+import ecoc_service as svc
+
+
+def test_submit_stays_in_the_environment_it_started_with(start_mock, write_ivi):
+    server = start_mock()
+    path = write_ivi("TEST0000000000000")
+    # As if the user switched environment while the call was running
+    svc.set_environment("Production")
+
+    status, response = svc.fetch_vegvesen_data(path, svc.generate_ivi_ref_id(), "0", "0", "0", "Local")
+
+    assert status == "HTTP Status Code: 200"
+    assert server.state.stats()["registrations"] == 1
+
+
+def test_delete_stays_in_the_environment_it_started_with(start_mock, write_ivi):
+    server = start_mock()
+    path = write_ivi("TEST0000000000000")
+    assert svc.fetch_vegvesen_data(path, svc.generate_ivi_ref_id(), "0", "0", "0")[0] == "HTTP Status Code: 200"
+    svc.set_environment("Production")
+
+    success, status_code, _ = svc.delete_vegvesen_entry("TEST0000000000000", "Local")
+
+    assert (success, status_code) == (True, 200)
+    assert server.state.stats()["registrations"] == 0
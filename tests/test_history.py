@@ -0,0 +1,65 @@
+import database
+import ecoc_service as svc
+
+
+def add_registrations(count, date="2024-01-01T10:00:00", start=0):
+    """Insert count history rows that all share one timestamp, so only rowid orders them."""
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO responses (iviReferanse, understellsnummer, datoTid, meldingstekst) VALUES (?, ?, ?, ?)",
+            [(f"ref-{n:03d}", f"TEST{n:013d}", date, "Mottatt") for n in range(start, start + count)])
+
+
+def all_pages(limit):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = svc.get_responses_page(cursor, limit)
+        pages.append(rows)
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_once_newest_first(db):
+    add_registrations(5, "2024-01-01T10:00:00")
+    conn = database.get_connection()
+    with conn:
+        conn.execute("INSERT INTO responses (iviReferanse, understellsnummer, datoTid, meldingstekst) "
+                     "VALUES ('ref-new', 'TKNVN000000000000', '2024-02-01T10:00:00', 'Mottatt')")
+
+    pages = all_pages(limit=2)
+
+    assert [len(page) for page in pages] == [2, 2, 2]
+    rows = [row for page in pages for row in page]
+    assert rows[0][1:4] == ("ref-new", "TKNVN000000000000", "2024-02-01")
+    # Equal timestamps fall back to rowid, newest first, without repeats or gaps
+    assert [row[1] for row in rows[1:]] == [f"ref-{n:03d}" for n in reversed(range(5))]
+
+
+def test_last_full_page_has_no_cursor(db):
+    add_registrations(4)
+
+    assert [len(page) for page in all_pages(limit=2)] == [2, 2]
+    assert svc.get_responses_page(limit=10)[1] is None
+
+
+def test_rows_added_while_paging_do_not_shift_later_pages(db):
+    add_registrations(4)
+    first, cursor = svc.get_responses_page(limit=2)
+
+    add_registrations(1, "2024-03-01T10:00:00", start=4)
+    second, _ = svc.get_responses_page(cursor, limit=2)
+
+    assert [row[1] for row in first + second] == ["ref-003", "ref-002", "ref-001", "ref-000"]
+
+
+def test_incomplete_rows_are_not_listed(db):
+    add_registrations(1)
+    conn = database.get_connection()
+    with conn:
+        conn.execute("INSERT INTO responses (iviReferanse, understellsnummer, datoTid, meldingstekst) "
+                     "VALUES ('', 'TEST0000000000009', '2024-01-01T10:00:00', 'Mottatt')")
+
+    rows, cursor = svc.get_responses_page()
+
+    assert [row[1] for row in rows] == ["ref-000"] and cursor is None
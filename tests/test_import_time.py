@@ -0,0 +1,70 @@
+"""Import-time regression tests for the modules the CLI and GUI load at startup.
+
+Each module is imported in a fresh interpreter under ``python -X importtime`` from an
+empty working directory. The import must not load one of HEAVY_MODULES, create files,
+or take longer than its budget (best of RUNS imports).
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time budget in milliseconds (generous for slow CI runners)
+IMPORT_BUDGETS_MS = {
+    "database": 50,
+    "http_session": 50,
+    "retry_policy": 50,
+    "telemetry": 50,
+    "samarbeidsportalen": 100,
+    "ecoc_service": 200,
+    "main": 50,
+}
+
+# Packages that must only be imported when a function needs them
+HEAVY_MODULES = ("requests", "urllib3", "cryptography", "jose", "pyperclip", "aiohttp", "ttkbootstrap")
+
+# Imports per module; the fastest counts
+RUNS = 3
+
+
+def measure_import(module, cwd):
+    """Import module in a fresh interpreter. Returns (cumulative_ms, {top-level package: ms})."""
+    code = f"import sys; sys.path.insert(0, {ROOT!r}); import {module}"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=cwd, capture_output=True, text=True)
+    assert proc.returncode == 0, f"import {module} failed:\n{proc.stderr}"
+
+    packages = {}
+    total = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line.split("|")
+            cumulative_us = int(cumulative)
+        except ValueError:
+            continue  # header line
+        top = name.strip().split(".")[0]
+        packages[top] = max(packages.get(top, 0), cumulative_us / 1000)
+        if name.rstrip() == f" {module}":  # unindented: the import we asked for
+            total = cumulative_us / 1000
+    return (total if total is not None else packages.get(module, 0.0)), packages
+
+
+@pytest.mark.parametrize("module, budget_ms", IMPORT_BUDGETS_MS.items())
+def test_import_is_cheap_and_has_no_side_effects(module, budget_ms, tmp_path):
+    timings = []
+    for run in range(RUNS):
+        cwd = tmp_path / str(run)
+        cwd.mkdir()
+        elapsed, packages = measure_import(module, str(cwd))
+
+        assert not os.listdir(cwd), "import created files"
+        assert not [name for name in HEAVY_MODULES if name in packages], "import loads heavy packages"
+        timings.append(elapsed)
+
+    assert min(timings) <= budget_ms
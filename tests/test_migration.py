@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+
+import database
+import ecoc_service as svc
+
+DOCUMENTS = {
+    "TEST0000000000000": "<InitialVehicleInformation><VehicleIdentificationNumber>TEST0000000000000"
+                         "</VehicleIdentificationNumber></InitialVehicleInformation>",
+    "TEST0000000000001": "<InitialVehicleInformation><VehicleIdentificationNumber>TEST0000000000001"
+                         "</VehicleIdentificationNumber></InitialVehicleInformation>",
+}
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    """A database as written before the series: inline IviDoc text and no other tables or indexes."""
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE responses (iviReferanse TEXT, understellsnummer TEXT, datoTid TEXT, "
+                 "meldingstekst TEXT, IviDoc TEXT)")
+    conn.execute("CREATE TABLE samarbeidsportalen (environment TEXT, issuer TEXT, audience TEXT, "
+                 "resource TEXT, scope TEXT)")
+    conn.execute("INSERT INTO samarbeidsportalen VALUES ('Test', 'issuer', 'aud', 'res', 'scope')")
+    for n, (vin, text) in enumerate(DOCUMENTS.items()):
+        conn.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?)",
+                     (f"ref-{n}", vin, f"2024-01-0{n + 1}T10:00:00", "Melding om preregistrering er mottatt", text))
+    conn.commit()
+    conn.close()
+
+    previous = database.DB_PATH
+    svc.set_database_path(path)
+    yield path
+    svc.set_database_path(previous)
+
+
+def test_create_database_migrates_old_database(old_database):
+    svc.create_database()
+    # A second start finds nothing left to migrate
+    svc.create_database()
+
+    conn = database.get_connection()
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(responses)")}
+    assert "ividoc_hash" in columns
+    assert conn.execute("SELECT COUNT(*) FROM responses WHERE IviDoc IS NOT NULL").fetchone()[0] == 0
+    for vin, text in DOCUMENTS.items():
+        assert svc.get_ividoc_by_vin(vin) == text
+
+    settings_columns = {row[1] for row in conn.execute("PRAGMA table_info(samarbeidsportalen)")}
+    assert "kid" in settings_columns
+
+    assert svc.check_if_exists_in_database("vin", "TEST0000000000001")
+    assert [row[1] for row in svc.search_registrations("TEST0000000000000")] == ["ref-0"]
+    assert len(svc.search_registrations("preregistrering")) == 2
+    assert svc.get_outbox_counts() == {}
@@ -0,0 +1,146 @@
+import os
+
+import database
+import ecoc_service as svc
+import retry_policy
+
+
+def queue_vehicles(write_ivi, vins):
+    """Write a file per VIN, queue them all and return the outbox's IVI references in VIN order."""
+    paths = [write_ivi(vin) for vin in vins]
+    queued = svc.enqueue_submissions(svc.load_batch(os.path.dirname(paths[0])), write_back=False)
+    assert [error for _, _, error in queued] == [None] * len(vins)
+    return [ivi for _, ivi, _ in queued]
+
+
+def test_drain_sends_pending_rows(start_mock, write_ivi):
+    server = start_mock()
+    queue_vehicles(write_ivi, [f"TEST{i:013d}" for i in range(3)])
+    assert svc.get_outbox_counts() == {svc.OUTBOX_PENDING: 3}
+
+    summary = svc.drain_outbox(max_workers=2)
+
+    assert (summary["total"], summary["submitted"], summary["failed"]) == (3, 3, 0)
+    assert svc.get_outbox_counts() == {svc.OUTBOX_DONE: 3}
+    assert server.state.stats()["registrations"] == 3
+    assert all(svc.check_if_exists_in_database("vin", f"TEST{i:013d}") for i in range(3))
+
+
+def test_invalid_document_is_not_queued(db, write_ivi):
+    write_ivi("TEST0000000000000", placeholder=True)
+    path = write_ivi("TEST0000000000001")
+
+    queued = svc.enqueue_submissions(svc.load_batch(os.path.dirname(path)), write_back=False)
+
+    errors = {vehicle["vin"]: error for vehicle, _, error in queued}
+    assert errors["TEST0000000000000"].startswith("Validation failed")
+    assert errors["TEST0000000000001"] is None
+    assert svc.get_outbox_counts() == {svc.OUTBOX_PENDING: 1}
+
+
+def test_transient_failure_is_resent_and_counted_once(start_mock, write_ivi, monkeypatch):
+    server = start_mock()
+    # Leave retries to the outbox, so the failed send goes back to pending
+    monkeypatch.setattr(retry_policy, "MAX_ATTEMPTS", 1)
+    assert svc.get_access_token("Local")[1] is None
+    first, *_ = queue_vehicles(write_ivi, [f"TEST{i:013d}" for i in range(3)])
+    server.state.failure_rate = 1.0
+
+    def recover(done, total, result):
+        server.state.failure_rate = 0.0
+
+    summary = svc.drain_outbox(max_workers=1, progress_callback=recover)
+
+    assert (summary["total"], summary["submitted"], summary["failed"]) == (3, 3, 0)
+    assert len(summary["attempts"]) == 4
+    assert summary["attempts"][0]["state"] == svc.OUTBOX_PENDING
+    assert {r["iviReferanse"]: r["attempts"] for r in summary["results"]}[first] == 2
+    assert svc.get_outbox_counts() == {svc.OUTBOX_DONE: 3}
+
+
+def test_rejected_rows_fail_and_can_be_requeued(start_mock, write_ivi):
+    server = start_mock(failure_status=400)
+    # Fetch the token before the server starts refusing everything
+    assert svc.get_access_token("Local")[1] is None
+    server.state.failure_rate = 1.0
+    queue_vehicles(write_ivi, [f"TEST{i:013d}" for i in range(2)])
+
+    summary = svc.drain_outbox(max_workers=2)
+
+    assert (summary["submitted"], summary["failed"]) == (0, 2)
+    assert {r["status"] for r in summary["results"]} == {"HTTP Status Code: 400"}
+    assert svc.get_outbox_counts() == {svc.OUTBOX_FAILED: 2}
+
+    server.state.failure_rate = 0.0
+    assert svc.retry_failed_outbox() == 2
+    summary = svc.drain_outbox(max_workers=2)
+    assert summary["submitted"] == 2
+    assert svc.get_outbox_counts() == {svc.OUTBOX_DONE: 2}
+
+
+def test_recover_returns_in_flight_rows_to_pending(db, write_ivi):
+    queue_vehicles(write_ivi, [f"TEST{i:013d}" for i in range(2)])
+    claimed = svc.claim_outbox_rows(1)
+    assert len(claimed) == 1
+    assert svc.get_outbox_counts() == {svc.OUTBOX_PENDING: 1, svc.OUTBOX_IN_FLIGHT: 1}
+
+    # As after a crash mid-send: nothing was stored, so the row is sent again
+    assert svc.recover_outbox() == 2
+    assert svc.get_outbox_counts() == {svc.OUTBOX_PENDING: 2}
+
+
+def test_rows_are_only_sent_to_the_environment_they_were_queued_for(db, write_ivi):
+    previous = svc.get_environment()
+    svc.set_environment("Test")
+    try:
+        queue_vehicles(write_ivi, ["TEST0000000000000"])
+        svc.set_environment("Production")
+
+        assert svc.claim_outbox_rows(1) == []
+        assert svc.recover_outbox() == 0
+        assert svc.get_outbox_counts() == {}
+        assert svc.get_outbox_counts("Test") == {svc.OUTBOX_PENDING: 1}
+    finally:
+        svc.set_environment(previous)
+
+
+def test_documents_are_validated_before_the_write_transaction(db, write_ivi, monkeypatch):
+    validate = svc.validate_ivi_document
+    open_transactions = []
+
+    def checked(document):
+        open_transactions.append(database.get_connection().in_transaction)
+        return validate(document)
+
+    monkeypatch.setattr(svc, "validate_ivi_document", checked)
+
+    queue_vehicles(write_ivi, [f"TEST{i:013d}" for i in range(3)])
+
+    assert open_transactions == [False] * 3
+    assert svc.get_outbox_counts() == {svc.OUTBOX_PENDING: 3}
+
+
+def test_deleting_a_registration_keeps_documents_still_queued(db, write_ivi):
+    queue_vehicles(write_ivi, ["TEST0000000000000"])
+    conn = database.get_connection()
+    (doc_hash,) = conn.execute("SELECT ividoc_hash FROM outbox").fetchone()
+    with conn:
+        conn.execute("INSERT INTO responses (iviReferanse, understellsnummer, datoTid, meldingstekst, ividoc_hash) "
+                     "VALUES ('ref-0', 'TEST0000000000001', '2024-01-01T10:00:00', 'Mottatt', ?)", (doc_hash,))
+
+    svc.delete_responses_by_vins(["TEST0000000000001"])
+
+    assert svc.load_ivi_document(conn, doc_hash) is not None
+
+
+def test_missing_document_fails_the_row_with_a_clear_status(db, write_ivi):
+    queue_vehicles(write_ivi, ["TEST0000000000000"])
+    conn = database.get_connection()
+    with conn:
+        conn.execute("DELETE FROM ivi_documents")
+
+    summary = svc.drain_outbox()
+
+    (result,) = summary["results"]
+    assert (result["status"], result["attempts"]) == ("Stored IVI document is missing.", 1)
+    assert svc.get_outbox_counts() == {svc.OUTBOX_FAILED: 1}
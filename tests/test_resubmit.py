@@ -0,0 +1,76 @@
+import os
+
+import ecoc_service as svc
+
+VIN = "TEST0000000000000"
+
+
+def register(write_ivi):
+    """Submit the original document for VIN and return its IVI reference."""
+    path = write_ivi(VIN, folder="original")
+    summary = svc.submit_batch(svc.load_batch(os.path.dirname(path)), write_back=False)
+    assert summary["submitted"] == 1
+    return summary["results"][0]["iviReferanse"]
+
+
+def test_correction_replaces_registration(start_mock, write_ivi):
+    server = start_mock()
+    original = register(write_ivi)
+    path = write_ivi(VIN, folder="fixed")
+
+    summary = svc.resubmit_corrections(svc.load_batch(os.path.dirname(path)))
+
+    (result,) = summary["results"]
+    assert result["success"]
+    assert result["delete_status"] == "HTTP Status Code: 200"
+    assert result["iviReferanse"] != original
+    assert server.state.vins == {VIN: result["iviReferanse"]}
+    assert not svc.check_if_exists_in_database("ivi", original)
+    assert svc.check_if_exists_in_database("ivi", result["iviReferanse"])
+    # write_back defaults to on: the new reference is in the corrected file
+    assert result["iviReferanse"] in svc.read_ivi_text(path)
+
+
+def test_invalid_correction_keeps_registration(start_mock, write_ivi):
+    server = start_mock()
+    original = register(write_ivi)
+    path = write_ivi(VIN, folder="fixed", placeholder=True)
+
+    summary = svc.resubmit_corrections(svc.load_batch(os.path.dirname(path)))
+
+    (result,) = summary["results"]
+    assert not result["success"]
+    assert result["delete_status"] is None
+    assert result["status"].startswith("Validation failed")
+    assert "deleted" not in server.state.stats()
+    assert server.state.vins == {VIN: original}
+    assert svc.check_if_exists_in_database("ivi", original)
+
+
+def test_duplicate_vin_is_reported_and_left_alone(start_mock, write_ivi):
+    server = start_mock()
+    original = register(write_ivi)
+    write_ivi(VIN, name="a.xml", folder="fixed")
+    path = write_ivi(VIN, name="b.xml", folder="fixed")
+
+    summary = svc.resubmit_corrections(svc.load_batch(os.path.dirname(path)))
+
+    assert (summary["total"], summary["failed"]) == (2, 2)
+    assert sorted(os.path.basename(r["file"]) for r in summary["results"]) == ["a.xml", "b.xml"]
+    assert all("is also in" in r["status"] for r in summary["results"])
+    assert server.state.vins == {VIN: original}
+
+
+def test_unrelated_queued_rows_are_not_sent(start_mock, write_ivi):
+    server = start_mock()
+    original = register(write_ivi)
+    other = write_ivi("TEST0000000000001", folder="backlog")
+    svc.enqueue_submissions(svc.load_batch(os.path.dirname(other)), write_back=False)
+    path = write_ivi(VIN, folder="fixed")
+
+    summary = svc.resubmit_corrections(svc.load_batch(os.path.dirname(path)))
+
+    assert [r["vin"] for r in summary["results"]] == [VIN]
+    assert server.state.vins[VIN] != original
+    assert "TEST0000000000001" not in server.state.vins
+    assert svc.get_outbox_counts() == {svc.OUTBOX_DONE: 1, svc.OUTBOX_PENDING: 1}
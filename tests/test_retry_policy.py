@@ -0,0 +1,122 @@
+import email.utils
+import os
+import socket
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import ecoc_service as svc
+import http_session
+import retry_policy
+
+
+def response(status_code, retry_after=None):
+    return SimpleNamespace(status_code=status_code,
+                           headers={"Retry-After": retry_after} if retry_after is not None else {})
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record the delays retry_policy sleeps for instead of waiting."""
+    slept = []
+    monkeypatch.setattr(retry_policy.time, "sleep", slept.append)
+    retry_policy.configure()
+    yield slept
+    retry_policy.configure()
+
+
+def test_parse_retry_after():
+    assert retry_policy.parse_retry_after("7") == 7.0
+    assert retry_policy.parse_retry_after(None) is None
+    assert retry_policy.parse_retry_after("soon") is None
+    in_a_minute = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 <= retry_policy.parse_retry_after(in_a_minute) <= 60
+    assert retry_policy.parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT") == 0.0
+
+
+def test_backoff_honours_retry_after_up_to_max_delay():
+    assert retry_policy.backoff_delay(1, retry_after=4) >= 4
+    assert retry_policy.backoff_delay(1, retry_after=10 * retry_policy.MAX_DELAY) == retry_policy.MAX_DELAY
+
+
+def test_bucket_allows_a_burst_then_waits():
+    bucket = retry_policy.TokenBucket(rate=10, burst=3)
+
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+
+
+def test_bucket_halves_once_per_second_and_recovers():
+    bucket = retry_policy.TokenBucket(rate=8, burst=1, min_rate=1, max_rate=9)
+
+    bucket.on_throttled()
+    bucket.on_throttled()
+    assert bucket.rate == 4
+
+    bucket.on_success()
+    assert bucket.rate == 4.25
+    for _ in range(100):
+        bucket.on_success()
+    assert bucket.rate == 9
+
+
+def test_throttle_pauses_the_bucket_for_retry_after():
+    bucket = retry_policy.TokenBucket(rate=100, burst=10)
+
+    bucket.on_throttled(retry_after=2)
+
+    assert bucket.reserve() == pytest.approx(2, abs=0.05)
+
+
+def test_retry_after_delays_the_next_attempt(sleeps):
+    replies = iter([response(429, "3"), response(200)])
+
+    result, error = retry_policy.call_with_retry(lambda: next(replies), "Test", OSError)
+
+    assert (result.status_code, error) == (200, None)
+    # The backoff and the paused bucket both wait out the header
+    assert sum(sleeps) >= 3
+    assert retry_policy.get_limiter("Test").rate < retry_policy.INITIAL_RATE
+
+
+def test_errors_that_are_not_retryable_stop_at_once(sleeps):
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise TimeoutError("no answer")
+
+    result, error = retry_policy.call_with_retry(send, "Test", OSError, retryable=lambda e: False)
+
+    assert result is None and isinstance(error, TimeoutError)
+    assert len(calls) == 1
+
+
+def test_refused_connection_was_not_sent():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with pytest.raises(requests.ConnectionError) as refused:
+        requests.post(f"http://127.0.0.1:{port}/", timeout=1)
+
+    assert http_session.request_not_sent(refused.value)
+    assert not http_session.request_not_sent(requests.ReadTimeout("no answer"))
+
+
+def test_dropped_submission_is_not_resent(start_mock, write_ivi):
+    server = start_mock()
+    assert svc.get_access_token("Local")[1] is None
+    path = write_ivi("TEST0000000000000")
+    svc.enqueue_submissions(svc.load_batch(os.path.dirname(path)), write_back=False)
+    server.state.drop_rate = 1.0
+
+    summary = svc.drain_outbox()
+
+    (result,) = summary["results"]
+    assert result["status"] == "Outcome unknown."
+    assert result["state"] == svc.OUTBOX_UNKNOWN
+    assert server.state.stats()["dropped"] == 1
+    assert svc.get_outbox_counts() == {svc.OUTBOX_UNKNOWN: 1}
+    assert svc.recover_outbox() == 0
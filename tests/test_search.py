@@ -0,0 +1,62 @@
+import database
+import ecoc_service as svc
+
+REGISTRATIONS = [
+    # (iviReferanse, VIN, datoTid, meldingstekst), oldest first
+    ("aaaa-1111", "TKNVN000000000000", "2024-01-01T10:00:00", "Melding om preregistrering er mottatt"),
+    ("bbbb-2222", "TKNVN000000000001", "2024-01-02T10:00:00", "Melding om preregistrering er mottatt"),
+    ("cccc-3333", "WVWZZZ00000000000", "2024-01-03T10:00:00", "Avvist: ugyldig typegodkjenning TKNVN"),
+]
+
+
+def add_registrations():
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO responses (iviReferanse, understellsnummer, datoTid, meldingstekst) VALUES (?, ?, ?, ?)",
+            REGISTRATIONS)
+
+
+def references(rows):
+    return [row[1] for row in rows]
+
+
+def test_vin_prefix_is_case_insensitive(db):
+    add_registrations()
+
+    assert references(svc.search_registrations("tknvn00000000000")) == ["aaaa-1111", "bbbb-2222"]
+
+
+def test_prefix_hits_rank_before_text_hits(db):
+    add_registrations()
+
+    # Both VINs start with TKNVN; the third row only mentions it in its message
+    assert references(svc.search_registrations("TKNVN")) == ["aaaa-1111", "bbbb-2222", "cccc-3333"]
+
+
+def test_partial_reference_and_message_words_match(db):
+    add_registrations()
+
+    assert references(svc.search_registrations("CCCC")) == ["cccc-3333"]
+    # Text hits come newest first
+    assert references(svc.search_registrations("preregistrering")) == ["bbbb-2222", "aaaa-1111"]
+    assert references(svc.search_registrations("typegodkjenning")) == ["cccc-3333"]
+
+
+def test_limit_and_empty_term(db):
+    add_registrations()
+
+    assert len(svc.search_registrations("preregistrering", limit=1)) == 1
+    assert references(svc.search_registrations("  ")) == ["cccc-3333", "bbbb-2222", "aaaa-1111"]
+    assert svc.search_registrations("nothing-like-this") == []
+
+
+def test_substring_search_without_the_fts_index(db):
+    add_registrations()
+    conn = database.get_connection()
+    with conn:
+        # As on a SQLite build without FTS5
+        conn.execute("DROP TABLE responses_fts")
+
+    assert references(svc.search_registrations("typegodkjenning")) == ["cccc-3333"]
+    assert references(svc.search_registrations("preregistrering")) == ["bbbb-2222", "aaaa-1111"]
@@ -0,0 +1,62 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import ecoc_service as svc
+import ivi_templates
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "xml_templates", "Example.xml")
+
+
+def test_render_substitutes_fields_and_keeps_the_rest():
+    template = ivi_templates.compile_template(TEMPLATE, ["VehicleIdentificationNumber", "Make", "IVIReferenceId"])
+
+    root = ET.fromstring(template.render({"VehicleIdentificationNumber": "TEST0000000000000", "Make": "Volvo & Co",
+                                  "IVIReferenceId": "ref-1"}))
+
+    assert root.findtext(".//VehicleIdentificationNumber") == "TEST0000000000000"
+    assert root.findtext(".//Make") == "Volvo & Co"
+    assert root.findtext(".//IVIReferenceId") == "ref-1"
+    # Fields are reported in document order, whatever order they were asked for in
+    assert template.fields == ["IVIReferenceId", "VehicleIdentificationNumber", "Make"]
+    assert root.findtext(".//TypeApprovalNumber") == "THE_NGN_TYPE_APPROVALNUMBER"
+
+
+def test_missing_values_keep_the_template_text():
+    template = ivi_templates.compile_template(TEMPLATE)
+
+    root = ET.fromstring(template.render({"VehicleIdentificationNumber": ""}))
+
+    assert root.findtext(".//VehicleIdentificationNumber") == "WILL_BE_FILLED_IN_FROM_SOFTWARE"
+    assert root.findtext(".//IVIReferenceId") == "GENERER_BUTTON_CREATESTHIS"
+
+
+def test_rendering_matches_the_template_outside_the_fields():
+    text = svc.read_ivi_text(TEMPLATE)
+    template = ivi_templates.compile_template(TEMPLATE)
+
+    assert template.render({}) == text
+
+
+def test_unknown_and_non_leaf_fields_are_rejected():
+    with pytest.raises(ValueError, match="no <NoSuchElement>"):
+        ivi_templates.compile_template(TEMPLATE, ["NoSuchElement"])
+    with pytest.raises(ValueError, match="not a leaf element"):
+        ivi_templates.compile_template(TEMPLATE, ["AxleTable"])
+
+
+def test_render_csv_writes_one_file_per_row(tmp_path):
+    csv_path = tmp_path / "variants.csv"
+    csv_path.write_text("vin,Make\nTEST0000000000000,Volvo\nTEST0000000000001,\n", encoding="utf-8")
+
+    written = ivi_templates.render_csv(TEMPLATE, str(csv_path), str(tmp_path / "out"))
+
+    assert [os.path.basename(path) for path in written] == ["TEST0000000000000.xml", "TEST0000000000001.xml"]
+    first, second = (ET.fromstring(svc.read_ivi_text(path)) for path in written)
+    assert first.findtext(".//Make") == "Volvo"
+    assert second.findtext(".//Make") == "The Make of your vehicle"
+    # Every document gets its own fresh IVI reference
+    references = {root.findtext(".//IVIReferenceId") for root in (first, second)}
+    assert len(references) == 2 and "GENERER_BUTTON_CREATESTHIS" not in references
@@ -0,0 +1,60 @@
+import os
+
+import ecoc_service as svc
+import samarbeidsportalen
+
+
+def test_missing_settings_are_an_error(db):
+    samarbeidsportalen.invalidate_token_cache("Test")
+
+    access_token, error = svc.get_access_token("Test")
+
+    assert access_token is None
+    assert error.startswith("No Samarbeidsportalen settings saved for Test")
+
+
+def test_throttled_token_endpoint_is_reported_and_not_used(start_mock, write_ivi):
+    server = start_mock(throttle_rate=1.0)
+    path = write_ivi("TEST0000000000000")
+
+    status, response = svc.fetch_vegvesen_data(path, svc.generate_ivi_ref_id(), "0", "0", "0")
+
+    assert status == "Could not get an access token."
+    assert response.startswith("HTTP 429")
+    stats = server.state.stats()
+    # The error body was never sent as a bearer token
+    assert stats["requests"] == 1 and "status_401" not in stats
+    assert samarbeidsportalen.get_cached_access_token("Local") is None
+
+
+def test_failed_token_is_not_cached(start_mock):
+    server = start_mock(throttle_rate=1.0)
+    assert svc.get_access_token("Local")[0] is None
+
+    server.state.throttle_rate = 0.0
+    access_token, error = svc.get_access_token("Local")
+
+    assert error is None
+    assert access_token.startswith("mock-")
+    assert samarbeidsportalen.get_cached_access_token("Local") == access_token
+
+
+def test_delete_reports_token_failure(start_mock):
+    start_mock(throttle_rate=1.0)
+
+    success, status_code, message = svc.delete_vegvesen_entry("TEST0000000000000")
+
+    assert (success, status_code) == (False, None)
+    assert message.startswith("Could not get an access token.")
+
+
+def test_short_lived_token_is_used_and_reused(start_mock, write_ivi):
+    # Shorter than TOKEN_REFRESH_MARGIN, so only the halved margin keeps it usable
+    server = start_mock(token_lifetime=20)
+    path = write_ivi("TEST0000000000000")
+    write_ivi("TEST0000000000001")
+
+    summary = svc.submit_batch(svc.load_batch(os.path.dirname(path)), max_workers=2, write_back=False)
+
+    assert (summary["submitted"], summary["failed"]) == (2, 0)
+    assert server.state.stats()["tokens_issued"] == 1
@@ -0,0 +1,77 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import ivi_validator
+from ivi_validator import ERROR, WARNING
+
+VIN = "TEST0000000000000"
+
+
+@pytest.fixture
+def document(write_ivi):
+    """Return the parsed root of a valid IVI document for VIN."""
+    with open(write_ivi(VIN), encoding="utf-16") as f:
+        return ET.fromstring(f.read())
+
+
+def issues(root, rule):
+    return [(issue.severity, issue.message) for issue in ivi_validator.Validator().validate_root(root)
+            if issue.rule == rule]
+
+
+def set_text(root, tag, value):
+    root.find(f".//{tag}").text = value
+
+
+def test_template_document_has_no_errors(document):
+    assert not ivi_validator.has_errors(ivi_validator.Validator().validate_root(document))
+
+
+def test_placeholders_are_errors_except_where_the_app_fills_them(document):
+    set_text(document, "TypeApprovalNumber", "THE_NGN_TYPE_APPROVALNUMBER")
+    set_text(document, "VehicleIdentificationNumber", "WILL_BE_FILLED_IN_FROM_SOFTWARE")
+
+    errors = [message for severity, message in issues(document, "placeholder") if severity == ERROR]
+    assert errors == [
+        "<VehicleIdentificationNumber> still holds the template placeholder WILL_BE_FILLED_IN_FROM_SOFTWARE.",
+        "<TypeApprovalNumber> still holds the template placeholder THE_NGN_TYPE_APPROVALNUMBER.",
+    ]
+    # The template's IVIReferenceId placeholder is replaced at submission time
+    assert document.findtext(".//IVIReferenceId") == "GENERER_BUTTON_CREATESTHIS"
+
+
+def test_template_sample_values_are_only_warnings(document):
+    assert issues(document, "placeholder") == [
+        (WARNING, "<Make> still holds the template sample value 'The Make of your vehicle'."),
+        (WARNING, "<CommercialName> still holds the template sample value 'CommercialName'."),
+    ]
+
+    set_text(document, "Make", "Tesla")
+    assert [message for _, message in issues(document, "placeholder")] == [
+        "<CommercialName> still holds the template sample value 'CommercialName'."]
+
+
+def test_axle_count_must_match_the_axle_table(document):
+    set_text(document, "NumberOfAxles", "3")
+
+    assert issues(document, "axles") == [(ERROR, "NumberOfAxles is 3 but AxleTable has 2 AxleGroup(s).")]
+
+
+def test_axle_count_must_be_a_positive_number(document):
+    set_text(document, "NumberOfAxles", "0")
+
+    assert issues(document, "axles") == [(ERROR, "NumberOfAxles 0 is not a positive whole number.")]
+
+
+def test_axle_numbers_must_run_in_order(document):
+    document.findall(".//AxleNumber")[1].text = "3"
+
+    assert issues(document, "axles") == [(ERROR, "AxleNumber values 1, 3 should run 1..2 in order.")]
+
+
+def test_steered_axle_mismatch_is_a_warning(document):
+    set_text(document, "NumberOfSteeredAxles", "2")
+
+    assert issues(document, "axles") == [
+        (WARNING, "NumberOfSteeredAxles is 2 but 1 axle(s) have SteeredAxleInd Y.")]
@@ -0,0 +1,66 @@
+import os
+
+import xml_index
+
+
+def test_rescan_only_parses_new_and_changed_files(db, write_ivi, monkeypatch):
+    first = write_ivi("TEST0000000000000")
+    second = write_ivi("TEST0000000000001")
+    folder = os.path.dirname(first)
+    assert xml_index.scan_directory(folder)["scanned"] == 2
+
+    parsed = []
+    extract = xml_index.extract_fields
+    monkeypatch.setattr(xml_index, "extract_fields", lambda path: parsed.append(path) or extract(path))
+
+    summary = xml_index.scan_directory(folder)
+    assert (summary["scanned"], summary["unchanged"], parsed) == (0, 2, [])
+
+    # Same size, new content: only the mtime tells the scanner it changed
+    write_ivi("TEST0000000000002", name=os.path.basename(second))
+    stat = os.stat(second)
+    os.utime(second, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    third = write_ivi("TEST0000000000003", folder="xml/sub")
+
+    summary = xml_index.scan_directory(folder)
+
+    assert (summary["scanned"], summary["unchanged"]) == (2, 1)
+    assert sorted(parsed) == sorted([second, third])
+    assert [f["path"] for f in xml_index.find_files("TEST0000000000002")] == [second]
+    assert xml_index.find_files("TEST0000000000001") == []
+
+
+def test_removed_files_are_dropped(db, write_ivi):
+    first = write_ivi("TEST0000000000000")
+    write_ivi("TEST0000000000001")
+    folder = os.path.dirname(first)
+    xml_index.scan_directory(folder)
+
+    os.remove(first)
+    summary = xml_index.scan_directory(folder)
+
+    assert (summary["files"], summary["removed"]) == (1, 1)
+    assert xml_index.find_files("TEST0000000000000") == []
+    assert [f["vin"] for f in xml_index.find_files("TEST", prefix=True)] == ["TEST0000000000001"]
+
+
+def test_non_recursive_scan_leaves_subfolders_indexed(db, write_ivi):
+    top = write_ivi("TEST0000000000000")
+    nested = write_ivi("TEST0000000000001", folder="xml/sub")
+    folder = os.path.dirname(top)
+    xml_index.scan_directory(folder)
+
+    summary = xml_index.scan_directory(folder, recursive=False)
+
+    assert (summary["files"], summary["removed"]) == (1, 0)
+    assert [f["path"] for f in xml_index.find_files("TEST0000000000001")] == [nested]
+
+
+def test_unreadable_files_are_indexed_with_their_error(db, tmp_path):
+    folder = tmp_path / "xml"
+    folder.mkdir()
+    (folder / "broken.xml").write_text("<InitialVehicleInformation>", encoding="utf-8")
+
+    summary = xml_index.scan_directory(str(folder))
+
+    assert (summary["scanned"], summary["errors"]) == (1, 1)
@@ -0,0 +1,212 @@
+"""Watch an inbox folder and submit every IVI XML file dropped into it.
+
+    python main.py --env Test watch path/to/inbox [--workers N] [--max-pending N]
+
+The inbox is polled every POLL_INTERVAL seconds. A file is picked up once its size and
+modification time have not changed for SETTLE_SECONDS, so files still being written
+are left alone. Each file is then:
+
+1. moved to <inbox>/processing, read, validated and queued in the outbox with a fresh
+   IVI reference (written back into the file unless write_back is off);
+2. sent by one of the outbox workers, with retry_policy's retries and rate limiting;
+3. moved to <inbox>/done, or to <inbox>/failed next to a .error.txt with the reason.
+
+At most max_pending files are taken from the inbox at a time. When Vegvesen throttles or
+slows down, sends take longer, the processing folder fills up, and new files simply
+wait in the inbox until there is room. On start, files left in processing by an earlier
+run are settled from their outbox state, or returned to the inbox if they were never queued.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import ecoc_service as svc
+import telemetry
+from database import get_connection
+
+# Seconds between scans of the inbox
+POLL_INTERVAL = 1.0
+# Seconds a file's size and mtime must stay unchanged before it is picked up
+SETTLE_SECONDS = 2.0
+# Files taken from the inbox but not yet done or failed
+MAX_PENDING = 20
+
+PROCESSING_DIR = "processing"
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+
+
+class FolderWatcher:
+    """Polls one inbox and feeds its files through the outbox. Call run() to start."""
+
+    def __init__(self, inbox, max_workers=svc.BATCH_WORKERS, max_pending=MAX_PENDING,
+                 settle_seconds=SETTLE_SECONDS, poll_interval=POLL_INTERVAL,
+                 avgiftskode="0", sitteplasser="0", sengeplasser="0", write_back=True):
+        self.inbox = os.path.abspath(inbox)
+        self.processing = os.path.join(self.inbox, PROCESSING_DIR)
+        self.done = os.path.join(self.inbox, DONE_DIR)
+        self.failed = os.path.join(self.inbox, FAILED_DIR)
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.defaults = {"avgiftskode": avgiftskode, "sitteplasser": sitteplasser,
+                         "sengeplasser": sengeplasser}
+        self.write_back = write_back
+        # Files are queued for, and only sent to, the environment selected when the watcher was made
+        self.environment = svc.get_environment()
+        self._seen = {}  # inbox path -> ((size, mtime_ns), monotonic time first seen unchanged)
+        self.counts = {"done": 0, "failed": 0}
+
+    # --- Files ---
+
+    def _candidates(self):
+        """Return inbox .xml files that have stopped changing, oldest first."""
+        now = time.monotonic()
+        seen = {}
+        ready = []
+        try:
+            entries = list(os.scandir(self.inbox))
+        except OSError as e:
+            logging.error(f"Cannot read inbox {self.inbox}: {e}")
+            return []
+        for entry in entries:
+            name = entry.name
+            if not name.lower().endswith(".xml") or name.startswith((".", "~")):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            previous = self._seen.get(entry.path)
+            since = previous[1] if previous and previous[0] == stamp else now
+            seen[entry.path] = (stamp, since)
+            if stat.st_size and now - since >= self.settle_seconds:
+                ready.append((stat.st_mtime_ns, entry.path))
+        self._seen = seen
+        return [path for _, path in sorted(ready)]
+
+    @staticmethod
+    def _move(path, directory):
+        """Move path into directory, adding a suffix if the name is taken. Returns the new path."""
+        name, ext = os.path.splitext(os.path.basename(path))
+        target = os.path.join(directory, name + ext)
+        n = 1
+        while os.path.exists(target):
+            target = os.path.join(directory, f"{name}.{n}{ext}")
+            n += 1
+        os.replace(path, target)
+        return target
+
+    def _finish(self, path, success, status):
+        """Move a processed file to done or failed and count it."""
+        outcome = "done" if success else "failed"
+        try:
+            target = self._move(path, self.done if success else self.failed)
+            if not success:
+                with open(target + ".error.txt", "w", encoding="utf-8") as f:
+                    f.write(f"{status}\n")
+        except OSError as e:
+            logging.error(f"Watch: could not move {path} to {outcome}: {e}")
+            return
+        self.counts[outcome] += 1
+        telemetry.increment("watch_files", outcome=outcome)
+        print(f"{'OK  ' if success else 'FAIL'} {os.path.basename(path)}  {status}")
+        logging.info(f"Watch: {path} -> {outcome}: {status}")
+
+    def _pending_count(self):
+        try:
+            return sum(1 for name in os.listdir(self.processing) if name.lower().endswith(".xml"))
+        except OSError:
+            return 0
+
+    # --- Pipeline ---
+
+    def _ingest(self, path):
+        """Claim one settled inbox file and queue it. Returns True if it was queued."""
+        try:
+            claimed = self._move(path, self.processing)
+        except OSError:
+            return False  # still locked by the writer, or already taken
+        self._seen.pop(path, None)
+
+        try:
+            vin = svc.read_vehicle_identification_number(claimed)
+            queued = svc.enqueue_submissions([{"file": claimed, "vin": vin, **self.defaults}], self.write_back)
+            vehicle, iviref_uid, error = queued[0]
+        except Exception as e:
+            # Fail the file rather than the daemon, or a restart would pick it up and crash again
+            logging.error(f"Watch: could not queue {claimed}: {e}")
+            self._finish(claimed, False, f"Error: {e}")
+            return False
+        if error:
+            self._finish(claimed, False, error)
+            return False
+        logging.info(f"Watch: queued {claimed} as {iviref_uid}")
+        return True
+
+    def _recover(self):
+        """Settle files left in processing by an earlier run."""
+        svc.recover_outbox(self.environment)
+        conn = get_connection()
+        for name in sorted(os.listdir(self.processing)):
+            path = os.path.join(self.processing, name)
+            if not name.lower().endswith(".xml"):
+                continue
+            row = conn.execute(
+                "SELECT state, last_status FROM outbox WHERE file_path = ? AND environment = ? "
+                "ORDER BY created_at DESC LIMIT 1", (path, self.environment)).fetchone()
+            if row is None:
+                self._move(path, self.inbox)  # never queued; start over
+            elif row[0] == svc.OUTBOX_DONE:
+                self._finish(path, True, row[1] or "Already registered.")
+            elif row[0] in (svc.OUTBOX_FAILED, svc.OUTBOX_UNKNOWN):
+                self._finish(path, False, row[1])
+            # pending rows are sent by the normal loop
+
+    def run(self, stop_event=None):
+        """Watch until stop_event is set (or KeyboardInterrupt). Returns the done/failed counts."""
+        for directory in (self.processing, self.done, self.failed):
+            os.makedirs(directory, exist_ok=True)
+        self._recover()
+        print(f"Watching {self.inbox} ({self.max_workers} worker(s), up to {self.max_pending} pending)")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = set()
+            next_poll = 0.0
+            while not (stop_event is not None and stop_event.is_set()):
+                if time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + self.poll_interval
+                    room = self.max_pending - self._pending_count()
+                    for path in self._candidates()[:max(0, room)]:
+                        self._ingest(path)
+
+                for row in svc.claim_outbox_rows(self.max_workers - len(in_flight), self.environment):
+                    in_flight.add(executor.submit(svc.send_outbox_row, row))
+
+                timeout = max(0.0, next_poll - time.monotonic())
+                if not in_flight:
+                    if stop_event is not None:
+                        stop_event.wait(timeout)
+                    else:
+                        time.sleep(timeout)
+                    continue
+                finished, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    if result["state"] == svc.OUTBOX_PENDING:
+                        continue  # transient failure; resent on a later pass
+                    if os.path.dirname(result["file"]) == self.processing and os.path.exists(result["file"]):
+                        self._finish(result["file"], result["state"] == svc.OUTBOX_DONE, result["status"])
+
+            # Let sends already started finish and settle their files
+            for future in in_flight:
+                result = future.result()
+                if result["state"] != svc.OUTBOX_PENDING and os.path.dirname(result["file"]) == self.processing:
+                    self._finish(result["file"], result["state"] == svc.OUTBOX_DONE, result["status"])
+        return dict(self.counts)
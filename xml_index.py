@@ -0,0 +1,200 @@
+"""Index of the IVI XML files in shared folders, so a vehicle's file can be found by VIN.
+
+    python xml_index.py scan <folder> [--workers N]
+    python xml_index.py find <vin or VIN prefix>
+
+scan_directory() walks a folder and extracts the VIN, IVI reference and key CoC fields
+from each .xml file in a process pool, storing them in the xml_files table of the main
+database. Files whose mtime and size are unchanged since the last scan are not opened
+again, and files that have disappeared are dropped. find_files() answers from the
+index alone and flags files whose VIN is already registered in responses.
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+from database import get_connection
+from ecoc_service import create_database, read_ivi_text
+
+# Element -> xml_files column, in the order the columns are stored
+INDEX_FIELDS = {
+    "VehicleIdentificationNumber": "vin",
+    "IVIReferenceId": "ivi_reference",
+    "VehicleCategoryCode": "category",
+    "TypeApprovalNumber": "type_approval_number",
+    "Make": "make",
+    "CommercialName": "commercial_name",
+    "DateOfManufactureVeh": "manufactured",
+}
+COLUMNS = tuple(INDEX_FIELDS.values())
+
+# Below this many changed files, extraction runs in-process instead of starting a pool
+POOL_THRESHOLD = 50
+# Default and maximum number of files returned by find_files()
+FIND_LIMIT = 50
+
+
+def extract_fields(file_path):
+    """Return (file_path, {column: text}, error) for one file.
+
+    Parsing streams the file and stops once every INDEX_FIELDS element has been seen.
+    Files whose bytes do not match their declared encoding fall back to read_ivi_text().
+    """
+    fields = {}
+    try:
+        try:
+            with open(file_path, "rb") as f:
+                for _, elem in ET.iterparse(f, events=("end",)):
+                    column = INDEX_FIELDS.get(elem.tag)
+                    if column and column not in fields:
+                        fields[column] = (elem.text or "").strip() or None
+                        if len(fields) == len(INDEX_FIELDS):
+                            break
+                    elem.clear()
+        except ET.ParseError:
+            fields = {}
+            root = ET.fromstring(read_ivi_text(file_path))
+            for tag, column in INDEX_FIELDS.items():
+                elem = next(root.iter(tag), None)
+                if elem is not None:
+                    fields[column] = (elem.text or "").strip() or None
+    except (OSError, UnicodeDecodeError, ET.ParseError) as e:
+        return file_path, {}, str(e)
+    return file_path, fields, None
+
+
+def _walk(directory, recursive):
+    """Yield (path, mtime_ns, size) for each .xml file under directory."""
+    pending = [directory]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            pending.append(entry.path)
+                    elif entry.name.lower().endswith(".xml") and entry.is_file():
+                        stat = entry.stat()
+                        yield entry.path, stat.st_mtime_ns, stat.st_size
+                except OSError:
+                    continue
+
+
+def _extract_all(paths, max_workers):
+    if len(paths) < POOL_THRESHOLD or max_workers == 1:
+        return map(extract_fields, paths)
+    workers = max_workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        return list(executor.map(extract_fields, paths, chunksize=max(1, len(paths) // (workers * 4))))
+    finally:
+        executor.shutdown()
+
+
+def scan_directory(directory, max_workers=None, recursive=True):
+    """Bring the index up to date for directory. Returns a summary dict.
+
+    Only new and changed files are parsed; the index is updated in one transaction.
+    """
+    started = time.monotonic()
+    directory = os.path.abspath(directory)
+    prefix = os.path.join(directory, "")
+    seen = {path: (mtime_ns, size) for path, mtime_ns, size in _walk(directory, recursive)}
+
+    conn = get_connection()
+    known = {path: (mtime_ns, size) for path, mtime_ns, size in conn.execute(
+        "SELECT path, mtime_ns, size FROM xml_files WHERE path >= ? AND path < ?",
+        (prefix, prefix + "\uffff"))}
+    if not recursive:
+        known = {path: stamp for path, stamp in known.items() if os.path.dirname(path) == directory}
+    changed = [path for path, stamp in seen.items() if known.get(path) != stamp]
+    removed = [path for path in known if path not in seen]
+
+    errors = 0
+    rows = []
+    for path, fields, error in _extract_all(changed, max_workers):
+        errors += error is not None
+        if fields.get("vin"):
+            fields["vin"] = fields["vin"].upper()
+        mtime_ns, size = seen[path]
+        rows.append((path, mtime_ns, size, *(fields.get(column) for column in COLUMNS), error))
+
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO xml_files (path, mtime_ns, size, {', '.join(COLUMNS)}, error) "
+            f"VALUES ({', '.join('?' * (len(COLUMNS) + 4))})", rows)
+        conn.executemany("DELETE FROM xml_files WHERE path = ?", ((path,) for path in removed))
+
+    return {
+        "directory": directory,
+        "files": len(seen),
+        "scanned": len(changed),
+        "unchanged": len(seen) - len(changed),
+        "removed": len(removed),
+        "errors": errors,
+        "elapsed": time.monotonic() - started,
+    }
+
+
+def find_files(vin, limit=FIND_LIMIT, prefix=False):
+    """Return indexed files for a VIN (or VIN prefix) as dicts, newest file first.
+
+    Each dict has the path, the INDEX_FIELDS columns and "registered": whether the VIN
+    already has a response stored.
+    """
+    vin = vin.strip().upper()
+    if not vin:
+        return []
+    where, params = ("x.vin >= ? AND x.vin < ?", [vin, vin + "\uffff"]) if prefix else ("x.vin = ?", [vin])
+    rows = get_connection().execute(
+        f"SELECT x.path, {', '.join('x.' + c for c in COLUMNS)}, "
+        "EXISTS (SELECT 1 FROM responses r WHERE r.understellsnummer = x.vin) "
+        f"FROM xml_files x WHERE {where} ORDER BY x.mtime_ns DESC LIMIT ?",
+        params + [limit]).fetchall()
+    return [{"path": row[0], **dict(zip(COLUMNS, row[1:-1])), "registered": bool(row[-1])} for row in rows]
+
+
+def format_files(files):
+    lines = []
+    for f in files:
+        mark = "REGISTERED" if f["registered"] else "new       "
+        lines.append(f"{mark} {f['vin']}  {f['category'] or '-'}  {f['make'] or '-'}  {f['path']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index IVI XML files and find them by VIN.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("scan", help="Scan a folder (recursively) into the index")
+    p.add_argument("directory")
+    p.add_argument("-w", "--workers", type=int, default=None, help="Processes to use")
+    p.add_argument("--no-recursive", dest="recursive", action="store_false")
+    p = sub.add_parser("find", help="Find indexed files by VIN")
+    p.add_argument("vin")
+    p.add_argument("--prefix", action="store_true", help="Match VINs starting with vin")
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        create_database()
+    if args.command == "scan":
+        s = scan_directory(args.directory, args.workers, args.recursive)
+        print(f"{s['files']} file(s): {s['scanned']} scanned, {s['unchanged']} unchanged, "
+              f"{s['removed']} removed, {s['errors']} unreadable in {s['elapsed']:.2f}s")
+        return 0
+    files = find_files(args.vin, prefix=args.prefix)
+    if files:
+        print(format_files(files))
+    return 0 if files else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())